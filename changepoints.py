@@ -0,0 +1,262 @@
+"""changepoints.py
+
+Detect when an athlete departs from their own baseline, for every
+athlete-metric series at once.
+
+Each series keeps a baseline of its recent readings:
+
+    median   median and MAD (x 1.4826) of the last WINDOW readings
+    ewma     exponentially weighted mean and standard deviation (ALPHA)
+
+Every new reading becomes a standardised residual z = (x - baseline) / scale
+and feeds a two-sided CUSUM:
+
+    S+ = max(0, S+ + z - K)      S- = max(0, S- - z - K)
+
+A changepoint is reported when S+ or S- exceeds H (a rise or a drop, e.g. a
+fall in Peak Propulsive Force after an injury). The series' CUSUM and baseline
+then restart from the new level. Nothing is tested until a series has
+MIN_READINGS readings in its baseline.
+
+All series are laid out as rows of a (series x reading) matrix and the
+recursion steps through reading positions with vectorised updates across
+every series, so the Python loop runs once per reading position, not once per
+athlete. The per-series state (baseline buffer, EWMA moments, CUSUM sums,
+last timestamp) is saved in `.changepoints/`. A later run continues from it
+with only the rows appended since the watermark and reports the new
+changepoints.
+
+Usage:
+    python changepoints.py                          # all six metrics, median/MAD baseline
+    python changepoints.py --baseline ewma --metric "Peak Propulsive Force(N)"
+    python changepoints.py --rebuild
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_quality import clean_rows
+from db import METRICS, get_engine, metrics_where, refresh_plan, table_name
+from dedup import collapse_readings
+from profiling import profiled
+
+
+STATE_DIR = Path(os.getenv('CHANGEPOINT_DIR', Path(__file__).resolve().parent / '.changepoints'))
+OUTPUT_PATH = Path(__file__).resolve().parent / 'changepoints.csv'
+BASELINES = ['median', 'ewma']
+WINDOW = 20
+ALPHA = 0.1
+MIN_READINGS = 5
+K = 0.5
+H = 5.0
+KEY = ['playername', 'metric']
+
+
+class DetectorState:
+    """Per-series arrays carried between runs (one row per athlete-metric series)."""
+
+    FIELDS = ['buffer', 'filled', 'ew_mean', 'ew_var', 'n', 's_pos', 's_neg', 'last_ts']
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.keys: list[tuple] = []
+        self.index: dict[tuple, int] = {}
+        self.buffer = np.full((0, window), np.nan)    # ring buffer of the last `window` readings
+        self.filled = np.zeros(0, np.int64)           # readings written to the buffer since the last reset
+        self.ew_mean = np.zeros(0)
+        self.ew_var = np.zeros(0)
+        self.n = np.zeros(0, np.int64)                # readings in the baseline since the last reset
+        self.s_pos = np.zeros(0)
+        self.s_neg = np.zeros(0)
+        self.last_ts = np.zeros(0, 'datetime64[ns]')
+
+    def rows_for(self, keys: list[tuple]) -> np.ndarray:
+        """State rows for `keys`, adding empty state for unseen series."""
+        new = [k for k in keys if k not in self.index]
+        for k in new:
+            self.index[k] = len(self.keys)
+            self.keys.append(k)
+        if new:
+            m = len(new)
+            self.buffer = np.vstack([self.buffer, np.full((m, self.window), np.nan)])
+            self.filled = np.r_[self.filled, np.zeros(m, np.int64)]
+            self.ew_mean = np.r_[self.ew_mean, np.zeros(m)]
+            self.ew_var = np.r_[self.ew_var, np.zeros(m)]
+            self.n = np.r_[self.n, np.zeros(m, np.int64)]
+            self.s_pos = np.r_[self.s_pos, np.zeros(m)]
+            self.s_neg = np.r_[self.s_neg, np.zeros(m)]
+            self.last_ts = np.r_[self.last_ts, np.full(m, np.datetime64('NaT'), 'datetime64[ns]')]
+        return np.array([self.index[k] for k in keys], dtype=np.int64)
+
+    def save(self, directory: Path, meta: dict) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        np.savez(directory / 'state.npz', **{f: getattr(self, f) for f in self.FIELDS})
+        (directory / 'meta.json').write_text(json.dumps({**meta, 'window': self.window, 'keys': self.keys}))
+
+    @classmethod
+    def load(cls, directory: Path) -> tuple['DetectorState | None', dict | None]:
+        if not (directory / 'meta.json').exists():
+            return None, None
+        meta = json.loads((directory / 'meta.json').read_text())
+        state = cls(meta.pop('window'))
+        state.keys = [tuple(k) for k in meta.pop('keys')]
+        state.index = {k: i for i, k in enumerate(state.keys)}
+        arrays = np.load(directory / 'state.npz')
+        for f in cls.FIELDS:
+            setattr(state, f, arrays[f])
+        return state, meta
+
+
+def series_matrix(df: pd.DataFrame) -> tuple[list[tuple], np.ndarray, np.ndarray]:
+    """Long rows -> (series keys, values (series x position), timestamps), NaN/NaT padded."""
+    df = df.sort_values(KEY + ['timestamp'], kind='stable')
+    codes, uniques = pd.MultiIndex.from_frame(df[KEY]).factorize()
+    pos = df.groupby(codes, sort=False).cumcount().to_numpy()
+    width = int(pos.max()) + 1 if len(pos) else 0
+    values = np.full((len(uniques), width), np.nan)
+    stamps = np.full((len(uniques), width), np.datetime64('NaT'), 'datetime64[ns]')
+    values[codes, pos] = df['value'].to_numpy(float)
+    stamps[codes, pos] = df['timestamp'].to_numpy('datetime64[ns]')
+    return list(uniques), values, stamps
+
+
+@profiled('changepoints.detect')
+def detect(state: DetectorState, keys: list[tuple], values: np.ndarray, stamps: np.ndarray,
+           baseline: str = 'median', k: float = K, h: float = H, alpha: float = ALPHA,
+           min_readings: int = MIN_READINGS) -> pd.DataFrame:
+    """Advance every series through its new readings; returns the changepoints found."""
+    if baseline not in BASELINES:
+        raise ValueError(f"Unknown baseline {baseline!r} (use one of {BASELINES})")
+    rows = state.rows_for(keys)
+    # Readings at or before a series' last processed timestamp were already seen.
+    fresh = ~(stamps <= state.last_ts[rows][:, None])
+    values = np.where(fresh, values, np.nan)
+    W = state.window
+    found = []
+    for t in range(values.shape[1]):
+        x = values[:, t]
+        live = ~np.isnan(x)
+        if not live.any():
+            continue
+        r = rows[live]
+        xv = x[live]
+
+        if baseline == 'median':
+            buf = state.buffer[r]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)     # empty buffers of new series
+                center = np.nanmedian(buf, axis=1)
+                scale = 1.4826 * np.nanmedian(np.abs(buf - center[:, None]), axis=1)
+        else:
+            center = state.ew_mean[r]
+            scale = np.sqrt(state.ew_var[r])
+        ready = (state.n[r] >= min_readings) & (scale > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = np.where(ready, (xv - center) / scale, 0.0)
+        s_pos = np.where(ready, np.maximum(0.0, state.s_pos[r] + z - k), 0.0)
+        s_neg = np.where(ready, np.maximum(0.0, state.s_neg[r] - z - k), 0.0)
+        alarm = (s_pos > h) | (s_neg > h)
+
+        if alarm.any():
+            a = np.flatnonzero(alarm)
+            found.append(pd.DataFrame({
+                'series': r[a],
+                'timestamp': stamps[live, t][a],
+                'value': xv[a],
+                'baseline': center[a],
+                'scale': scale[a],
+                'direction': np.where(s_pos[a] > h, 'rise', 'drop'),
+                'cusum': np.maximum(s_pos[a], s_neg[a]),
+            }))
+
+        # Update the baseline with this reading; series that alarmed restart from it.
+        with np.errstate(invalid='ignore'):
+            slot = state.filled[r] % W
+            state.buffer[r, slot] = xv
+            state.filled[r] += 1
+            delta = xv - state.ew_mean[r]
+            first = state.n[r] == 0
+            state.ew_mean[r] = np.where(first, xv, state.ew_mean[r] + alpha * delta)
+            state.ew_var[r] = np.where(first, 0.0, (1 - alpha) * (state.ew_var[r] + alpha * delta * delta))
+            state.n[r] += 1
+        state.s_pos[r] = np.where(alarm, 0.0, s_pos)
+        state.s_neg[r] = np.where(alarm, 0.0, s_neg)
+        state.last_ts[r] = stamps[live, t]
+        if alarm.any():
+            ra = r[alarm]
+            state.buffer[ra] = np.nan
+            state.buffer[ra, 0] = xv[alarm]
+            state.filled[ra] = 1
+            state.ew_mean[ra] = xv[alarm]
+            state.ew_var[ra] = 0.0
+            state.n[ra] = 1
+
+    if not found:
+        return pd.DataFrame(columns=KEY + ['timestamp', 'value', 'baseline', 'scale', 'direction', 'cusum'])
+    out = pd.concat(found, ignore_index=True)
+    out.insert(0, 'playername', [state.keys[s][0] for s in out['series']])
+    out.insert(1, 'metric', [state.keys[s][1] for s in out['series']])
+    return out.drop(columns='series').sort_values(['timestamp', 'playername', 'metric'], kind='stable').reset_index(drop=True)
+
+
+def run(metrics: list[str] = METRICS, baseline: str = 'median', directory: Path = STATE_DIR,
+        rebuild: bool = False, engine=None) -> tuple[pd.DataFrame, bool]:
+    """Detect changepoints in rows not yet seen; returns (changepoints, incremental?)."""
+    engine = engine or get_engine()
+    table = table_name()
+    settings = {'metrics': sorted(metrics), 'baseline': baseline}
+
+    state, meta = (None, None) if rebuild else DetectorState.load(directory)
+    if state is not None and meta.get('settings') != settings:
+        state, meta = None, None
+    mark, where, incremental = refresh_plan(engine, table, metrics_where(metrics), meta and meta['mark'], 'Changepoints')
+    if where is None:
+        return pd.DataFrame(columns=KEY + ['timestamp', 'value', 'baseline', 'scale', 'direction', 'cusum']), True
+    if not incremental:
+        state = DetectorState()
+    df = pd.read_sql(f"SELECT playername, team, metric, value, timestamp, data_source FROM {table} {where}", engine)
+
+    df = collapse_readings(clean_rows(df)).drop(columns='readings')
+    keys, values, stamps = series_matrix(df)
+    found = detect(state, keys, values, stamps, baseline)
+    state.save(directory, {'mark': mark, 'settings': settings})
+    return found, incremental
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Per-athlete baseline + CUSUM changepoint detection.')
+    parser.add_argument('--metric', action='append', help='only these metrics (default: the six project metrics)')
+    parser.add_argument('--baseline', choices=BASELINES, default='median')
+    parser.add_argument('--rebuild', action='store_true', help='discard saved state and replay the full history')
+    parser.add_argument('--output', type=Path, default=OUTPUT_PATH, help='CSV that changepoints are appended to')
+    args = parser.parse_args(argv)
+
+    found, incremental = run(args.metric or METRICS, args.baseline, rebuild=args.rebuild)
+    if incremental and args.output.exists():
+        found.to_csv(args.output, mode='a', header=False, index=False)
+    else:
+        found.to_csv(args.output, index=False)
+
+    print("="*80)
+    print(f"CHANGEPOINTS ({args.baseline} baseline, CUSUM k={K}, h={H})"
+          + (" — new since last run" if incremental else " — full history"))
+    print("="*80)
+    if found.empty:
+        print("No new changepoints")
+    else:
+        print(found.groupby(['metric', 'direction']).size().unstack(fill_value=0).to_string())
+        print(f"\nLatest {min(len(found), 15)}:")
+        print(found.tail(15).round({'value': 3, 'baseline': 3, 'scale': 3, 'cusum': 3}).to_string(index=False))
+    print(f"\nWrote {args.output}")
+    return found
+
+
+if __name__ == '__main__':
+    main()
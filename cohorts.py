@@ -0,0 +1,37 @@
+"""cohorts.py
+
+Team-name heuristics shared by the analysis scripts. Team spellings in the
+database are inconsistent ("Mens Basketball" vs "Men's Basketball"), so
+gender and sport are inferred from the lower-cased team string.
+"""
+from __future__ import annotations
+
+
+BASKETBALL_TEAMS = [
+    'Mens Basketball',
+    'Womens Basketball',
+    "Men's Basketball",
+    "Women's Basketball",
+]
+
+
+def infer_gender(team: str) -> str:
+    if not isinstance(team, str):
+        return 'Unknown'
+    t = team.lower()
+    if "women" in t or "women's" in t or "womens" in t:
+        return 'Female'
+    if "men" in t or "men's" in t or "mens" in t:
+        return 'Male'
+    return 'Unknown'
+
+
+def infer_sport(team: str) -> str:
+    if not isinstance(team, str):
+        return 'Unknown'
+    t = team.lower()
+    if 'basketball' in t:
+        return 'Basketball'
+    if 'football' in t:
+        return 'Football'
+    return 'Other'
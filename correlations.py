@@ -0,0 +1,215 @@
+"""correlations.py
+
+Full metric x metric Pearson and Spearman matrices for every cohort.
+
+Works on per-athlete means (one row per player/team, one column per metric).
+Cohorts are All, each team, each sport, each gender and each sport x gender.
+
+Every cohort is a row-weight vector, so all cohorts are computed in one
+batched pass: with X the centered value matrix (NaN -> 0) and M its
+"observed" mask, the pairwise-complete sums for every cohort c and metric
+pair (i, j) are einsum contractions over athletes:
+
+    n[c,i,j]   = sum_r w[c,r] M[r,i] M[r,j]
+    sxy[c,i,j] = sum_r w[c,r] X[r,i] X[r,j]        (and sx, sxx likewise)
+
+Bootstrap resamples are also just weight vectors (multinomial counts), so
+the same contraction gives B bootstrap matrices at once; cohorts run in
+parallel worker processes. Spearman uses weighted average ranks, which equal
+the ranks of the resampled data (ties included), computed per metric pair
+over the rows where both metrics are observed. Both match pandas'
+`Series.corr` on pairwise-complete rows.
+
+Usage:
+    python correlations.py                    # matrices + 95% bootstrap CIs -> correlations.csv
+    python correlations.py --boot 0 --cohort "sport=Basketball"
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import infer_gender, infer_sport
+from db import METRICS, get_engine, table_name
+from profiling import profiled
+from query_cache import cached_read_sql
+
+
+MIN_N = 3
+DEFAULT_BOOT = 1000
+OUTPUT_PATH = Path(__file__).resolve().parent / 'correlations.csv'
+
+
+def cohort_weights(pm: pd.DataFrame) -> pd.DataFrame:
+    """0/1 membership of every athlete row in every cohort (columns are cohort names)."""
+    gender = pm['team'].map(infer_gender)
+    sport = pm['team'].map(infer_sport)
+    cohorts = {'All': np.ones(len(pm), dtype=bool)}
+    for team in sorted(pm['team'].unique()):
+        cohorts[f"team={team}"] = (pm['team'] == team).to_numpy()
+    for s in sorted(sport.unique()):
+        cohorts[f"sport={s}"] = (sport == s).to_numpy()
+    for g in sorted(gender.unique()):
+        cohorts[f"gender={g}"] = (gender == g).to_numpy()
+    for s in sorted(sport.unique()):
+        for g in sorted(gender.unique()):
+            mask = ((sport == s) & (gender == g)).to_numpy()
+            if mask.any():
+                cohorts[f"sport={s}&gender={g}"] = mask
+    return pd.DataFrame(cohorts, index=pm.index).astype(float)
+
+
+def weighted_ranks(W: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """Average ranks of each column under row weights W (k x rows) -> (k, rows, metrics).
+
+    A row with weight w counts as w copies; ties share the average rank.
+    Missing values get rank 0 (they are masked out later).
+    """
+    k, n = W.shape
+    R = np.zeros((k, n, X.shape[1]))
+    for j in range(X.shape[1]):
+        valid = ~np.isnan(X[:, j])
+        if not valid.any():
+            continue
+        uniq, inv = np.unique(X[valid, j], return_inverse=True)
+        onehot = np.zeros((valid.sum(), len(uniq)))
+        onehot[np.arange(len(inv)), inv] = 1.0
+        tie_w = W[:, valid] @ onehot                      # (k, unique values)
+        rank_u = np.cumsum(tie_w, axis=1) - tie_w + (tie_w + 1) / 2
+        R[:, valid, j] = rank_u[:, inv]
+    return R
+
+
+def weighted_corr(W: np.ndarray, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Pairwise-complete Pearson matrices for every weight row of W (k x rows).
+
+    Returns (r, n), both shaped (k, metrics, metrics).
+    """
+    M = (~np.isnan(X)).astype(float)
+    X0 = np.where(M > 0, X - np.nanmean(X, axis=0), 0.0)
+    n = np.einsum('kr,ri,rj->kij', W, M, M)
+    sx = np.einsum('kr,ri,rj->kij', W, X0, M)
+    sxx = np.einsum('kr,ri,rj->kij', W, X0 ** 2, M)
+    sxy = np.einsum('kr,ri,rj->kij', W, X0, X0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sx.transpose(0, 2, 1) / n
+        var_i = sxx - sx ** 2 / n
+        var_j = var_i.transpose(0, 2, 1)
+        r = cov / np.sqrt(var_i * var_j)
+    r[n < MIN_N] = np.nan
+    return np.clip(r, -1.0, 1.0), n
+
+
+def weighted_spearman(W: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """Pairwise-complete Spearman matrices for every weight row of W (k x rows).
+
+    For each pair both metrics are ranked over the rows where both are
+    observed, as `Series.corr(method='spearman')` does.
+    """
+    M = ~np.isnan(X)
+    m = X.shape[1]
+    # R[k, r, i, j]: rank of metric i among the rows where metric j is observed
+    R = np.stack([weighted_ranks(W * M[:, j], X) for j in range(m)], axis=3)
+    Wp = W[:, :, None, None] * (M[:, :, None] & M[:, None, :])
+    n = Wp.sum(axis=1)
+    a, b = R, R.swapaxes(2, 3)
+    center = (n[:, None] + 1) / 2          # mean rank of n weighted observations
+    a, b = a - center, b - center
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (Wp * a * b).sum(axis=1) / np.sqrt((Wp * a * a).sum(axis=1) * (Wp * b * b).sum(axis=1))
+    r[n < MIN_N] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def _boot_cohort(args) -> tuple[str, np.ndarray, np.ndarray]:
+    """Worker: bootstrap CIs for one cohort -> (name, pearson (2,m,m), spearman (2,m,m))."""
+    name, X, n_boot, seed, level, batch = args
+    rng = np.random.default_rng(seed)
+    n = len(X)
+    pearson, spearman = [], []
+    for start in range(0, n_boot, batch):
+        size = min(batch, n_boot - start)
+        W = rng.multinomial(n, np.full(n, 1.0 / n), size=size).astype(float)
+        pearson.append(weighted_corr(W, X)[0])
+        spearman.append(weighted_spearman(W, X))
+    tail = (1 - level) / 2 * 100
+    qs = [tail, 100 - tail]
+    return (name,
+            np.nanpercentile(np.concatenate(pearson), qs, axis=0),
+            np.nanpercentile(np.concatenate(spearman), qs, axis=0))
+
+
+@profiled('correlations.matrices')
+def correlation_table(pm: pd.DataFrame, metrics: list[str] | None = None, cohorts: list[str] | None = None,
+                      n_boot: int = DEFAULT_BOOT, level: float = 0.95, jobs: int | None = None,
+                      seed: int = 0) -> pd.DataFrame:
+    """Long table: cohort, metric_a, metric_b, n, pearson, spearman (+ CI columns when n_boot > 0)."""
+    metrics = [m for m in (metrics or METRICS) if m in pm.columns]
+    X = pm[metrics].to_numpy(float)
+    weights = cohort_weights(pm)
+    if cohorts:
+        weights = weights[cohorts]
+    W = weights.to_numpy().T
+
+    pearson, n = weighted_corr(W, X)
+    spearman = weighted_spearman(W, X)
+
+    iu = np.triu_indices(len(metrics), k=1)
+    rows = []
+    for c, name in enumerate(weights.columns):
+        for i, j in zip(*iu):
+            rows.append({'cohort': name, 'metric_a': metrics[i], 'metric_b': metrics[j], 'n': int(n[c, i, j]),
+                         'pearson': pearson[c, i, j], 'spearman': spearman[c, i, j]})
+    out = pd.DataFrame(rows)
+
+    if n_boot > 0:
+        seeds = np.random.SeedSequence(seed).spawn(len(weights.columns))
+        tasks = [(name, X[weights[name].to_numpy() > 0], n_boot, seeds[c], level, 50)
+                 for c, name in enumerate(weights.columns)]
+        ci = {}
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            for name, p_ci, s_ci in pool.map(_boot_cohort, tasks):
+                ci[name] = (p_ci, s_ci)
+        for col, k, which in [('pearson_lo', 0, 0), ('pearson_hi', 1, 0), ('spearman_lo', 0, 1), ('spearman_hi', 1, 1)]:
+            out[col] = [ci[r.cohort][which][k, metrics.index(r.metric_a), metrics.index(r.metric_b)]
+                        for r in out.itertuples()]
+    return out
+
+
+def player_means(df: pd.DataFrame) -> pd.DataFrame:
+    """Per (player, team) mean of each metric, team as a column."""
+    pm = df.groupby(['playername', 'team', 'metric'])['value'].mean().unstack()
+    return pm.rename_axis(('playername', 'team')).reset_index()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Pearson/Spearman matrices with bootstrap CIs for every cohort.')
+    parser.add_argument('--cohort', action='append', help='only these cohorts (e.g. All, "sport=Basketball")')
+    parser.add_argument('--boot', type=int, default=DEFAULT_BOOT, help='bootstrap resamples (0 disables CIs)')
+    parser.add_argument('--level', type=float, default=0.95, help='confidence level')
+    parser.add_argument('--jobs', type=int, help='worker processes for the bootstrap')
+    parser.add_argument('--output', type=Path, default=OUTPUT_PATH, help='CSV output path')
+    args = parser.parse_args(argv)
+
+    metrics = "','".join(METRICS)
+    sql = f"SELECT playername, team, metric, value FROM {table_name()} WHERE metric IN ('{metrics}') AND value IS NOT NULL"
+    pm = player_means(cached_read_sql(sql, get_engine()))
+    table = correlation_table(pm, cohorts=args.cohort, n_boot=args.boot, level=args.level, jobs=args.jobs)
+    table.to_csv(args.output, index=False)
+
+    print("="*80)
+    print(f"CORRELATIONS ({table['cohort'].nunique()} cohorts, {len(table)} metric pairs)")
+    print("="*80)
+    strongest = table.dropna(subset=['pearson']).loc[lambda d: d['pearson'].abs().sort_values(ascending=False).index]
+    print(strongest.head(15).round(3).to_string(index=False))
+    print(f"\nWrote {args.output}")
+    return table
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""dashboard_server.py
+
+Local HTTP backend for the Part 3 dashboard views.
+
+The pipeline artifacts (`.pipeline/derived.feather`, `clean.feather` and
+`part4_flagged_athletes.csv`) are loaded once and the aggregates are
+precomputed at start-up:
+
+- athlete timelines: derived rows sorted by (athlete, metric, timestamp),
+  so an athlete (and a metric within it) is a contiguous slice found with
+  `searchsorted`
+- team comparison: mean / median / std / count per team and metric
+- monthly test counts per team or data source (the 3.3 dashboard metric),
+  from the trend cube (trend_cube.py)
+- z-score rankings: each athlete's latest reading per metric, ranked by the
+  shrinkage-adjusted `shrunk_z` (shrinkage.py) or by the raw `z_score`
+- the Part 4.1 flag report
+
+Requests are served by an asyncio server (HTTP/1.1, keep-alive) and the
+JSON bodies go through an LRU cache keyed by path and query string.
+
+Endpoints (all GET, JSON):
+    /health
+    /athletes                          names with team and reading count
+    /athlete/<name>?metric=...         timeline (value, team_mean, pct_diff_from_team, z_score)
+    /teams?metric=...                  team comparison
+    /teams/monthly?by=team|data_source monthly test counts
+    /flags?team=...                    Part 4.1 flags
+    /rankings?metric=...&team=...&n=10&order=desc&by=shrunk_z|z_score|athlete_z
+
+Usage:
+    python dashboard_server.py                      # serve on 127.0.0.1:8050
+    python dashboard_server.py --bench 5000 --concurrency 50
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+from trend_cube import aggregate, slice_cube
+
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_ARTIFACTS = ROOT / '.pipeline'
+HOST, PORT = '127.0.0.1', 8050
+CACHE_SIZE = 1024
+TIMELINE_COLUMNS = ['metric', 'timestamp', 'team', 'value', 'team_mean', 'pct_diff_from_team', 'z_score']
+# Scores /rankings can order by; the first one present in derived.feather is the default.
+RANK_BY = ['shrunk_z', 'z_score', 'athlete_z']
+
+
+class NotFound(Exception):
+    pass
+
+
+def _records(df: pd.DataFrame) -> str:
+    """JSON array of row objects (written by pandas, never re-parsed)."""
+    return df.to_json(orient='records', date_format='iso')
+
+
+class DashboardData:
+    """Precomputed aggregates behind every endpoint."""
+
+    @profiled('dashboard.load')
+    def __init__(self, artifacts: Path = DEFAULT_ARTIFACTS, cache_size: int = CACHE_SIZE):
+        derived_path = artifacts / 'derived.feather'
+        if not derived_path.exists():
+            raise SystemExit(f"No pipeline artifacts in {artifacts}; run `python pipeline.py` first")
+        derived = pd.read_feather(derived_path)
+        derived = derived.sort_values(['playername', 'metric', 'timestamp'], kind='stable').reset_index(drop=True)
+        self.timelines = derived[TIMELINE_COLUMNS]
+        self.names = derived['playername'].to_numpy()
+        self.metrics = derived['metric'].to_numpy()
+
+        athletes = derived.groupby('playername').agg(team=('team', 'last'), readings=('value', 'size'))
+        self.athletes = athletes.reset_index()
+
+        self.teams = (derived.groupby(['team', 'metric'])['value']
+                      .agg(['mean', 'median', 'std', 'count']).round(4).reset_index())
+        self.teams_by_metric = {m: g for m, g in self.teams.groupby('metric')}
+
+        # Latest reading per athlete and metric, ranked by each score within the metric and within each team.
+        latest = derived.sort_values('timestamp', kind='stable').drop_duplicates(['playername', 'metric'], keep='last')
+        self.rank_by = [c for c in RANK_BY if c in derived.columns]
+        self.ranked = {}
+        for by in self.rank_by:
+            ranked = (latest.dropna(subset=[by])
+                      [['playername', 'team', 'metric', 'value', by, 'timestamp']]
+                      .sort_values(by, ascending=False, kind='stable')
+                      .round({'value': 4, by: 4}))
+            self.ranked.update({(by, m): g for m, g in ranked.groupby('metric')})
+            self.ranked.update({(by, m, t): g for (m, t), g in ranked.groupby(['metric', 'team'])})
+
+        clean_path = artifacts / 'clean.feather'
+        self.cube = aggregate(pd.read_feather(clean_path) if clean_path.exists() else derived)
+
+        flags_path = artifacts / 'part4_flagged_athletes.csv'
+        self.flags = pd.read_csv(flags_path) if flags_path.exists() else pd.DataFrame()
+
+        self.respond = lru_cache(maxsize=cache_size)(self._respond)
+
+    # ------------------------------------------------------------------ endpoints
+
+    def athlete(self, name: str, metric: str | None = None) -> str:
+        lo, hi = np.searchsorted(self.names, name, 'left'), np.searchsorted(self.names, name, 'right')
+        if lo == hi:
+            raise NotFound(f"Unknown athlete {name!r}")
+        if metric:
+            # Rows within an athlete are sorted by metric, so the metric is a sub-slice.
+            block = self.metrics[lo:hi]
+            lo, hi = lo + np.searchsorted(block, metric, 'left'), lo + np.searchsorted(block, metric, 'right')
+        return f'{{"playername": {json.dumps(name)}, "readings": {_records(self.timelines.iloc[lo:hi])}}}'
+
+    def team_comparison(self, metric: str | None = None) -> str:
+        teams = self.teams if not metric else self.teams_by_metric.get(metric, self.teams.iloc[:0])
+        return _records(teams)
+
+    def monthly(self, by: str = 'team') -> str:
+        if by not in ('team', 'data_source', 'metric'):
+            raise NotFound(f"Cannot group monthly counts by {by!r}")
+        return _records(slice_cube(self.cube, 'month', by=[by])[['period', by, 'count']])
+
+    def flag_report(self, team: str | None = None) -> str:
+        flags = self.flags
+        if team and not flags.empty:
+            flags = flags[flags['Team'] == team]
+        return _records(flags)
+
+    def rankings(self, metric: str, team: str | None = None, n: int = 10, order: str = 'desc',
+                 by: str | None = None) -> str:
+        if n < 1:
+            raise ValueError(f"n must be a positive integer, got {n}")
+        by = by or self.rank_by[0]
+        if by not in self.rank_by:
+            raise ValueError(f"Cannot rank by {by!r} (use one of {self.rank_by})")
+        rows = self.ranked.get((by, metric, team) if team else (by, metric))
+        if rows is None:
+            raise NotFound(f"No {by} for metric {metric!r}" + (f" in team {team!r}" if team else ''))
+        return _records(rows.head(n) if order == 'desc' else rows.iloc[::-1].head(n))
+
+    # ------------------------------------------------------------------ routing
+
+    def _respond(self, path: str, query: str) -> tuple[int, bytes]:
+        """(status, JSON body) for one request; wrapped in an LRU cache as `respond`."""
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+        try:
+            if parts == ['health']:
+                body = json.dumps({'status': 'ok', 'athletes': len(self.athletes), 'rows': len(self.timelines)})
+            elif parts == ['athletes']:
+                body = _records(self.athletes)
+            elif len(parts) == 2 and parts[0] == 'athlete':
+                body = self.athlete(parts[1], params.get('metric'))
+            elif parts == ['teams']:
+                body = self.team_comparison(params.get('metric'))
+            elif parts == ['teams', 'monthly']:
+                body = self.monthly(params.get('by', 'team'))
+            elif parts == ['flags']:
+                body = self.flag_report(params.get('team'))
+            elif parts == ['rankings'] and 'metric' in params:
+                body = self.rankings(params['metric'], params.get('team'), int(params.get('n', 10)),
+                                     params.get('order', 'desc'), params.get('by'))
+            else:
+                raise NotFound(f"No route for /{'/'.join(parts)}")
+        except NotFound as exc:
+            return 404, json.dumps({'error': str(exc)}).encode()
+        except ValueError as exc:
+            return 400, json.dumps({'error': str(exc)}).encode()
+        return 200, body.encode()
+
+
+# ============================================================================
+# HTTP server
+# ============================================================================
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+async def handle(data: DashboardData, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Serve requests on one connection until the client closes it (HTTP/1.1 keep-alive)."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            if method != 'GET':
+                status, body = 405, b'{"error": "GET only"}'
+            else:
+                url = urlsplit(target)
+                status, body = data.respond(url.path, url.query)
+            close = headers.get('connection', '').lower() == 'close'
+            writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: {'close' if close else 'keep-alive'}\r\n\r\n"
+                         .encode() + body)
+            await writer.drain()
+            if close:
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(data: DashboardData, host: str = HOST, port: int = PORT) -> asyncio.AbstractServer:
+    return await asyncio.start_server(lambda r, w: handle(data, r, w), host, port)
+
+
+# ============================================================================
+# Benchmark
+# ============================================================================
+
+def bench_paths(data: DashboardData, n: int, seed: int = 0) -> list[str]:
+    """A mix of dashboard requests (timelines dominate, as in the notebooks)."""
+    rng = random.Random(seed)
+    names = [quote(n) for n in data.athletes['playername']]
+    metrics = [quote(m) for m in data.teams['metric'].unique()]
+    teams = [quote(t) for t in data.teams['team'].unique()]
+    paths = []
+    for _ in range(n):
+        kind = rng.random()
+        if kind < 0.6:
+            paths.append(f"/athlete/{rng.choice(names)}?metric={rng.choice(metrics)}")
+        elif kind < 0.8:
+            paths.append(f"/rankings?metric={rng.choice(metrics)}&team={rng.choice(teams)}&n=10")
+        elif kind < 0.9:
+            paths.append(f"/teams?metric={rng.choice(metrics)}")
+        elif kind < 0.95:
+            paths.append('/teams/monthly?by=data_source')
+        else:
+            paths.append(f"/flags?team={rng.choice(teams)}")
+    return paths
+
+
+async def _client(host: str, port: int, paths: list[str], latencies: list[float]) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    for path in paths:
+        start = time.perf_counter()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        await writer.drain()
+        length = 0
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def bench(data: DashboardData, n: int, concurrency: int) -> dict:
+    """Serve on an ephemeral port and replay `n` requests over `concurrency` keep-alive connections."""
+    server = await serve(data, HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+    paths = bench_paths(data, n)
+    results = {}
+    async with server:
+        for label in ('cold', 'warm'):
+            if label == 'cold':
+                data.respond.cache_clear()
+            latencies: list[float] = []
+            start = time.perf_counter()
+            await asyncio.gather(*[_client(HOST, port, paths[i::concurrency], latencies) for i in range(concurrency)])
+            elapsed = time.perf_counter() - start
+            lat = pd.Series(latencies) * 1e3
+            results[label] = {'requests': len(lat), 'requests_per_s': round(len(lat) / elapsed, 1),
+                              'p50_ms': round(lat.quantile(0.50), 3), 'p99_ms': round(lat.quantile(0.99), 3)}
+    info = data.respond.cache_info()
+    results['cache'] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
+    return results
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Serve precomputed athlete/team aggregates for the dashboard.')
+    parser.add_argument('--artifacts', type=Path, default=DEFAULT_ARTIFACTS, help='pipeline artifact directory')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='LRU response cache entries')
+    parser.add_argument('--bench', type=int, metavar='N', help='benchmark N requests instead of serving')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent connections for --bench')
+    args = parser.parse_args(argv)
+
+    data = DashboardData(args.artifacts, args.cache_size)
+    if args.bench:
+        stats = asyncio.run(bench(data, args.bench, args.concurrency))
+        print(json.dumps(stats, indent=2))
+        return stats
+
+    async def run():
+        server = await serve(data, args.host, args.port)
+        print(f"Serving {len(data.athletes)} athletes on http://{args.host}:{args.port} (Ctrl+C to stop)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""data_quality.py
+
+Data-quality scan of the measurement table in one streaming pass.
+
+Rows are read in chunks and every chunk updates all checks at once:
+
+- NULL and zero values per metric / team / data source (part2 Q1)
+- invalid player names ('NA', 'N/A', ...; part1 `missing_names`)
+- athletes with data from more than one source (part1 `multiple_sources`)
+- text fields with stray whitespace (the notebooks' `.str.strip()` cleanup)
+- duplicate (player, timestamp, metric) readings, split into exact repeats
+  and conflicting values
+- outliers: log-scale robust z-score (median/MAD per metric) above
+  OUTLIER_Z, which catches readings such as the 0.009541 accel_load_accum
+  in the Part 2.2 sample output
+
+The scan writes a report and a cleaned dataset (stripped text, invalid
+names and NULLs removed, exact duplicates dropped).
+
+Usage:
+    python data_quality.py                     # six project metrics
+    python data_quality.py --all-metrics --drop-outliers --out-dir quality
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db import METRICS, get_engine, table_name
+from dedup import POLICIES, collapse_readings
+from profiling import profiled
+
+
+INVALID_NAMES = ['NA', 'N/A', 'na', 'n/a', '']
+TEXT_COLUMNS = ['playername', 'team', 'metric', 'data_source']
+KEY = ['playername', 'metric', 'timestamp']
+OUTLIER_Z = 5.0
+CHUNK_ROWS = 50_000
+DEFAULT_OUT_DIR = Path(__file__).resolve().parent / 'quality'
+
+
+def scan_sql(table: str, metrics: list[str] | None = METRICS) -> str:
+    sql = f"SELECT playername, team, metric, value, timestamp, data_source FROM {table}"
+    if metrics:
+        sql += " WHERE metric IN ('" + "','".join(metrics) + "')"
+    return sql
+
+
+def _strip(values: pd.Series) -> pd.Series:
+    """Stripped text; NULLs stay NULL (not the string 'None')."""
+    return values.where(values.isna(), values.astype(str).str.strip())
+
+
+def clean_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Strip text columns, drop invalid names and rows without a value or timestamp."""
+    df = df.copy()
+    for col in TEXT_COLUMNS:
+        if col in df.columns:
+            df[col] = _strip(df[col])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    df = df[df['playername'].notna() & ~df['playername'].isin(INVALID_NAMES + ['None', 'nan'])]
+    return df.dropna(subset=['timestamp', 'value'])
+
+
+def _chunk_counts(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Per (metric, team, data_source) counts for one raw chunk."""
+    stripped = {c: _strip(chunk[c]) for c in TEXT_COLUMNS}
+    needs_strip = np.zeros(len(chunk), dtype=bool)
+    for c in TEXT_COLUMNS:
+        needs_strip |= (chunk[c].notna() & (chunk[c] != stripped[c])).to_numpy()
+    value = pd.to_numeric(chunk['value'], errors='coerce')
+    flags = pd.DataFrame({
+        'metric': stripped['metric'],
+        'team': stripped['team'],
+        'data_source': stripped['data_source'],
+        'total_records': 1,
+        'null_count': value.isna().astype(int),
+        'zero_count': (value == 0).astype(int),
+        'invalid_name_count': (chunk['playername'].isna() | stripped['playername'].isin(INVALID_NAMES)).astype(int),
+        'whitespace_count': needs_strip.astype(int),
+        'bad_timestamp_count': pd.to_datetime(chunk['timestamp'], errors='coerce').isna().astype(int),
+    })
+    return flags.groupby(['metric', 'team', 'data_source'], dropna=False).sum()
+
+
+def duplicate_readings(df: pd.DataFrame) -> pd.DataFrame:
+    """(player, metric, timestamp) keys read more than once, with how many distinct values."""
+    dup = df[df.duplicated(KEY, keep=False)]
+    if dup.empty:
+        return pd.DataFrame(columns=KEY + ['team', 'readings', 'distinct_values', 'min_value', 'max_value', 'kind'])
+    out = dup.groupby(KEY, sort=True).agg(
+        team=('team', 'first'),
+        readings=('value', 'size'),
+        distinct_values=('value', 'nunique'),
+        min_value=('value', 'min'),
+        max_value=('value', 'max'),
+    ).reset_index()
+    out['kind'] = np.where(out['distinct_values'] > 1, 'conflicting', 'exact')
+    return out
+
+
+def outliers(df: pd.DataFrame, z: float = OUTLIER_Z) -> pd.DataFrame:
+    """Positive readings whose log10 value is more than `z` robust SDs from the metric median."""
+    pos = df[df['value'] > 0]
+    logv = np.log10(pos['value'].astype(float))
+    grouped = logv.groupby(pos['metric'])
+    median = grouped.transform('median')
+    mad = (logv - median).abs().groupby(pos['metric']).transform('median') * 1.4826
+    robust_z = (logv - median) / mad.replace(0, np.nan)
+    mask = robust_z.abs() > z
+    out = pos.loc[mask, ['playername', 'team', 'metric', 'value', 'timestamp', 'data_source']].copy()
+    out['robust_z'] = robust_z[mask].round(2)
+    out['metric_median'] = (10 ** median[mask]).round(4)
+    return out.sort_values('robust_z', key=np.abs, ascending=False)
+
+
+@profiled('quality.scan')
+def scan(chunks, outlier_z: float = OUTLIER_Z) -> dict:
+    """Run every check over an iterable of raw DataFrame chunks in a single pass."""
+    counts, sources, cleaned = [], [], []
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        counts.append(_chunk_counts(chunk))
+        clean = clean_rows(chunk)
+        sources.append(clean[['playername', 'data_source']].drop_duplicates())
+        cleaned.append(clean)
+
+    summary = pd.concat(counts).groupby(level=[0, 1, 2], dropna=False).sum().reset_index() if counts else pd.DataFrame()
+    if not summary.empty:
+        summary['null_zero_percentage'] = (100.0 * (summary['null_count'] + summary['zero_count'])
+                                           / summary['total_records']).round(2)
+    clean = pd.concat(cleaned, ignore_index=True) if cleaned else pd.DataFrame(columns=KEY)
+    pairs = pd.concat(sources).drop_duplicates() if sources else pd.DataFrame(columns=['playername', 'data_source'])
+    per_player = pairs.groupby('playername')['data_source'].agg(['nunique', lambda s: ', '.join(sorted(s.dropna()))])
+    per_player.columns = ['n_sources', 'sources']
+    multi = per_player[per_player['n_sources'] >= 2].reset_index()
+
+    dups = duplicate_readings(clean)
+    before = len(clean)
+    clean = clean.drop_duplicates(KEY + ['value'], keep='last').reset_index(drop=True)
+    return {
+        'rows_scanned': rows,
+        'summary': summary,
+        'multiple_sources': multi,
+        'duplicates': dups,
+        'exact_duplicates_dropped': before - len(clean),
+        'outlier_z': outlier_z,
+        'outliers': outliers(clean, outlier_z),
+        'clean': clean,
+    }
+
+
+def print_report(result: dict) -> None:
+    summary = result['summary']
+    print("="*80)
+    print("DATA QUALITY REPORT")
+    print("="*80)
+    print(f"Rows scanned: {result['rows_scanned']}")
+    print(f"Rows in cleaned dataset: {len(result['clean'])}")
+
+    print("\nNULL/zero by metric (highest first):")
+    by_metric = summary.groupby('metric')[['total_records', 'null_count', 'zero_count']].sum()
+    by_metric['null_zero_percentage'] = (100.0 * (by_metric['null_count'] + by_metric['zero_count'])
+                                         / by_metric['total_records']).round(2)
+    print(by_metric.sort_values('null_zero_percentage', ascending=False).to_string())
+
+    print("\nNULL/zero by data source:")
+    print(summary.groupby('data_source')[['total_records', 'null_count', 'zero_count']].sum().to_string())
+
+    print(f"\nInvalid player names (NULL/'NA'/'N/A'): {int(summary['invalid_name_count'].sum())}")
+    print(f"Values with leading/trailing whitespace: {int(summary['whitespace_count'].sum())}")
+    print(f"Unparseable timestamps: {int(summary['bad_timestamp_count'].sum())}")
+    print(f"Athletes with data from multiple sources: {len(result['multiple_sources'])}")
+
+    dups = result['duplicates']
+    print("\nDuplicate (player, timestamp, metric) readings:")
+    if dups.empty:
+        print("  none")
+    else:
+        print(dups.groupby('kind')['readings'].agg(keys='size', rows='sum').to_string())
+        print(f"  exact repeats dropped from the cleaned dataset: {result['exact_duplicates_dropped']}")
+        conflicting = dups[dups['kind'] == 'conflicting']
+        if not conflicting.empty:
+            print("  conflicting examples:")
+            print(conflicting.head(5).to_string(index=False))
+
+    out = result['outliers']
+    print(f"\nOutliers (|log robust z| > {result['outlier_z']}): {len(out)}")
+    if not out.empty:
+        print(out.groupby('metric').size().to_string())
+        print(out.head(10).to_string(index=False))
+
+
+def write_outputs(result: dict, out_dir: Path) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    result['summary'].to_csv(out_dir / 'quality_summary.csv', index=False)
+    result['multiple_sources'].to_csv(out_dir / 'multiple_sources.csv', index=False)
+    result['duplicates'].to_csv(out_dir / 'duplicates.csv', index=False)
+    result['outliers'].to_csv(out_dir / 'outliers.csv', index=False)
+    result['clean'].reset_index(drop=True).to_feather(out_dir / 'clean.feather')
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Single-pass data-quality scan with a cleaned, de-duplicated output.')
+    parser.add_argument('--all-metrics', action='store_true', help='scan every metric, not only the six project metrics')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='rows per streamed chunk')
+    parser.add_argument('--outlier-z', type=float, default=OUTLIER_Z, help='robust z threshold (log scale)')
+    parser.add_argument('--drop-outliers', action='store_true', help='remove outliers from the cleaned dataset')
+    parser.add_argument('--dedup-policy', choices=POLICIES,
+                        help='also collapse conflicting duplicate readings with this policy (see dedup.py)')
+    parser.add_argument('--out-dir', type=Path, default=DEFAULT_OUT_DIR, help='directory for the report CSVs and clean.feather')
+    args = parser.parse_args(argv)
+
+    sql = scan_sql(table_name(), None if args.all_metrics else METRICS)
+    chunks = pd.read_sql(sql, get_engine(), chunksize=args.chunk_rows)
+    result = scan(chunks, args.outlier_z)
+    if args.drop_outliers:
+        result['clean'] = result['clean'].drop(result['outliers'].index)
+    if args.dedup_policy:
+        result['clean'] = collapse_readings(result['clean'], args.dedup_policy).drop(columns='readings')
+    print_report(result)
+    write_outputs(result, args.out_dir)
+    print(f"\nWrote report CSVs and clean.feather to {args.out_dir}")
+    return result
+
+
+if __name__ == '__main__':
+    main()
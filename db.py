@@ -0,0 +1,110 @@
+"""db.py
+
+Shared database settings for the project scripts.
+
+Credentials are read from `.env` next to this file (DB_HOST, DB_USER,
+DB_PASSWORD, DB_NAME and optionally DB_TABLE). Setting DB_URL instead
+points the scripts at any SQLAlchemy URL, for example a local SQLite copy
+of the table used as a stand-in for the MySQL server.
+
+Stores derived from the table (trend cube, sketches, similarity profiles,
+shrinkage statistics, changepoint state, ...) keep the `table_mark` they
+were built at; `refresh_plan` tells them whether they are current, can fold
+in the rows appended since, or must be rebuilt.
+"""
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from pathlib import Path
+
+
+ENV_PATH = Path(__file__).resolve().parent / ".env"
+DEFAULT_TABLE = "research_experiment_refactor_test"
+
+# Metric names expected in the DB 'metric' column
+METRICS = [
+    'accel_load_accum',
+    'Jump Height(m)',
+    'Peak Propulsive Force(N)',
+    'distance_total',
+    'leftMaxForce',
+    'rightMaxForce',
+]
+
+
+@lru_cache(maxsize=None)
+def load_env() -> None:
+    """Load `.env` into the process environment (existing variables win)."""
+    from dotenv import load_dotenv
+
+    load_dotenv(ENV_PATH)
+
+
+def table_name() -> str:
+    """Return the measurement table name (DB_TABLE or the project default)."""
+    load_env()
+    return os.getenv("DB_TABLE") or DEFAULT_TABLE
+
+
+def database_url() -> str:
+    """Build the SQLAlchemy URL from DB_URL or the DB_* credentials."""
+    load_env()
+    url = os.getenv("DB_URL")
+    if url:
+        return url
+    host = os.getenv("DB_HOST")
+    user = os.getenv("DB_USER")
+    password = os.getenv("DB_PASSWORD")
+    name = os.getenv("DB_NAME")
+    if not all([host, user, password, name]):
+        raise SystemExit("Missing DB credentials in .env — please set DB_HOST, DB_USER, DB_PASSWORD, DB_NAME (or DB_URL)")
+    return f"mysql+pymysql://{user}:{password}@{host}:3306/{name}"
+
+
+@lru_cache(maxsize=None)
+def get_engine(url: str | None = None):
+    """Return a (cached) SQLAlchemy engine; nothing connects until first use."""
+    from sqlalchemy import create_engine
+
+    return create_engine(url or database_url())
+
+
+def metrics_where(metrics: list[str] | None = None) -> str:
+    """WHERE clause for the non-NULL rows of `metrics` (default: the project METRICS)."""
+    names = "','".join(metrics or METRICS)
+    return f"WHERE metric IN ('{names}') AND value IS NOT NULL"
+
+
+def table_mark(engine, table: str, where: str = '') -> dict:
+    """Watermark of the rows matching `where`: {'max_ts': latest timestamp or None, 'rows': count}."""
+    import pandas as pd
+
+    row = pd.read_sql(f"SELECT MAX(timestamp) AS max_ts, COUNT(*) AS n FROM {table} {where}", engine).iloc[0]
+    return {'max_ts': None if pd.isna(row['max_ts']) else str(pd.Timestamp(row['max_ts'])), 'rows': int(row['n'])}
+
+
+def refresh_plan(engine, table: str, where: str = '', meta: dict | None = None,
+                 label: str = 'Store') -> tuple[dict, str | None, bool]:
+    """(mark, rows to read, incremental) for a store built at watermark `meta` (None: no store).
+
+    The second item is the WHERE clause of the rows the store still needs: None when
+    it is current, `where` plus `timestamp > max_ts` when rows were only appended
+    since `meta` (incremental), and `where` itself when it must be rebuilt.
+    """
+    import pandas as pd
+
+    mark = table_mark(engine, table, where)
+    if meta is None:
+        return mark, where, False
+    if meta == mark:
+        return mark, None, True
+    if not meta.get('max_ts') and meta.get('rows') == 0:
+        return mark, where, True
+    if meta.get('max_ts'):
+        since = f"{where} {'AND' if where else 'WHERE'} timestamp > '{meta['max_ts']}'"
+        appended = int(pd.read_sql(f"SELECT COUNT(*) AS n FROM {table} {since}", engine).iloc[0]['n'])
+        if meta['rows'] + appended == mark['rows']:
+            return mark, since, True
+    print(f"{label}: table changed beyond appended rows; rebuilding")
+    return mark, where, False
@@ -0,0 +1,121 @@
+"""dedup.py
+
+Collapse repeated readings per (player, metric, timestamp) before any pivot,
+merge or flag step.
+
+`pivot_table(aggfunc='mean')` in `transform_player_metrics` hides duplicate
+timestamp-metric pairs, and the left/right merge in `part4_flags.py`
+multiplies rows when a player has repeated readings at the same timestamp.
+`collapse_readings` reduces every key to one row with a policy:
+
+    mean   average of the repeated readings (what pivot_table did)
+    max    largest reading
+    last   the reading that arrived last (input order)
+    best   best-of-trials: max, or min for metrics in LOWER_IS_BETTER
+
+A policy can also be a dict {metric: policy} with a 'default' entry.
+
+Keys are factorized to integer codes and sorted once (np.lexsort); group
+boundaries come from the sorted codes and the values are reduced with
+`np.*.reduceat`, so there is no per-group Python work.
+
+Usage:
+    from dedup import collapse_readings
+    df = collapse_readings(df, policy='best')
+
+    python dedup.py --policy mean        # report how many rows each policy removes
+"""
+from __future__ import annotations
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+KEY = ['playername', 'metric', 'timestamp']
+POLICIES = ['mean', 'max', 'last', 'best']
+DEFAULT_POLICY = 'mean'
+# Metrics where a smaller reading is the better trial (none of the six project metrics yet).
+LOWER_IS_BETTER: set[str] = set()
+
+
+def _reduce(values: np.ndarray, starts: np.ndarray, counts: np.ndarray, policy: str) -> np.ndarray:
+    if policy == 'mean':
+        return np.add.reduceat(values, starts) / counts
+    if policy == 'max':
+        return np.maximum.reduceat(values, starts)
+    if policy == 'min':
+        return np.minimum.reduceat(values, starts)
+    if policy == 'last':
+        return values[starts + counts - 1]
+    raise ValueError(f"Unknown policy {policy!r} (use one of {POLICIES})")
+
+
+def _policy_for(policy, metric: str) -> str:
+    name = policy.get(metric, policy.get('default', DEFAULT_POLICY)) if isinstance(policy, dict) else policy
+    if name == 'best':
+        return 'min' if metric in LOWER_IS_BETTER else 'max'
+    return name
+
+
+def collapse_readings(df: pd.DataFrame, policy: str | dict = DEFAULT_POLICY, key: list[str] = KEY) -> pd.DataFrame:
+    """One row per `key` (other columns keep the last reading's values).
+
+    Rows come out grouped by key; a `readings` column counts the rows collapsed.
+    Rows with a NULL value or key are left out first, as `pivot_table` drops them.
+    """
+    df = df.dropna(subset=['value'] + list(key))
+    if df.empty:
+        return df.assign(readings=pd.Series(dtype='int64'))
+    codes = []
+    for col in key:
+        col_codes, _ = pd.factorize(df[col])
+        codes.append(col_codes)
+    # lexsort uses the last key as primary; input position breaks ties so 'last' is stable.
+    order = np.lexsort([np.arange(len(df))] + codes[::-1])
+    sorted_codes = np.column_stack([c[order] for c in codes])
+    boundary = np.r_[True, (sorted_codes[1:] != sorted_codes[:-1]).any(axis=1)]
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.r_[starts, len(df)])
+
+    values = df['value'].to_numpy(float)[order]
+    ends = order[starts + counts - 1]
+    out = df.iloc[ends].copy()
+    per_metric = {m: _policy_for(policy, m) for m in pd.unique(out['metric'])}
+    row_policy = out['metric'].map(per_metric).to_numpy()
+    collapsed = np.empty(len(starts))
+    for name in set(per_metric.values()):
+        sel = row_policy == name
+        collapsed[sel] = _reduce(values, starts, counts, name)[sel]
+    out['value'] = collapsed
+    out['readings'] = counts
+    return out.reset_index(drop=True)
+
+
+def main(argv: list[str] | None = None):
+    from db import METRICS, get_engine, table_name
+    from data_quality import clean_rows
+    from query_cache import cached_read_sql
+
+    parser = argparse.ArgumentParser(description='Collapse repeated (player, metric, timestamp) readings.')
+    parser.add_argument('--policy', choices=POLICIES, default=DEFAULT_POLICY)
+    args = parser.parse_args(argv)
+
+    metrics = "','".join(METRICS)
+    sql = f"SELECT playername, team, metric, value, timestamp, data_source FROM {table_name()} WHERE metric IN ('{metrics}')"
+    df = clean_rows(cached_read_sql(sql, get_engine()))
+    collapsed = collapse_readings(df, args.policy)
+    repeated = collapsed[collapsed['readings'] > 1]
+    print("="*80)
+    print(f"DUPLICATE COLLAPSE (policy: {args.policy})")
+    print("="*80)
+    print(f"Rows: {len(df)} -> {len(collapsed)} ({len(df) - len(collapsed)} removed)")
+    print(f"Keys with repeated readings: {len(repeated)}")
+    if not repeated.empty:
+        print(repeated.groupby('metric')['readings'].agg(keys='size', rows='sum').to_string())
+    return collapsed
+
+
+if __name__ == '__main__':
+    main()
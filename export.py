@@ -0,0 +1,275 @@
+"""export.py
+
+Columnar exports of the flags, derived metrics and risk categories.
+
+Each dataset is written with a fixed Arrow schema as Parquet (default) or
+Arrow IPC files, hive-partitioned by run date and team:
+
+    exports/<dataset>/run_date=2025-10-31/team=Mens%20Basketball/part-<run_id>-0.parquet
+
+Writes are append-only: every run appends one snapshot of each dataset.
+`derived` is a snapshot too, because its team means and z-scores are
+recomputed against the whole table (a late row or new data shifts every
+row of its team and metric). Every run is
+recorded in `exports/manifest.json`, so a consumer that remembers the last
+run_id it saw can read just the new files (`read_since`). A compact
+`<dataset>/current.<ext>` table keeps the latest row per key and is rewritten
+on every run; Arrow IPC files are read through a memory map (zero-copy).
+
+Usage:
+    python export.py                       # export from the pipeline artifacts in .pipeline/
+    python export.py --format arrow
+    python export.py --list                # runs in the manifest
+    python export.py --since <run_id> flags
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import uuid
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_EXPORT_DIR = ROOT / 'exports'
+MANIFEST = 'manifest.json'
+FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+# Key columns of the "current state" table; `order` decides which row is latest.
+DATASETS = {
+    'flags': {'key': ['player_name', 'flag_reason'], 'order': 'last_test'},
+    'derived': {'key': ['team', 'playername', 'metric'], 'order': 'timestamp'},
+    'risk': {'key': ['team', 'playername'], 'order': None},
+}
+
+
+@lru_cache(maxsize=None)
+def schemas() -> dict:
+    """Arrow schema of every dataset (team is the partition column and is not stored in files)."""
+    import pyarrow as pa
+
+    ts = pa.timestamp('us')
+    return {
+        'flags': pa.schema([
+            ('player_name', pa.string()), ('team', pa.string()), ('flag_reason', pa.string()),
+            ('metric_value', pa.float64()), ('last_test', ts),
+        ]),
+        'derived': pa.schema([
+            ('playername', pa.string()), ('team', pa.string()), ('metric', pa.string()),
+            ('value', pa.float64()), ('timestamp', ts), ('data_source', pa.string()),
+            ('team_mean', pa.float64()), ('pct_diff_from_team', pa.float64()), ('z_score', pa.float64()),
+            ('shrunk_team_mean', pa.float64()), ('shrunk_z', pa.float64()), ('athlete_z', pa.float64()),
+        ]),
+        'risk': pa.schema([
+            ('playername', pa.string()), ('team', pa.string()), ('gender', pa.string()), ('sport', pa.string()),
+            ('leftMaxForce', pa.float64()), ('rightMaxForce', pa.float64()), ('accel_load_accum', pa.float64()),
+            ('asym_pct', pa.float64()), ('high_asym', pa.bool_()), ('high_load', pa.bool_()),
+            ('risk_category', pa.string()),
+        ]),
+    }
+
+
+def flags_frame(report: pd.DataFrame) -> pd.DataFrame:
+    """part4 report columns ('Player Name', ...) -> export column names."""
+    df = report.rename(columns={'Player Name': 'player_name', 'Team': 'team', 'Flag Reason': 'flag_reason',
+                                'Metric Value': 'metric_value', 'Last Test Date': 'last_test'})
+    df['last_test'] = pd.to_datetime(df['last_test'])
+    return df
+
+
+def to_table(name: str, df: pd.DataFrame):
+    """DataFrame -> Arrow table with the dataset's schema (missing columns become nulls)."""
+    import pyarrow as pa
+
+    schema = schemas()[name]
+    if df.empty:
+        # an all-NaN reindex is float64 and would not cast to the timestamp/string columns
+        return schema.empty_table()
+    df = df.reindex(columns=schema.names)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def read_manifest(root: Path) -> dict:
+    path = root / MANIFEST
+    return json.loads(path.read_text()) if path.exists() else {'runs': []}
+
+
+def write_manifest(root: Path, manifest: dict) -> None:
+    tmp = root / (MANIFEST + '.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2))
+    tmp.replace(root / MANIFEST)
+
+
+def _write_partitions(name: str, table, root: Path, run_date: str, run_id: str, fmt: str) -> list[str]:
+    """Append `table` under run_date=/team= partitions; returns the files written."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if table.num_rows == 0:
+        return []
+    table = table.append_column('run_date', pa.array([run_date] * table.num_rows, pa.string()))
+    partitioning = ds.partitioning(pa.schema([('run_date', pa.string()), ('team', pa.string())]), flavor='hive')
+    written: list[str] = []
+    file_format = 'ipc' if fmt == 'arrow' else 'parquet'
+    ds.write_dataset(
+        table, root / name, format=file_format, partitioning=partitioning,
+        basename_template=f"part-{run_id}-{{i}}.{FORMATS[fmt]}",
+        existing_data_behavior='overwrite_or_ignore',
+        file_visitor=lambda f: written.append(str(Path(f.path).relative_to(root))),
+    )
+    return sorted(written)
+
+
+def update_current(name: str, df: pd.DataFrame, root: Path, fmt: str) -> int:
+    """Rewrite `<dataset>/current.<ext>` from the snapshot `df`, keeping the latest row per key."""
+    spec = DATASETS[name]
+    path = root / name / f"current.{FORMATS[fmt]}"
+    previous = _current_path(name, root)
+    if spec['order']:
+        df = df.sort_values(spec['order'], kind='stable')
+    df = df.drop_duplicates(spec['key'], keep='last').sort_values(spec['key']).reset_index(drop=True)
+    _write_file(to_table(name, df), path, fmt)
+    if previous is not None and previous != path:
+        previous.unlink()
+    return len(df)
+
+
+def _current_path(name: str, root: Path) -> Path | None:
+    for ext in FORMATS.values():
+        path = root / name / f"current.{ext}"
+        if path.exists():
+            return path
+    return None
+
+
+def _write_file(table, path: Path, fmt: str) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    if fmt == 'arrow':
+        with pa.OSFile(str(tmp), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, tmp)
+    tmp.replace(path)
+
+
+def read_table(path: Path):
+    """Read one export file; Arrow IPC files are memory-mapped (zero-copy)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.suffix == '.arrow':
+        return pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    return pq.read_table(path)
+
+
+def export_run(frames: dict[str, pd.DataFrame], root: Path = DEFAULT_EXPORT_DIR, fmt: str = 'parquet',
+               run_date: str | None = None) -> dict:
+    """Append one run of `frames` ({dataset: DataFrame}) and refresh the current tables."""
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(root)
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    run_date = run_date or date.today().isoformat()
+    entry = {'run_id': run_id, 'run_date': run_date, 'format': fmt, 'datasets': {}}
+
+    for name, df in frames.items():
+        files = _write_partitions(name, to_table(name, df), root, run_date, run_id, fmt)
+        current_rows = update_current(name, df, root, fmt)
+        entry['datasets'][name] = {'rows': len(df), 'files': files, 'current_rows': current_rows}
+
+    manifest['runs'].append(entry)
+    write_manifest(root, manifest)
+    return entry
+
+
+def read_since(name: str, root: Path = DEFAULT_EXPORT_DIR, after: str | None = None):
+    """Arrow table of the files appended to `name` by runs after run_id `after` (all runs if None)."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    runs = read_manifest(root)['runs']
+    ids = [r['run_id'] for r in runs]
+    if after is not None:
+        if after not in ids:
+            raise KeyError(f"Unknown run_id {after!r}")
+        runs = runs[ids.index(after) + 1:]
+    files = [str(root / f) for run in runs for f in run['datasets'].get(name, {}).get('files', [])]
+    # read with the current schema so files written before a column was added read it as nulls
+    schema = schemas()[name].append(pa.field('run_date', pa.string()))
+    if not files:
+        return schema.empty_table()
+    partitioning = ds.partitioning(pa.schema([('run_date', pa.string()), ('team', pa.string())]), flavor='hive')
+    tables = []
+    for ext, fmt in [('.parquet', 'parquet'), ('.arrow', 'ipc')]:
+        group = [f for f in files if f.endswith(ext)]
+        if group:
+            tables.append(ds.dataset(group, format=fmt, partitioning=partitioning, schema=schema,
+                                     partition_base_dir=str(root / name)).to_table())
+    return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+
+def read_current(name: str, root: Path = DEFAULT_EXPORT_DIR):
+    path = _current_path(name, root)
+    if path is None:
+        raise FileNotFoundError(f"No current table for {name!r} under {root}")
+    return read_table(path)
+
+
+def pipeline_frames(artifacts: Path) -> dict[str, pd.DataFrame]:
+    """Export frames built from the pipeline's artifacts (derived.feather, flags CSV, clean.feather)."""
+    from plot_q4_risk_distribution_basketball_gender import METRICS as PLOT_METRICS, basketball_risk
+
+    frames = {}
+    flags_csv = artifacts / 'part4_flagged_athletes.csv'
+    if flags_csv.exists():
+        frames['flags'] = flags_frame(pd.read_csv(flags_csv))
+    if (artifacts / 'derived.feather').exists():
+        frames['derived'] = pd.read_feather(artifacts / 'derived.feather')
+    if (artifacts / 'clean.feather').exists():
+        clean = pd.read_feather(artifacts / 'clean.feather')
+        frames['risk'] = basketball_risk(clean[clean['metric'].isin(PLOT_METRICS)])
+    return frames
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Export flags, derived metrics and risk categories as Parquet/Arrow.')
+    parser.add_argument('datasets', nargs='*', help=f"datasets for --since (default: all): {', '.join(DATASETS)}")
+    parser.add_argument('--artifacts', type=Path, default=ROOT / '.pipeline', help='pipeline artifact directory to export from')
+    parser.add_argument('--root', type=Path, default=DEFAULT_EXPORT_DIR, help='export directory')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet')
+    parser.add_argument('--run-date', help='partition date (default: today)')
+    parser.add_argument('--list', action='store_true', help='list runs in the manifest')
+    parser.add_argument('--since', metavar='RUN_ID', help="print rows appended after this run ('' for all)")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for run in read_manifest(args.root)['runs']:
+            counts = ', '.join(f"{n}={d['rows']}" for n, d in run['datasets'].items())
+            print(f"{run['run_id']}  {run['run_date']}  {run['format']:<7} {counts}")
+        return
+    if args.since is not None:
+        for name in args.datasets or list(DATASETS):
+            table = read_since(name, args.root, args.since or None)
+            print(f"{name}: {table.num_rows} new rows")
+        return
+
+    frames = pipeline_frames(args.artifacts)
+    if not frames:
+        raise SystemExit(f"No pipeline artifacts in {args.artifacts}; run `python pipeline.py` first")
+    entry = export_run(frames, args.root, args.format, args.run_date)
+    print(f"Run {entry['run_id']} ({entry['run_date']}, {entry['format']}):")
+    for name, d in entry['datasets'].items():
+        print(f"  {name:<8} appended {d['rows']} rows in {len(d['files'])} files; current table {d['current_rows']} rows")
+    return entry
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""flag_backtest.py
+
+Replay the Part 4.1 flags as of every test date.
+
+`part4_flags.py` answers "is this athlete flagged on their latest test" with a
+90th percentile computed over all history, so early tests are judged against
+thresholds that include future data. The backtest instead evaluates, for every
+calendar date D in the data:
+
+- the gender 90th percentile of accel_load_accum over tests up to and
+  including D (expanding window, no future data), and
+- each athlete's latest accel / bilateral test on or before D.
+
+Percentiles come from a Fenwick tree over value ranks (one insert per test,
+one k-th order statistic lookup per date) and point-in-time latest values
+from a forward-filled date x athlete matrix, so the whole replay is a single
+sorted pass instead of one recompute per date. Thresholds (quantile, 10%
+asymmetry) come from the `part4` rule set in flag_rules.json, and the
+left/right tests are part4's `load_bilateral` rows from the session table
+(sessions.py), so the state on the final date is what part4_flags.py reports.
+
+Outputs:
+    part4_backtest_daily.csv   date x gender: threshold, athletes tested/flagged
+    part4_backtest_events.csv  flag raised / cleared per athlete and date
+
+Usage:
+    python flag_backtest.py
+    python flag_backtest.py --verify 25     # cross-check 25 dates and the final state against part4
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import infer_gender
+from db import get_engine
+from part4_flags import flag_accel_load, flag_asymmetry, load_accel, load_bilateral
+from profiling import profiled
+from rule_engine import rule_set
+
+
+OUTPUT_DIR = Path(__file__).resolve().parent
+
+
+def part4_thresholds() -> tuple[float, float]:
+    """(load quantile, asymmetry %) from the `part4` rule set."""
+    plan = rule_set('part4')
+    steps = {s['name']: s for s in plan['steps']}
+    stats = {s['id']: s for s in plan['stats']}
+    load_q = stats[steps['accel_load']['stat']]['q']
+    return load_q, steps['bilateral_asymmetry']['value']
+
+
+def _kth(tree: list[int], k: int, log: int) -> int:
+    """Index (0-based) of the k-th smallest inserted rank (1-based k)."""
+    pos = 0
+    step = 1 << log
+    while step:
+        nxt = pos + step
+        if nxt < len(tree) and tree[nxt] < k:
+            pos = nxt
+            k -= tree[nxt]
+        step >>= 1
+    return pos
+
+
+def expanding_quantile(days: np.ndarray, values: np.ndarray, q: float) -> pd.DataFrame:
+    """Quantile of all values with day <= D, for every distinct day D (linear interpolation).
+
+    Matches `Series.quantile(q)` over the same prefix of the data.
+    """
+    n = len(values)
+    if n == 0:
+        return pd.DataFrame(columns=['date', 'n', 'threshold'])
+    order = np.argsort(values, kind='stable')
+    sorted_vals = values[order]
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+
+    by_day = np.argsort(days, kind='stable')
+    days_sorted = days[by_day]
+    ranks_by_day = rank[by_day] + 1
+    bounds = np.flatnonzero(np.r_[True, days_sorted[1:] != days_sorted[:-1], True])
+
+    tree = [0] * (n + 1)
+    log = n.bit_length()
+    out_days, out_n, out_thr = [], [], []
+    count = 0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        for i in ranks_by_day[start:end].tolist():
+            while i <= n:
+                tree[i] += 1
+                i += i & -i
+        count += end - start
+        pos = (count - 1) * q
+        lo = int(pos)
+        lo_val = sorted_vals[_kth(tree, lo + 1, log)]
+        hi_val = sorted_vals[_kth(tree, lo + 2, log)] if lo + 1 < count else lo_val
+        out_days.append(days_sorted[start])
+        out_n.append(count)
+        out_thr.append(lo_val + (hi_val - lo_val) * (pos - lo))
+    return pd.DataFrame({'date': out_days, 'n': out_n, 'threshold': out_thr})
+
+
+def as_of_matrix(df: pd.DataFrame, value_col: str, dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """date x athlete matrix of each athlete's latest value on or before the date."""
+    latest = df.sort_values('timestamp', kind='stable').groupby(['date', 'playername'])[value_col].last()
+    return latest.unstack().reindex(dates).ffill()
+
+
+def _final(flagged: pd.DataFrame, values: pd.DataFrame, threshold: float, reason: str) -> pd.DataFrame:
+    """Every tested athlete's value and flag on the last date."""
+    last = pd.DataFrame({'value': values.iloc[-1], 'flagged': flagged.iloc[-1]}).dropna(subset=['value'])
+    last.index.name = 'playername'
+    return last.reset_index().assign(flag_reason=reason, threshold=threshold)
+
+
+def _events(flagged: pd.DataFrame, values: pd.DataFrame, thresholds, reason: str) -> pd.DataFrame:
+    """Rows where an athlete's flag state changes between consecutive dates."""
+    state = flagged.astype(np.int8)
+    change = state.diff()
+    change.iloc[0] = state.iloc[0]
+    stacked = change.stack()
+    stacked = stacked[stacked != 0]
+    if stacked.empty:
+        return pd.DataFrame(columns=['date', 'playername', 'flag_reason', 'change', 'value', 'threshold'])
+    ev = stacked.rename('delta').reset_index()
+    ev.columns = ['date', 'playername', 'delta']
+    ev['flag_reason'] = reason
+    ev['change'] = np.where(ev['delta'] > 0, 'raised', 'cleared')
+    ev['value'] = values.stack().reindex(pd.MultiIndex.from_frame(ev[['date', 'playername']])).to_numpy()
+    if isinstance(thresholds, pd.Series):
+        ev['threshold'] = thresholds.reindex(ev['date']).to_numpy()
+    else:
+        ev['threshold'] = thresholds
+    return ev.drop(columns='delta')
+
+
+@profiled('backtest.replay')
+def backtest(df_accel: pd.DataFrame, df_bilateral: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Point-in-time replay; returns (daily summary, flag change events, state on the final date)."""
+    load_q, asym_limit = part4_thresholds()
+    df_accel = df_accel.assign(date=df_accel['timestamp'].dt.normalize())
+    sessions = df_bilateral.copy()
+    sessions['date'] = pd.to_datetime(sessions['timestamp']).dt.normalize()
+    sessions['gender'] = sessions['team'].map(infer_gender)
+    dates = pd.DatetimeIndex(sorted(set(df_accel['date']) | set(sessions['date'])), name='date')
+
+    daily, events, final = [], [], []
+    for gender in ['Male', 'Female']:
+        acc = df_accel[df_accel['gender'] == gender]
+        ses = sessions[sessions['gender'] == gender]
+        if acc.empty and ses.empty:
+            continue
+        frame = pd.DataFrame(index=dates)
+
+        if not acc.empty:
+            thr = expanding_quantile(acc['date'].to_numpy(), acc['value'].to_numpy(float), load_q)
+            threshold = thr.set_index('date')['threshold'].reindex(dates).ffill()
+            load = as_of_matrix(acc, 'value', dates)
+            load_flag = load.gt(threshold, axis=0)
+            frame['accel_threshold'] = threshold
+            frame['accel_tested'] = load.notna().sum(axis=1)
+            frame['accel_flagged'] = load_flag.sum(axis=1)
+            events.append(_events(load_flag, load, threshold, 'Accel load >90th percentile (gender)').assign(gender=gender))
+            final.append(_final(load_flag, load, threshold.iloc[-1], 'Accel load >90th percentile (gender)').assign(gender=gender))
+
+        if not ses.empty:
+            asym = as_of_matrix(ses, 'asymmetry_pct', dates)
+            asym_flag = asym > asym_limit
+            frame['asym_tested'] = asym.notna().sum(axis=1)
+            frame['asym_flagged'] = asym_flag.sum(axis=1)
+            events.append(_events(asym_flag, asym, asym_limit, 'Bilateral asymmetry >10%').assign(gender=gender))
+            final.append(_final(asym_flag, asym, asym_limit, 'Bilateral asymmetry >10%').assign(gender=gender))
+
+        daily.append(frame.assign(gender=gender).reset_index())
+
+    daily_df = pd.concat(daily, ignore_index=True) if daily else pd.DataFrame()
+    events_df = pd.concat(events, ignore_index=True) if events else pd.DataFrame()
+    if not events_df.empty:
+        events_df = events_df.sort_values(['date', 'playername', 'flag_reason'], kind='stable').reset_index(drop=True)
+    final_df = pd.concat(final, ignore_index=True) if final else pd.DataFrame(
+        columns=['playername', 'value', 'flagged', 'flag_reason', 'threshold', 'gender'])
+    return daily_df, events_df, final_df
+
+
+def verify(df_accel: pd.DataFrame, df_bilateral: pd.DataFrame, daily: pd.DataFrame, final: pd.DataFrame,
+           n_dates: int = 20, seed: int = 0) -> int:
+    """Recompute sampled thresholds from scratch and the final-date state with part4_flags.py.
+
+    Returns the number of mismatches: thresholds, latest asymmetry values and flagged athletes.
+    """
+    load_q, _ = part4_thresholds()
+    df_accel = df_accel.assign(date=df_accel['timestamp'].dt.normalize())
+    dated = daily.dropna(subset=['accel_threshold'])
+    sample = dated.sample(min(n_dates, len(dated)), random_state=seed)
+    bad = 0
+    for row in sample.itertuples():
+        prefix = df_accel[(df_accel['gender'] == row.gender) & (df_accel['date'] <= row.date)]['value']
+        expected = prefix.quantile(load_q)
+        if not np.isclose(expected, row.accel_threshold):
+            bad += 1
+            print(f"  mismatch {row.date.date()} {row.gender}: {row.accel_threshold} vs {expected}")
+    print(f"\nVerification: {len(sample) - bad} / {len(sample)} sampled thresholds match a full recompute")
+
+    # Final date: every athlete's latest asymmetry and the flagged set, as part4_flags.py computes them
+    latest = df_bilateral.sort_values('timestamp', kind='stable').groupby('playername')['asymmetry_pct'].last()
+    asym = final[final['flag_reason'] == 'Bilateral asymmetry >10%'].set_index('playername')['value']
+    asym, latest = asym.align(latest)
+    wrong = ~np.isclose(asym.to_numpy(float), latest.to_numpy(float), equal_nan=False)
+    for player in asym.index[wrong]:
+        print(f"  asymmetry mismatch {player}: {asym[player]} vs {latest[player]}")
+    print(f"Verification: {len(asym) - int(wrong.sum())} / {len(asym)} final-date asymmetry values match part4")
+    bad += int(wrong.sum())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        flagged = pd.concat([flag_asymmetry(df_bilateral), flag_accel_load(df_accel)], ignore_index=True)
+    expected_flags = set(flagged[['playername', 'flag_reason']].itertuples(index=False, name=None)) if len(flagged) else set()
+    got = set(final.loc[final['flagged'].astype(bool), ['playername', 'flag_reason']].itertuples(index=False, name=None))
+    for player, reason in sorted(expected_flags ^ got):
+        print(f"  flag mismatch {player} ({reason}): {'backtest only' if (player, reason) in got else 'part4 only'}")
+    print(f"Verification: {len(expected_flags & got)} / {len(expected_flags | got)} final-date flags match part4")
+    return bad + len(expected_flags ^ got)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Backtest the Part 4.1 flags as of every test date (no future data).')
+    parser.add_argument('--out-dir', type=Path, default=OUTPUT_DIR, help='directory for the backtest CSVs')
+    parser.add_argument('--verify', type=int, default=0, metavar='N', help='cross-check N sampled dates and the final-date flags against part4')
+    args = parser.parse_args(argv)
+
+    conn = get_engine()
+    df_accel = load_accel(conn)
+    df_bilateral = load_bilateral(conn)
+
+    print("="*80)
+    print("PART 4.1 FLAG BACKTEST (point-in-time, expanding-window percentiles)")
+    print("="*80)
+    start = time.perf_counter()
+    daily, events, final = backtest(df_accel, df_bilateral)
+    elapsed = time.perf_counter() - start
+    print(f"\nReplayed {daily['date'].nunique()} dates in {elapsed:.2f}s "
+          f"({len(df_accel)} accel tests, {len(df_bilateral)} bilateral tests)")
+
+    if not daily.empty:
+        last = daily.sort_values('date').groupby('gender').tail(1)
+        print("\nState on the final date (matches part4_flags.py):")
+        print(last.to_string(index=False))
+    if not events.empty:
+        print("\nFlag changes by reason:")
+        print(events.groupby(['flag_reason', 'change']).size().to_string())
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    daily.to_csv(args.out_dir / 'part4_backtest_daily.csv', index=False)
+    events.to_csv(args.out_dir / 'part4_backtest_events.csv', index=False)
+    print(f"\nWrote part4_backtest_daily.csv and part4_backtest_events.csv to {args.out_dir}")
+
+    if args.verify:
+        if verify(df_accel, df_bilateral, daily, final, args.verify):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
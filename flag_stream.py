@@ -0,0 +1,349 @@
+"""flag_stream.py
+
+Streaming version of the Part 4.1 flags.
+
+Instead of running `part4_flags.py` as a batch, new measurements are
+consumed as they arrive and each event is evaluated against in-memory
+state:
+
+- Bilateral asymmetry: a leftMaxForce/rightMaxForce pair for the same
+  athlete and timestamp with ((strong - weak) / strong) * 100 > 10.
+- Acceleration load: accel_load_accum above the 90th percentile of the
+  athlete's gender (percentile over all values seen so far).
+
+The threshold, quantile and labels are read from the 'part4' set of
+flag_rules.json, so the stream flags what part4_flags.py flags. A half of a
+left/right pair waits in memory for its other side for PENDING_TTL of event
+time (checked once per event day).
+
+Sources (stand-ins for the VALD/Kinexon feeds):
+    --source table       poll the measurement table on a timestamp watermark
+    --source file PATH   tail a JSON-lines file (one measurement per line)
+
+Sinks: stdout (default), `file:alerts.jsonl`, `webhook:http://localhost:8000/alerts`.
+
+Usage:
+    python flag_stream.py --source table --interval 5
+    python flag_stream.py --source file drop/events.jsonl --sink file:alerts.jsonl
+    python flag_stream.py --bench 50000      # replay history, report throughput/latency
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import bisect
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+from cohorts import BASKETBALL_TEAMS, infer_gender
+from db import get_engine, table_name
+from rule_engine import load_rules
+
+
+STREAM_METRICS = ['accel_load_accum', 'leftMaxForce', 'rightMaxForce']
+PENDING_TTL = pd.Timedelta(days=1)
+
+
+def part4_rules(rules: dict | None = None) -> dict:
+    """The 'bilateral_asymmetry' and 'accel_load' rules of the part4 set, by name."""
+    spec = (rules or load_rules())['part4']
+    return {r['name']: r for r in spec['rules']}
+
+
+def quantile_sorted(values: list[float], q: float) -> float:
+    """Linear-interpolated quantile of a sorted list (same as pandas' default)."""
+    if not values:
+        return float('nan')
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class FlagState:
+    """In-memory state needed to evaluate both flag rules per event."""
+
+    def __init__(self, teams: list[str] | None = BASKETBALL_TEAMS, rules: dict | None = None):
+        self.teams = set(teams) if teams else None
+        self.rules = part4_rules(rules)
+        self.asym_threshold = float(self.rules['bilateral_asymmetry']['threshold'])
+        self.load_quantile = float(self.rules['accel_load']['threshold']['q'])
+        self.loads: dict[str, list[float]] = defaultdict(list)   # gender -> sorted accel values
+        self.pending: dict[tuple, dict] = {}                       # (player, timestamp) -> {metric: value}, oldest first
+        self._day = None                                           # event day of the last eviction pass
+
+    def seed(self, df: pd.DataFrame) -> None:
+        """Load historical accel values so thresholds are meaningful from the first event."""
+        df = df[df['metric'] == 'accel_load_accum']
+        if self.teams is not None:
+            df = df[df['team'].isin(self.teams)]
+        for gender, values in df.groupby(df['team'].map(infer_gender))['value']:
+            self.loads[gender] = sorted(values.tolist())
+
+    def evaluate(self, event: dict) -> list[dict]:
+        """Update state with one measurement and return any alerts it triggers."""
+        if self.teams is not None and event.get('team') not in self.teams:
+            return []
+        metric = event['metric']
+        if metric == 'accel_load_accum':
+            return self._evaluate_load(event)
+        if metric in ('leftMaxForce', 'rightMaxForce'):
+            return self._evaluate_asymmetry(event)
+        return []
+
+    def _evaluate_load(self, event: dict) -> list[dict]:
+        gender = infer_gender(event['team'])
+        values = self.loads[gender]
+        bisect.insort(values, float(event['value']))
+        threshold = quantile_sorted(values, self.load_quantile)
+        if event['value'] > threshold:
+            return [_alert(event, self.rules['accel_load']['label'], round(float(event['value']), 2),
+                           threshold=round(threshold, 2), gender=gender)]
+        return []
+
+    def _evaluate_asymmetry(self, event: dict) -> list[dict]:
+        key = (event['playername'], str(event['timestamp']))
+        if key[1][:10] != self._day:
+            self._day = key[1][:10]
+            self._evict(str(pd.Timestamp(key[1]) - PENDING_TTL))
+        sides = self.pending.setdefault(key, {})
+        sides[event['metric']] = float(event['value'])
+        if len(sides) < 2:
+            return []
+        del self.pending[key]
+        left, right = sides['leftMaxForce'], sides['rightMaxForce']
+        strong, weak = max(left, right), min(left, right)
+        if strong <= 0:
+            return []
+        asym = (strong - weak) / strong * 100
+        if asym > self.asym_threshold:
+            return [_alert(event, self.rules['bilateral_asymmetry']['label'], round(asym, 2),
+                           left_force=left, right_force=right,
+                           stronger_side='Left' if left > right else 'Right')]
+        return []
+
+    def _evict(self, cutoff: str) -> None:
+        """Drop unpaired halves timestamped before `cutoff` (pending is in arrival order)."""
+        while self.pending:
+            key = next(iter(self.pending))
+            if key[1] >= cutoff:
+                break
+            del self.pending[key]
+
+
+def _alert(event: dict, reason: str, value: float, **extra) -> dict:
+    return {
+        'playername': event['playername'],
+        'team': event['team'],
+        'flag_reason': reason,
+        'flag_value': value,
+        'last_test': str(event['timestamp']),
+        **extra,
+    }
+
+
+# ============================================================================
+# Sinks
+# ============================================================================
+
+class StdoutSink:
+    async def send(self, alert: dict) -> None:
+        print(f"[ALERT] {alert['playername']} ({alert['team']}): {alert['flag_reason']} = {alert['flag_value']} at {alert['last_test']}")
+
+
+class FileSink:
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    async def send(self, alert: dict) -> None:
+        with open(self.path, 'a') as fh:
+            fh.write(json.dumps(alert) + '\n')
+
+
+class WebhookSink:
+    """POST each alert as JSON (blocking I/O runs in a worker thread)."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def _post(self, alert: dict) -> None:
+        import urllib.request
+
+        req = urllib.request.Request(self.url, data=json.dumps(alert).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+    async def send(self, alert: dict) -> None:
+        try:
+            await asyncio.to_thread(self._post, alert)
+        except OSError as exc:
+            print(f"Webhook delivery failed: {exc}")
+
+
+class NullSink:
+    async def send(self, alert: dict) -> None:
+        pass
+
+
+def make_sink(spec: str):
+    if spec == 'stdout':
+        return StdoutSink()
+    if spec == 'null':
+        return NullSink()
+    kind, _, target = spec.partition(':')
+    if kind == 'file' and target:
+        return FileSink(target)
+    if kind == 'webhook' and target:
+        return WebhookSink(target)
+    raise SystemExit(f"Unknown sink: {spec} (use stdout, file:PATH or webhook:URL)")
+
+
+# ============================================================================
+# Sources — async generators yielding measurement dicts
+# ============================================================================
+
+def _event_key(event: dict) -> tuple:
+    return event['playername'], event['metric'], str(event['timestamp'])
+
+
+async def poll_table(engine, table: str, watermark: str, interval: float = 5.0, seen: set | None = None):
+    """Yield rows at or after `watermark`, polling every `interval` seconds.
+
+    Rows sharing the watermark timestamp can land in a later poll (e.g. the
+    second half of a left/right pair), so the watermark timestamp is polled
+    again and the (player, metric, timestamp) keys already yielded at it are
+    skipped. `seen` holds those keys for the starting watermark.
+    """
+    metrics = "','".join(STREAM_METRICS)
+    seen = set(seen or ())
+    while True:
+        sql = f"""
+SELECT playername, team, metric, value, timestamp
+FROM {table}
+WHERE metric IN ('{metrics}') AND value IS NOT NULL AND timestamp >= '{watermark}'
+ORDER BY timestamp
+"""
+        df = await asyncio.to_thread(pd.read_sql, sql, engine)
+        for event in df.to_dict('records'):
+            key = _event_key(event)
+            if key in seen:
+                continue
+            if key[2] > watermark:
+                watermark, seen = key[2], set()
+            seen.add(key)
+            yield event
+        await asyncio.sleep(interval)
+
+
+async def tail_file(path: Path, interval: float = 0.5, from_start: bool = True):
+    """Yield JSON-lines measurements appended to `path` (a file drop stand-in)."""
+    path.touch(exist_ok=True)
+    with open(path) as fh:
+        if not from_start:
+            fh.seek(0, 2)
+        while True:
+            line = fh.readline()
+            if not line:
+                await asyncio.sleep(interval)
+                continue
+            if line.strip():
+                yield json.loads(line)
+
+
+async def consume(source, state: FlagState, sink, max_events: int | None = None) -> dict:
+    """Evaluate every event from `source` and push alerts; returns throughput/latency stats."""
+    latencies = []
+    alerts = 0
+    start = time.perf_counter()
+    async for event in source:
+        received = time.perf_counter()
+        for alert in state.evaluate(event):
+            await sink.send(alert)
+            alerts += 1
+        latencies.append(time.perf_counter() - received)
+        if max_events is not None and len(latencies) >= max_events:
+            break
+    return stream_stats(latencies, alerts, time.perf_counter() - start)
+
+
+def stream_stats(latencies: list[float], alerts: int, elapsed: float) -> dict:
+    lat = pd.Series(latencies, dtype=float) * 1e6
+    return {
+        'events': len(latencies),
+        'alerts': alerts,
+        'elapsed_s': round(elapsed, 3),
+        'events_per_s': round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        'p50_us': round(lat.quantile(0.50), 1) if len(lat) else None,
+        'p99_us': round(lat.quantile(0.99), 1) if len(lat) else None,
+    }
+
+
+async def _replay(df: pd.DataFrame):
+    for event in df.to_dict('records'):
+        yield event
+
+
+def fetch_history(engine, table: str) -> pd.DataFrame:
+    metrics = "','".join(STREAM_METRICS)
+    sql = f"""
+SELECT playername, team, metric, value, timestamp
+FROM {table}
+WHERE metric IN ('{metrics}') AND value IS NOT NULL
+ORDER BY timestamp
+"""
+    return pd.read_sql(sql, engine)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Stream new measurements and raise Part 4.1 flags as they arrive.')
+    parser.add_argument('--source', nargs='+', default=['table'], metavar=('KIND', 'PATH'),
+                        help="'table' (poll the DB) or 'file PATH' (tail a JSON-lines drop file)")
+    parser.add_argument('--sink', default='stdout', help='stdout, null, file:PATH or webhook:URL')
+    parser.add_argument('--interval', type=float, default=5.0, help='poll interval in seconds')
+    parser.add_argument('--all-teams', action='store_true', help='evaluate every team, not only Basketball')
+    parser.add_argument('--max-events', type=int, help='stop after this many events')
+    parser.add_argument('--bench', type=int, metavar='N', help='replay the last N historical events and report throughput')
+    args = parser.parse_args(argv)
+
+    engine = get_engine()
+    table = table_name()
+    state = FlagState(None if args.all_teams else BASKETBALL_TEAMS)
+    sink = make_sink(args.sink)
+
+    history = fetch_history(engine, table)
+    if args.bench:
+        seed, replay = history.iloc[:-args.bench], history.iloc[-args.bench:]
+        state.seed(seed)
+        stats = asyncio.run(consume(_replay(replay), state, sink))
+        print(json.dumps(stats, indent=2))
+        return stats
+
+    state.seed(history)
+    watermark = str(history['timestamp'].max()) if not history.empty else '1970-01-01'
+    kind = args.source[0]
+    if kind == 'table':
+        at_mark = history[history['timestamp'].astype(str) == watermark]
+        seen = {_event_key(e) for e in at_mark.to_dict('records')}
+        source = poll_table(engine, table, watermark, args.interval, seen)
+    elif kind == 'file' and len(args.source) == 2:
+        source = tail_file(Path(args.source[1]), interval=min(args.interval, 0.5))
+    else:
+        parser.error("--source must be 'table' or 'file PATH'")
+
+    print(f"Streaming from {kind} (watermark {watermark}); Ctrl+C to stop")
+    try:
+        stats = asyncio.run(consume(source, state, sink, args.max_events))
+    except KeyboardInterrupt:
+        return
+    print(json.dumps(stats, indent=2))
+    return stats
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""index_advisor.py
+
+Index and partition advisor for the measurement table.
+
+Every query in the project filters on some mix of `metric`, `team`,
+`playername` and `data_source` and often ranges or groups on `timestamp`.
+This tool collects those queries, runs EXPLAIN against the configured
+database (MySQL, or a SQLite stand-in via DB_URL / --url), proposes
+composite/covering indexes, optionally creates them and reports the
+before/after latency of every query.
+
+Usage:
+    python index_advisor.py                 # explain + propose only
+    python index_advisor.py --apply         # create indexes and re-time
+    python index_advisor.py --url sqlite:///standin.db --apply
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from db import METRICS, get_engine, table_name
+
+
+METRICS_IN = "','".join(METRICS)
+BASKETBALL_IN = "'Mens Basketball', 'Womens Basketball', 'Men''s Basketball', 'Women''s Basketball'"
+
+# Queries issued by the project scripts and notebooks, keyed by origin.
+# `{table}` is substituted with the configured table name.
+PROJECT_QUERIES = {
+    'part1.unique_athletes': "select count(distinct playername) as unique_athletes from {table}",
+    'part1.unique_teams': "select count(distinct team) as unique_teams from {table}",
+    'part1.data_range': "select min(timestamp) as earliest, max(timestamp) as latest from {table}",
+    'part1.most_records': "select data_source, count(*) as records from {table} group by data_source order by records desc",
+    'part1.missing_names': "select count(*) as missing_names from {table} where playername is null or playername in ('NA', 'N/A', 'na', 'n/a')",
+    'part1.multiple_sources': """
+select count(*) as num_players from (
+    select playername from {table} group by playername having count(distinct data_source) >= 2
+) t""",
+    'part1.top_metrics_hawkins': """
+SELECT data_source, metric AS metric_name, COUNT(*) AS record_count,
+       MIN(timestamp) AS earliest_date, MAX(timestamp) AS latest_date,
+       COUNT(DISTINCT timestamp) AS unique_dates
+FROM {table}
+WHERE data_source = 'hawkins'
+GROUP BY metric
+ORDER BY record_count DESC
+LIMIT 10""",
+    'part1.top_metrics_kinexon': """
+SELECT data_source, metric AS metric_name, COUNT(*) AS record_count,
+       MIN(timestamp) AS earliest_date, MAX(timestamp) AS latest_date,
+       COUNT(DISTINCT timestamp) AS unique_dates
+FROM {table}
+WHERE data_source = 'kinexon'
+GROUP BY metric
+ORDER BY record_count DESC
+LIMIT 10""",
+    'part1.top_metrics_vald': """
+SELECT data_source, metric AS metric_name, COUNT(*) AS record_count,
+       MIN(timestamp) AS earliest_date, MAX(timestamp) AS latest_date,
+       COUNT(DISTINCT timestamp) AS unique_dates
+FROM {table}
+WHERE data_source = 'Vald'
+GROUP BY metric
+ORDER BY record_count DESC
+LIMIT 10""",
+    'part2.null_zero': f"""
+SELECT metric, COUNT(*) as total_records,
+       SUM(CASE WHEN value IS NULL THEN 1 ELSE 0 END) as null_count,
+       SUM(CASE WHEN value = 0 THEN 1 ELSE 0 END) as zero_count
+FROM {{table}}
+WHERE metric IN ('{METRICS_IN}')
+GROUP BY metric""",
+    'part2.team_coverage': f"""
+SELECT team, metric, COUNT(DISTINCT playername) as total_athletes,
+       SUM(CASE WHEN measurement_count >= 5 THEN 1 ELSE 0 END) as athletes_with_5plus
+FROM (
+    SELECT playername, team, metric, COUNT(*) as measurement_count
+    FROM {{table}}
+    WHERE value IS NOT NULL AND metric IN ('{METRICS_IN}')
+    GROUP BY playername, team, metric
+) subquery
+GROUP BY team, metric
+ORDER BY team, metric""",
+    'part2.last_tested': f"""
+SELECT playername, team, metric, MAX(timestamp) AS last_measurement_date
+FROM {{table}}
+WHERE metric IN ('{METRICS_IN}') AND value IS NOT NULL
+GROUP BY playername, team, metric""",
+    'part2.metric_fetch': f"""
+SELECT playername, team, metric, value, timestamp
+FROM {{table}}
+WHERE metric IN ('{METRICS_IN}') AND value IS NOT NULL
+ORDER BY team, playername, metric, timestamp""",
+    'part4.accel_basketball': f"""
+SELECT playername, team, metric, value, timestamp
+FROM {{table}}
+WHERE metric = 'accel_load_accum' AND value IS NOT NULL
+  AND team IN ({BASKETBALL_IN})
+ORDER BY playername, timestamp""",
+    'part4.bilateral_basketball': f"""
+SELECT playername, team, metric, value, timestamp
+FROM {{table}}
+WHERE metric IN ('leftMaxForce', 'rightMaxForce') AND value IS NOT NULL
+  AND team IN ({BASKETBALL_IN})
+ORDER BY playername, timestamp""",
+    'test2.team_metrics': """
+SELECT metric, COUNT(DISTINCT playername) as num_athletes, COUNT(*) as num_measurements
+FROM {table}
+WHERE team = 'Mens Basketball' AND value IS NOT NULL
+GROUP BY metric""",
+    'notebook.team_list': f"""
+SELECT team, COUNT(DISTINCT playername) as athlete_count
+FROM {{table}}
+WHERE metric IN ('{METRICS_IN}')
+GROUP BY team
+ORDER BY athlete_count DESC""",
+    'notebook.comparison_data': f"""
+SELECT playername, timestamp, metric, value, team
+FROM {{table}}
+WHERE team IN ('Mens Basketball', 'Football') AND metric IN ('{METRICS_IN}') AND value IS NOT NULL
+ORDER BY timestamp""",
+}
+
+COLUMNS = ['metric', 'data_source', 'team', 'playername', 'timestamp', 'value']
+# Equality columns are ordered from the most to the least common filter so
+# that the proposed indexes share prefixes and can be merged.
+EQUALITY_ORDER = ['metric', 'data_source', 'team', 'playername']
+MAX_INDEX_COLUMNS = 5
+
+
+def project_queries(table: str | None = None) -> dict[str, str]:
+    """Return the project's queries with the table name filled in."""
+    table = table or table_name()
+    return {name: sql.format(table=table).strip() for name, sql in PROJECT_QUERIES.items()}
+
+
+@contextmanager
+def capture_queries(engine):
+    """Record every SELECT the engine executes inside the block.
+
+    Yields a list that fills up with the statement text, so any project
+    function can be run under the advisor to collect its real queries.
+    """
+    from sqlalchemy import event
+
+    captured: list[str] = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().lower().startswith('select'):
+            captured.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, 'before_cursor_execute', _record)
+
+
+def _normalize(sql: str) -> str:
+    """Lower-case, collapse whitespace and replace literals and IN lists."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\s+', ' ', sql).lower()
+    return re.sub(r'\bin\s*\([^()]*\)', 'in_list', sql)
+
+
+def _clause(sql: str, start: str, stops: list[str]) -> str:
+    """Return the text of the last `start` clause up to the next stop keyword."""
+    lower = _normalize(sql)
+    pos = lower.rfind(start)
+    if pos < 0:
+        return ''
+    end = len(lower)
+    for stop in stops:
+        idx = lower.find(stop, pos + len(start))
+        if idx >= 0:
+            end = min(end, idx)
+    return lower[pos + len(start):end]
+
+
+def query_columns(sql: str) -> dict[str, list[str]]:
+    """Classify the known columns a query uses (equality, group, other)."""
+    where = _clause(sql, ' where ', [' group by ', ' order by ', ' limit ', ')'])
+    group = _clause(sql, ' group by ', [' having ', ' order by ', ' limit ', ')'])
+    lower = _normalize(sql)
+    eq = [c for c in EQUALITY_ORDER if re.search(rf"\b{c}\s*(=|in_list)", where)]
+    grouped = [c for c in COLUMNS if re.search(rf"\b{c}\b", group) and c not in eq]
+    used = [c for c in COLUMNS if re.search(rf"\b{c}\b", lower) and c not in eq + grouped]
+    return {'equality': eq, 'group': grouped, 'other': used}
+
+
+def propose_index(sql: str) -> tuple[tuple[str, ...], int] | None:
+    """Propose a composite (ideally covering) index for one query.
+
+    Equality columns go first, then grouping columns, then the remaining
+    referenced columns (`timestamp` before `value`) so the index covers the
+    query without touching the base rows. On MySQL a TEXT column is indexed
+    by a prefix only, which rules covering out (see `prefix_columns`). Returns the columns and the
+    length of the seek prefix (equality + grouping part).
+    """
+    cols = query_columns(sql)
+    seek = cols['equality'] + cols['group']
+    if not seek:
+        return None
+    key = tuple((seek + cols['other'])[:MAX_INDEX_COLUMNS])
+    return key, min(len(seek), len(key))
+
+
+def merge_indexes(proposals: list[tuple[tuple[str, ...], int]]) -> list[tuple[str, ...]]:
+    """Drop proposals another index already serves.
+
+    An index is redundant when a wider one starts with the same seek prefix
+    and contains all of its columns (so it still covers the query).
+    """
+    ordered = sorted(set(proposals), key=lambda p: len(p[0]), reverse=True)
+    kept: list[tuple[str, ...]] = []
+    for cols, seek in ordered:
+        if not any(other[:seek] == cols[:seek] and set(cols) <= set(other) for other in kept):
+            kept.append(cols)
+    return kept
+
+
+def index_name(columns: tuple[str, ...]) -> str:
+    return 'ix_' + '_'.join(c[:6] for c in columns)
+
+
+def explain(engine, sql: str) -> pd.DataFrame:
+    """Return the query plan for `sql` on the engine's dialect."""
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    return pd.read_sql(prefix + sql, engine)
+
+
+def is_full_scan(plan: pd.DataFrame, dialect: str) -> bool:
+    """True when the plan reads the whole table instead of an index."""
+    if plan.empty:
+        return False
+    if dialect == 'sqlite':
+        detail = plan['detail'].astype(str)
+        return bool((detail.str.startswith('SCAN') & ~detail.str.contains('INDEX')).any())
+    return bool((plan['type'].astype(str).str.upper() == 'ALL').any())
+
+
+def plan_summary(plan: pd.DataFrame, dialect: str) -> str:
+    if plan.empty:
+        return ''
+    if dialect == 'sqlite':
+        return '; '.join(plan['detail'].astype(str))
+    return '; '.join(f"{r.get('type')}:{r.get('key')}" for _, r in plan.iterrows())
+
+
+def time_query(engine, sql: str, repeat: int = 3) -> float:
+    """Best-of-`repeat` wall time in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pd.read_sql(sql, engine)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def analyze(engine, queries: dict[str, str], repeat: int = 3) -> pd.DataFrame:
+    """Explain and time every query; queries the dialect rejects are kept with an error."""
+    dialect = engine.dialect.name
+    rows = []
+    for name, sql in queries.items():
+        try:
+            plan = explain(engine, sql)
+            rows.append({
+                'query': name,
+                'full_scan': is_full_scan(plan, dialect),
+                'plan': plan_summary(plan, dialect),
+                'ms': round(time_query(engine, sql, repeat), 2),
+            })
+        except Exception as exc:
+            rows.append({'query': name, 'full_scan': None, 'plan': f"error: {str(exc).splitlines()[0]}", 'ms': None})
+    return pd.DataFrame(rows)
+
+
+def recommend(queries: dict[str, str]) -> list[tuple[str, ...]]:
+    """Composite index recommendations covering all queries."""
+    proposals = [propose_index(sql) for sql in queries.values()]
+    return merge_indexes([p for p in proposals if p])
+
+
+def existing_indexes(engine, table: str) -> set[str]:
+    from sqlalchemy import inspect
+
+    return {ix['name'] for ix in inspect(engine).get_indexes(table)}
+
+
+def apply_indexes(engine, table: str, indexes: list[tuple[str, ...]]) -> list[str]:
+    """Create the recommended indexes that do not exist yet; return their names."""
+    from sqlalchemy import text
+
+    present = existing_indexes(engine, table)
+    created = []
+    for cols in indexes:
+        name = index_name(cols)
+        if name in present:
+            continue
+        prefixed = prefix_columns(engine, table, cols)
+        quoted = ', '.join(_quote_column(engine, c, prefixed) for c in cols)
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX {name} ON {table} ({quoted})"))
+        created.append(name)
+    return created
+
+
+def drop_indexes(engine, table: str, indexes: list[tuple[str, ...]]) -> list[str]:
+    """Remove advisor-created indexes (to restore the original schema)."""
+    from sqlalchemy import text
+
+    present = existing_indexes(engine, table)
+    dropped = []
+    for cols in indexes:
+        name = index_name(cols)
+        if name not in present:
+            continue
+        stmt = f"DROP INDEX {name}" if engine.dialect.name == 'sqlite' else f"DROP INDEX {name} ON {table}"
+        with engine.begin() as conn:
+            conn.execute(text(stmt))
+        dropped.append(name)
+    return dropped
+
+
+def column_types(engine, table: str) -> dict[str, str]:
+    """Upper-case declared type of every column, e.g. {'team': 'TEXT', 'timestamp': 'DATETIME'}."""
+    from sqlalchemy import inspect
+
+    return {c['name']: str(c['type']).split('(')[0].upper() for c in inspect(engine).get_columns(table)}
+
+
+def prefix_columns(engine, table: str, columns: tuple[str, ...]) -> list[str]:
+    """Columns MySQL can only index by a prefix (TEXT/BLOB); such an index cannot cover a query."""
+    if engine.dialect.name != 'mysql':
+        return []
+    types = column_types(engine, table)
+    return [c for c in columns if types.get(c, '').endswith(('TEXT', 'BLOB'))]
+
+
+def _quote_column(engine, column: str, prefixed: list[str]) -> str:
+    # MySQL cannot index TEXT columns without a prefix length; VARCHAR columns are indexed whole
+    quoted = engine.dialect.identifier_preparer.quote(column)
+    return f"{quoted}(64)" if column in prefixed else quoted
+
+
+def suggest_partitioning(table: str, column_type: str = 'DATETIME') -> str:
+    """MySQL DDL for yearly RANGE partitioning on timestamp (printed, never applied).
+
+    A TIMESTAMP column is partitioned on UNIX_TIMESTAMP() (YEAR() is rejected
+    for TIMESTAMP); DATETIME and DATE use RANGE COLUMNS on the value itself.
+    Any other type has to be converted to DATETIME first. Partitioning also
+    requires `timestamp` in every unique key, which the project does not
+    control, so the statement is left for the DBA.
+    """
+    years = range(2019, 2028)
+    if column_type == 'TIMESTAMP':
+        scheme = 'RANGE (UNIX_TIMESTAMP(timestamp))'
+        bounds = [f"UNIX_TIMESTAMP('{y}-01-01 00:00:00')" for y in years]
+    else:
+        scheme = 'RANGE COLUMNS (timestamp)'
+        bounds = [f"'{y}-01-01'" for y in years]
+    parts = ',\n    '.join(f"PARTITION p{y - 1} VALUES LESS THAN ({b})" for y, b in zip(years, bounds))
+    note = ('' if column_type in ('TIMESTAMP', 'DATETIME', 'DATE') else
+            f"-- timestamp is {column_type or 'unknown'}: ALTER TABLE {table} MODIFY timestamp DATETIME first\n")
+    return (f"{note}ALTER TABLE {table}\nPARTITION BY {scheme} (\n    {parts},\n"
+            f"    PARTITION pmax VALUES LESS THAN MAXVALUE\n);")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='SQLAlchemy URL (defaults to DB_URL or the .env MySQL credentials)')
+    parser.add_argument('--table', help='table name (defaults to DB_TABLE)')
+    parser.add_argument('--apply', action='store_true', help='create the recommended indexes and re-time every query')
+    parser.add_argument('--drop', action='store_true', help='drop previously created advisor indexes and exit')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions per query (best-of)')
+    args = parser.parse_args(argv)
+
+    engine = get_engine(args.url)
+    table = args.table or table_name()
+    queries = project_queries(table)
+    indexes = recommend(queries)
+
+    if args.drop:
+        print(f"Dropped: {drop_indexes(engine, table, indexes) or 'nothing'}")
+        return
+
+    print(f"== Query plans before indexing ({engine.dialect.name}) ==")
+    before = analyze(engine, queries, args.repeat)
+    print(before.to_string(index=False))
+
+    print('\n== Recommended composite indexes ==')
+    for cols in indexes:
+        prefixed = prefix_columns(engine, table, cols)
+        caveat = f"  -- not covering: prefix index on TEXT {', '.join(prefixed)}" if prefixed else ''
+        print(f"  {index_name(cols)} ({', '.join(cols)}){caveat}")
+    print('\n== Suggested partitioning (MySQL, not applied) ==')
+    print(suggest_partitioning(table, column_types(engine, table).get('timestamp', '')))
+
+    if not args.apply:
+        print('\nRun with --apply to create the indexes and compare latency.')
+        return
+
+    created = apply_indexes(engine, table, indexes)
+    print(f"\nCreated indexes: {created or 'none (already present)'}")
+    after = analyze(engine, queries, args.repeat)
+    report = before[['query', 'full_scan', 'ms']].merge(
+        after[['query', 'full_scan', 'ms', 'plan']], on='query', suffixes=('_before', '_after'))
+    report['speedup'] = (report['ms_before'] / report['ms_after']).round(2)
+    print('\n== Before/after latency per query ==')
+    print(report.to_string(index=False))
+    return report
+
+
+if __name__ == '__main__':
+    main()
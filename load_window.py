@@ -0,0 +1,189 @@
+"""load_window.py
+
+Join every force-plate test with the athlete's trailing Kinexon load.
+
+Force-plate tests (VALD/Hawkins: leftMaxForce, rightMaxForce, Jump Height,
+Peak Propulsive Force) are one row per (player, timestamp) with the part4
+asymmetry_pct. For each test and each window of N days the join adds the
+athlete's Kinexon readings in [test - N days, test):
+
+    <load>_<N>d_sum / _sessions / _mean
+
+plus an as-of join of the last load reading before the test
+(`<load>_last`, `days_since_<load>`).
+
+Both sides are sorted once by (athlete, time) into a single int64 key, so a
+window is two `np.searchsorted` calls for all tests at once and the sums come
+from a cumulative sum; there is no per-test filtering.
+
+The command line reads the tests from the force-plate session table
+(sessions.py) and the loads from the Kinexon table of sources.py;
+`force_plate_tests` builds the same tests from long EAV rows.
+
+Usage:
+    from load_window import window_join
+    joined = window_join(tests, loads, days=[7, 28])
+
+    python load_window.py                          # 7/28-day accel_load_accum -> load_window.csv
+    python load_window.py --days 3 7 14 --load distance_total --verify 200
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+from sessions import force_plate_sessions
+from sources import ingest
+
+
+TEST_METRICS = ['leftMaxForce', 'rightMaxForce', 'Jump Height(m)', 'Peak Propulsive Force(N)']
+LOAD_METRICS = ['accel_load_accum', 'distance_total']
+DEFAULT_DAYS = [7, 28]
+DAY_S = 86_400
+OUTPUT_PATH = Path(__file__).resolve().parent / 'load_window.csv'
+
+
+def _seconds(ts: pd.Series) -> np.ndarray:
+    return pd.to_datetime(ts).to_numpy('datetime64[s]').astype(np.int64)
+
+
+def _keys(test_who: pd.Series, test_ts: pd.Series, load_who: pd.Series, load_ts: pd.Series,
+          lookback_s: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """(athlete, time) -> one int64 per row, ordered by athlete then time on both sides.
+
+    Keys are `athlete_code * span + seconds`; times are shifted by
+    `lookback_s` so `key - window` never reaches the previous athlete's block.
+    Returns (test keys, load keys, span).
+    """
+    codes, _ = pd.factorize(pd.concat([test_who, load_who], ignore_index=True))
+    t_sec, l_sec = _seconds(test_ts), _seconds(load_ts)
+    t0 = min(t_sec.min(initial=0), l_sec.min(initial=0))
+    span = max(t_sec.max(initial=0), l_sec.max(initial=0)) - t0 + lookback_s + 1
+    key = codes.astype(np.int64) * span + np.r_[t_sec, l_sec] - t0 + lookback_s
+    return key[:len(t_sec)], key[len(t_sec):], span
+
+
+@profiled('load_window.join')
+def window_join(tests: pd.DataFrame, loads: pd.DataFrame, days: list[int] = DEFAULT_DAYS,
+                prefix: str = 'load', by: str = 'playername', time: str = 'timestamp',
+                value: str = 'value') -> pd.DataFrame:
+    """Add trailing-window sums/counts/means and an as-of last reading of `loads` to every test.
+
+    Windows are [test - N days, test): a load recorded at the test time is
+    not counted as preceding it. Tests with no timestamp (NaT) or athlete get
+    NaN for every window column.
+    """
+    loads = loads.dropna(subset=[value, time, by])
+    # keys are built for dated tests only (NaT would become int64.min seconds)
+    valid = (pd.to_datetime(tests[time]).notna() & tests[by].notna()).to_numpy()
+    tkey, lkey, span = _keys(tests[by][valid], tests[time][valid], loads[by], loads[time], max(days, default=0) * DAY_S)
+    order = np.argsort(lkey, kind='stable')
+    lkey = lkey[order]
+    lval = loads[value].to_numpy(float)[order]
+    csum = np.r_[0.0, np.cumsum(lval)]
+
+    def scatter(values, fill=np.nan):
+        full = np.full(len(tests), fill, dtype=np.result_type(values, type(fill)))
+        full[valid] = values
+        return full
+
+    out = tests.copy()
+    hi = np.searchsorted(lkey, tkey, side='left')
+    for n in days:
+        lo = np.searchsorted(lkey, tkey - n * DAY_S, side='left')
+        count = hi - lo
+        total = csum[hi] - csum[lo]
+        out[f"{prefix}_{n}d_sum"] = scatter(total)
+        out[f"{prefix}_{n}d_sessions"] = count if valid.all() else scatter(count)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[f"{prefix}_{n}d_mean"] = scatter(np.where(count > 0, total / count, np.nan))
+
+    # As-of: the reading just before `hi`, if it falls in the same athlete block.
+    prev = hi - 1
+    same = prev >= 0
+    same[same] = lkey[prev[same]] // span == tkey[same] // span
+    load_ts = pd.to_datetime(loads[time]).to_numpy('datetime64[ns]')[order]
+    last_value = np.full(len(tkey), np.nan)
+    last_ts = np.full(len(tkey), np.datetime64('NaT'), dtype='datetime64[ns]')
+    last_value[same] = lval[prev[same]]
+    last_ts[same] = load_ts[prev[same]]
+    out[f"{prefix}_last"] = scatter(last_value)
+    out[f"days_since_{prefix}"] = (pd.to_datetime(out[time]).to_numpy('datetime64[ns]')
+                                   - scatter(last_ts, np.datetime64('NaT', 'ns'))) / np.timedelta64(1, 'D')
+    return out
+
+
+def force_plate_tests(df: pd.DataFrame) -> pd.DataFrame:
+    """One row per (player, team, timestamp) force-plate session with asymmetry_pct."""
+    tests = df[df['metric'].isin(TEST_METRICS)]
+    wide = tests.pivot_table(index=['playername', 'team', 'timestamp'], columns='metric',
+                             values='value', aggfunc='mean').reset_index()
+    wide.columns.name = None
+    if {'leftMaxForce', 'rightMaxForce'}.issubset(wide.columns):
+        sides = wide[['leftMaxForce', 'rightMaxForce']]
+        strong, weak = sides.max(axis=1, skipna=False), sides.min(axis=1, skipna=False)
+        wide['asymmetry_pct'] = (strong - weak) / strong * 100
+    return wide.sort_values(['playername', 'timestamp']).reset_index(drop=True)
+
+
+def verify(tests: pd.DataFrame, loads: pd.DataFrame, joined: pd.DataFrame, days: list[int],
+           prefix: str, n: int = 100, seed: int = 0) -> int:
+    """Recompute `n` sampled tests with per-test filters; returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(tests), size=min(n, len(tests)), replace=False)
+    bad = 0
+    for i in sample:
+        row = tests.iloc[i]
+        mine = loads[loads['playername'] == row['playername']]
+        for d in days:
+            win = mine[(mine['timestamp'] >= row['timestamp'] - pd.Timedelta(days=d)) & (mine['timestamp'] < row['timestamp'])]
+            got = joined.iloc[i][[f"{prefix}_{d}d_sum", f"{prefix}_{d}d_sessions"]]
+            if len(win) != got.iloc[1] or not np.isclose(win['value'].sum(), got.iloc[0]):
+                bad += 1
+    print(f"Verified {len(sample)} tests x {len(days)} windows against per-test filters: {bad} mismatches")
+    return bad
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Join force-plate tests with each athlete's trailing Kinexon load.")
+    parser.add_argument('--days', type=int, nargs='+', default=DEFAULT_DAYS, help='trailing window lengths in days')
+    parser.add_argument('--load', choices=LOAD_METRICS, default='accel_load_accum', help='Kinexon metric to sum')
+    parser.add_argument('--output', type=Path, default=OUTPUT_PATH, help='CSV output path')
+    parser.add_argument('--verify', type=int, default=0, metavar='N', help='cross-check N sampled tests with per-test filters')
+    args = parser.parse_args(argv)
+
+    sessions = force_plate_sessions(metrics=TEST_METRICS).astype({'playername': object, 'team': object})
+    tests = sessions[['playername', 'team', 'timestamp'] + sorted(TEST_METRICS) + ['asymmetry_pct']]
+    loads = (ingest(['kinexon'])['kinexon'].dropna(subset=[args.load])
+             .rename(columns={args.load: 'value'})[['playername', 'team', 'timestamp', 'value']]
+             .astype({'playername': object, 'team': object})
+             .sort_values(['playername', 'timestamp']))
+    joined = window_join(tests, loads, args.days, prefix=args.load)
+    joined.to_csv(args.output, index=False)
+
+    print("="*80)
+    print(f"FORCE-PLATE TESTS x TRAILING {args.load} ({', '.join(f'{d}d' for d in args.days)})")
+    print("="*80)
+    print(f"{len(tests)} tests, {len(loads)} load readings")
+    longest = max(args.days)
+    covered = joined[f"{args.load}_{longest}d_sessions"] > 0
+    print(f"Tests with any load in the preceding {longest} days: {int(covered.sum())}")
+    if 'asymmetry_pct' in joined.columns:
+        print("\nSpearman correlation of trailing load with asymmetry_pct:")
+        for d in args.days:
+            sub = joined[joined[f"{args.load}_{d}d_sessions"] > 0]
+            r = sub[f"{args.load}_{d}d_sum"].corr(sub['asymmetry_pct'], method='spearman')
+            print(f"  {d:>3}d: r={r:.3f} (n={sub['asymmetry_pct'].notna().sum()})")
+    print(f"\nWrote {args.output}")
+
+    if args.verify and verify(tests, loads, joined, args.days, args.load, args.verify):
+        raise SystemExit(1)
+    return joined
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""manifest.py
+
+Run manifests and a content-addressed artifact cache.
+
+A `Run` records what a script did: the queries it issued through
+`cached_read_sql` (SQL text, source-table watermarks, row counts, cache hit),
+its config (rule thresholds, policies, arguments) and the intermediate
+artifacts it produced (team means, player means, thresholds, pairing
+results, flags). The manifest is written to `.artifacts/runs/<run_id>.json`.
+
+Artifacts are stored by content under `.artifacts/objects/`: a DataFrame is
+identified by a SHA-256 of its column names, dtypes and
+`pd.util.hash_pandas_object`, so identical results across runs are stored
+once. `Run.cached(name, func, *inputs)` memoises a pure computation on the
+digests of its inputs, its parameters and the source file of `func`. A rerun
+with the same inputs loads the stored result instead of recomputing it.
+
+Two runs can be compared artifact by artifact (rows added, removed and
+changed on the key columns), and `why` lists every recorded row for one
+athlete, e.g. why PLAYER_252 was flagged, without rerunning anything.
+
+Usage:
+    from manifest import Run
+    with Run('part4_flags', config={...}) as run:
+        df = load_accel(conn)                   # queries are recorded automatically
+        means = run.cached('team_means', compute_team_means, df)
+        run.record('flags', report)
+
+    python manifest.py list
+    python manifest.py show part4_flags                 # latest run of a script (or a run id)
+    python manifest.py diff part4_flags~1 part4_flags   # previous vs latest
+    python manifest.py why PLAYER_252 --run part4_flags
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import query_cache
+
+
+ARTIFACT_DIR = Path(os.getenv('ARTIFACT_DIR', Path(__file__).resolve().parent / '.artifacts'))
+PLAYER_COLUMNS = ['playername', 'Player Name', 'player_name']
+
+
+def _json(obj) -> str:
+    return json.dumps(obj, sort_keys=True, default=str)
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Content hash of a DataFrame (values, index, column names and dtypes)."""
+    h = hashlib.sha256(_json([[str(c), str(t)] for c, t in df.dtypes.items()]).encode())
+    h.update(_json(list(df.index.names)).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def digest(obj) -> str:
+    if isinstance(obj, pd.Series):
+        obj = obj.to_frame()
+    if isinstance(obj, pd.DataFrame):
+        return frame_digest(obj)
+    return hashlib.sha256(_json(obj).encode()).hexdigest()
+
+
+def code_digest(func) -> str:
+    """Hash of the source file that defines `func` (any edit there invalidates its cache)."""
+    path = inspect.getsourcefile(inspect.unwrap(func))
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest() if path else ''
+
+
+class ArtifactStore:
+    """Content-addressed objects (DataFrames as Feather, everything else as JSON) plus a memo index."""
+
+    def __init__(self, root: Path = ARTIFACT_DIR):
+        self.root = Path(root)
+
+    def _object(self, key: str, suffix: str) -> Path:
+        return self.root / 'objects' / key[:2] / f'{key}{suffix}'
+
+    def put(self, obj) -> str:
+        key = digest(obj)
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            path = self._object(key, '.feather')
+            if not path.exists():
+                frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+                meta = {'index': list(frame.index.names) if not isinstance(frame.index, pd.RangeIndex) else None,
+                        'columns': [str(c) for c in frame.columns], 'series': isinstance(obj, pd.Series)}
+                # copy before renaming so the recorded frame keeps its column labels
+                flat = frame.reset_index() if meta['index'] else frame.copy(deep=False)
+                flat.columns = [str(c) for c in flat.columns]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix('.tmp')
+                flat.to_feather(tmp)
+                tmp.replace(path)
+                path.with_suffix('.json').write_text(_json(meta))
+        else:
+            path = self._object(key, '.obj.json')
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(_json(obj))
+        return key
+
+    def get(self, key: str):
+        path = self._object(key, '.feather')
+        if path.exists():
+            meta = json.loads(path.with_suffix('.json').read_text())
+            frame = pd.read_feather(path)
+            if meta['index']:
+                frame = frame.set_index(list(frame.columns[:len(meta['index'])]))
+                frame.index.names = meta['index']
+            return frame.iloc[:, 0] if meta['series'] else frame
+        return json.loads(self._object(key, '.obj.json').read_text())
+
+    def memo_get(self, key: str) -> str | None:
+        path = self.root / 'memo' / f'{key}.json'
+        if not path.exists():
+            return None
+        ref = json.loads(path.read_text())['artifact']
+        return ref if (self._object(ref, '.feather').exists() or self._object(ref, '.obj.json').exists()) else None
+
+    def memo_put(self, key: str, ref: str, name: str) -> None:
+        path = self.root / 'memo' / f'{key}.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(_json({'artifact': ref, 'name': name, 'created': time.time()}))
+
+
+class Run:
+    """Context manager that writes a manifest of one script run."""
+
+    def __init__(self, script: str, config: dict | None = None, store: ArtifactStore | None = None):
+        self.store = store or ArtifactStore()
+        self.script = script
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.manifest = {
+            'run_id': self.run_id, 'script': script, 'argv': sys.argv[1:],
+            'config': json.loads(_json(config or {})), 'queries': [], 'artifacts': {},
+        }
+
+    def __enter__(self) -> 'Run':
+        self._start = time.perf_counter()
+        self.manifest['started'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        query_cache.QUERY_LISTENERS.append(self._on_query)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        query_cache.QUERY_LISTENERS.remove(self._on_query)
+        self.manifest['finished'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.manifest['seconds'] = round(time.perf_counter() - self._start, 3)
+        self.manifest['status'] = 'failed' if exc_type else 'ok'
+        path = self.store.root / 'runs' / f'{self.run_id}.json'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.manifest, indent=2, sort_keys=True, default=str))
+        return False
+
+    def _on_query(self, sql: str, watermarks: dict, df: pd.DataFrame, hit: bool) -> None:
+        self.manifest['queries'].append({'sql': query_cache.normalize_sql(sql), 'watermarks': watermarks,
+                                         'rows': len(df), 'cache_hit': hit})
+
+    def _entry(self, name: str, obj, ref: str, cached: bool) -> None:
+        entry = {'digest': ref, 'cached': cached}
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            entry.update(rows=len(obj), columns=[str(c) for c in (obj.to_frame() if isinstance(obj, pd.Series) else obj).columns])
+        self.manifest['artifacts'][name] = entry
+
+    def record(self, name: str, obj):
+        """Store `obj` (DataFrame, Series or JSON-able value) as an artifact of this run; returns it."""
+        self._entry(name, obj, self.store.put(obj), cached=False)
+        return obj
+
+    def cached(self, name: str, func, *inputs, **params):
+        """`func(*inputs, **params)`, loaded from the store when the same inputs were seen before."""
+        key = digest({'name': name, 'func': f"{func.__module__}.{func.__qualname__}", 'code': code_digest(func),
+                      'inputs': [digest(i) for i in inputs], 'params': params})
+        ref = self.store.memo_get(key)
+        if ref is not None:
+            obj = self.store.get(ref)
+            self._entry(name, obj, ref, cached=True)
+            return obj
+        obj = func(*inputs, **params)
+        ref = self.store.put(obj)
+        self.store.memo_put(key, ref, name)
+        self._entry(name, obj, ref, cached=False)
+        return obj
+
+
+# ------------------------------------------------------------------ reading runs
+
+def runs(root: Path = ARTIFACT_DIR) -> pd.DataFrame:
+    """One row per manifest, oldest first."""
+    rows = []
+    for path in sorted((root / 'runs').glob('*.json')):
+        m = json.loads(path.read_text())
+        rows.append({'run_id': m['run_id'], 'script': m['script'], 'started': m.get('started'),
+                     'seconds': m.get('seconds'), 'status': m.get('status'), 'queries': len(m['queries']),
+                     'artifacts': len(m['artifacts'])})
+    return pd.DataFrame(rows, columns=['run_id', 'script', 'started', 'seconds', 'status', 'queries', 'artifacts'])
+
+
+def resolve(ref: str, root: Path = ARTIFACT_DIR) -> dict:
+    """Manifest for a run id (or unique prefix), a script name (latest run) or `script~N` (N runs back)."""
+    table = runs(root)
+    script, _, back = ref.partition('~')
+    mine = table[table['script'] == script]
+    if not mine.empty:
+        n = int(back or 0)
+        if n >= len(mine):
+            raise SystemExit(f"{script} has only {len(mine)} recorded runs")
+        run_id = mine['run_id'].iloc[-1 - n]
+    else:
+        match = table[table['run_id'].str.startswith(ref)]
+        if len(match) != 1:
+            raise SystemExit(f"No unique run matches {ref!r}")
+        run_id = match['run_id'].iloc[0]
+    return json.loads((root / 'runs' / f'{run_id}.json').read_text())
+
+
+def frame_diff(a: pd.DataFrame, b: pd.DataFrame, key: list[str] | None = None, tol: float = 1e-9) -> dict:
+    """Rows only in `a`, only in `b`, and rows whose non-key values changed (matched on `key`)."""
+    a = a.reset_index() if not isinstance(a.index, pd.RangeIndex) else a
+    b = b.reset_index() if not isinstance(b.index, pd.RangeIndex) else b
+    if key is None:
+        key = [c for c in a.columns if c in b.columns and not pd.api.types.is_float_dtype(a[c])]
+    values = [c for c in a.columns if c in b.columns and c not in key]
+    merged = a.drop_duplicates(key).merge(b.drop_duplicates(key), on=key, how='outer',
+                                          suffixes=('_a', '_b'), indicator=True)
+    both = merged[merged['_merge'] == 'both']
+    changed = np.zeros(len(both), dtype=bool)
+    for c in values:
+        x, y = both[f'{c}_a'], both[f'{c}_b']
+        if pd.api.types.is_numeric_dtype(x) and pd.api.types.is_numeric_dtype(y):
+            differs = ~np.isclose(x.to_numpy(float), y.to_numpy(float), rtol=tol, atol=tol, equal_nan=True)
+        else:
+            differs = ~((x == y) | (x.isna() & y.isna())).to_numpy()
+        changed |= differs
+    return {
+        'key': key,
+        'only_a': merged.loc[merged['_merge'] == 'left_only', key],
+        'only_b': merged.loc[merged['_merge'] == 'right_only', key],
+        'changed': both.loc[changed].drop(columns='_merge'),
+    }
+
+
+def diff_runs(a: dict, b: dict, store: ArtifactStore | None = None, show: int = 10) -> None:
+    store = store or ArtifactStore()
+    print("="*80)
+    print(f"DIFF {a['run_id']} ({a['script']}) -> {b['run_id']} ({b['script']})")
+    print("="*80)
+    for section in ['config', 'argv']:
+        if a.get(section) != b.get(section):
+            print(f"{section}: {_json(a.get(section))} -> {_json(b.get(section))}")
+    marks_a = {q['sql']: q['watermarks'] for q in a['queries']}
+    for q in b['queries']:
+        if q['sql'] in marks_a and marks_a[q['sql']] != q['watermarks']:
+            print(f"watermark changed: {marks_a[q['sql']]} -> {q['watermarks']}  ({q['sql'][:60]}...)")
+    for name in sorted(set(a['artifacts']) | set(b['artifacts'])):
+        ea, eb = a['artifacts'].get(name), b['artifacts'].get(name)
+        if ea is None or eb is None:
+            print(f"\n{name}: only in {'b' if ea is None else 'a'}")
+            continue
+        if ea['digest'] == eb['digest']:
+            print(f"\n{name}: identical ({ea.get('rows', '-')} rows)")
+            continue
+        obj_a, obj_b = store.get(ea['digest']), store.get(eb['digest'])
+        if not isinstance(obj_a, (pd.DataFrame, pd.Series)):
+            print(f"\n{name}: {_json(obj_a)} -> {_json(obj_b)}")
+            continue
+        d = frame_diff(obj_a.to_frame() if isinstance(obj_a, pd.Series) else obj_a,
+                       obj_b.to_frame() if isinstance(obj_b, pd.Series) else obj_b)
+        print(f"\n{name}: {len(d['only_a'])} removed, {len(d['only_b'])} added, {len(d['changed'])} changed "
+              f"(key: {', '.join(map(str, d['key']))})")
+        for label, rows in [('removed', d['only_a']), ('added', d['only_b']), ('changed', d['changed'])]:
+            if len(rows):
+                print(f"  {label}:")
+                print(rows.head(show).to_string(index=False))
+
+
+def why(player: str, manifest: dict, store: ArtifactStore | None = None) -> dict[str, pd.DataFrame]:
+    """Rows for `player` in every DataFrame artifact of a run."""
+    store = store or ArtifactStore()
+    found = {}
+    for name, entry in manifest['artifacts'].items():
+        obj = store.get(entry['digest'])
+        if isinstance(obj, pd.Series):
+            obj = obj.to_frame()
+        if not isinstance(obj, pd.DataFrame):
+            continue
+        frame = obj.reset_index() if not isinstance(obj.index, pd.RangeIndex) else obj
+        col = next((c for c in PLAYER_COLUMNS if c in frame.columns), None)
+        if col is not None and (frame[col] == player).any():
+            found[name] = frame[frame[col] == player]
+    return found
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Inspect, compare and query recorded run manifests.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help='all recorded runs')
+    p = sub.add_parser('show', help='one manifest')
+    p.add_argument('run', help='run id (prefix), script name, or script~N')
+    p = sub.add_parser('diff', help='compare the artifacts of two runs')
+    p.add_argument('a')
+    p.add_argument('b')
+    p.add_argument('--rows', type=int, default=10, help='sample rows to print per change type')
+    p = sub.add_parser('why', help="an athlete's rows in every artifact of a run")
+    p.add_argument('player')
+    p.add_argument('--run', default='part4_flags', help='run id, script name or script~N (default: part4_flags)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        table = runs()
+        print(table.to_string(index=False) if not table.empty else f"No runs recorded in {ARTIFACT_DIR}")
+        return table
+    if args.command == 'show':
+        m = resolve(args.run)
+        print(json.dumps(m, indent=2, sort_keys=True))
+        return m
+    if args.command == 'diff':
+        diff_runs(resolve(args.a), resolve(args.b), show=args.rows)
+        return
+    m = resolve(args.run)
+    found = why(args.player, m)
+    print("="*80)
+    print(f"{args.player} IN RUN {m['run_id']} ({m['script']}, {m.get('started')})")
+    print("="*80)
+    print(f"config: {_json(m['config'])}")
+    if not found:
+        print(f"\n{args.player} does not appear in any artifact of this run")
+    for name, rows in found.items():
+        print(f"\n--- {name} ({len(rows)} rows) ---")
+        print(rows.head(20).to_string(index=False))
+    return found
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,21 @@
-from sqlalchemy import create_engine
+"""Part 1.2 / 1.3 — database exploration and metric discovery.
+
+Run `python part1_exploration.py` to print the answers; importing the module
+only defines the query functions (no database connection is made).
+"""
+import argparse
+
 import pandas as pd
-import os
-from dotenv import load_dotenv
-from pathlib import Path
 
-#Find the exact path to the .env file and load the environment variables
-env_path = Path(__file__).resolve().parent / ".env"
-load_dotenv(env_path)
+from db import DEFAULT_TABLE, get_engine
 
-# Retrieve database credentials from environment variables
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')  
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE')
 
-# Create the database connection
-url_string = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-conn = create_engine(url_string)
+table = DEFAULT_TABLE
+
 
 # Test the connection by naming the table and querying a sample of data
-table = "research_experiment_refactor_test"
-sample = pd.read_sql(f"select * from {table} limit 5", conn)
-print(sample)
+def sample_rows(conn, n=5):
+  return pd.read_sql(f"select * from {table} limit {int(n)}", conn)
 
 #Q1: Function to find the number of unique athletes in the database
 def unique_athletes(conn):
@@ -32,8 +25,6 @@ def unique_athletes(conn):
   """
   df = pd.read_sql(query, conn)
   return int(df.loc[0, "unique_athletes"])
-count = unique_athletes(conn)
-print(f"There are {count} unique athletes in the database.")
 
 #Q2. Function to find the number of different sports/teams in the database
 def unique_teams(conn):
@@ -43,8 +34,6 @@ def unique_teams(conn):
   """
   df = pd.read_sql(query,conn)
   return int(df.loc[0, "unique_teams"])
-count = unique_teams(conn)
-print(f"There are {count} unique teams in the database.")
 
 #Q3. Function to find the date range of the data in the database
 def data_range(conn):
@@ -55,8 +44,6 @@ def data_range(conn):
   """
   df = pd.read_sql(query, conn)
   return df.loc[0, "earliest"], df.loc[0, "latest"]
-min, max = data_range(conn)
-print(f"The date range of available data is between {min} and {max}")
 
 #Q4. Function to find which data source has the most records in the database
 def most_records(conn):
@@ -69,8 +56,6 @@ def most_records(conn):
   """
   df = pd.read_sql(query, conn)
   return df
-records = most_records(conn)
-print(f"The following are the sources with their amount of corresponding records {records}")
 
 #Q5. Function to find the number of athletes with missing or invalid names
 def missing_names(conn):
@@ -82,8 +67,6 @@ def missing_names(conn):
   """
   df = pd.read_sql(query, conn)
   return int(df.loc[0, "missing_names"])
-miss = missing_names(conn)
-print(f"There are {miss} athletes with missing or invalid names.")
 
 #Q6. Function to find the number of athletes with data from multiple sources
 def multiple_sources(conn):
@@ -97,56 +80,13 @@ def multiple_sources(conn):
   """
   df = pd.read_sql(query, conn)
   return int(df.loc[0, "num_players"])
-player = multiple_sources(conn)
-print(f"There are {player} athletes with data from multiple sources.")
 
 # 1.3. Metric Discovery and Selection
 
-# Query to find the top 10 most common metrics for Hawkins data 
-sql_toexecute_metrics = """
-SELECT
-    data_source,
-    metric AS metric_name,
-    COUNT(*) AS record_count,
-    MIN(timestamp) AS earliest_date,
-    MAX(timestamp) AS latest_date,
-    COUNT(DISTINCT timestamp) AS unique_dates
-FROM research_experiment_refactor_test
-WHERE data_source = 'hawkins'
-GROUP BY metric
-ORDER BY record_count DESC
-LIMIT 10;
-"""
-
-metrics_response = pd.read_sql(sql_toexecute_metrics, conn)
-metrics_response
-print("Top 10 most common metrics for Hawkins data:")
-print(metrics_response) 
-
-
-# Query to find the top 10 most common metrics for Kinexon data
-sql_toexecute_kinexon_metrics = """
-SELECT
-    data_source,
-    metric AS metric_name,
-    COUNT(*) AS record_count,
-    MIN(timestamp) AS earliest_date,
-    MAX(timestamp) AS latest_date,
-    COUNT(DISTINCT timestamp) AS unique_dates
-FROM research_experiment_refactor_test
-WHERE data_source = 'kinexon'
-GROUP BY metric
-ORDER BY record_count DESC
-LIMIT 10;
-"""
-
-kinexon_metrics_response = pd.read_sql(sql_toexecute_kinexon_metrics, conn)
-kinexon_metrics_response 
-print("Top 10 most common metrics for Kinexon data:")
-print(kinexon_metrics_response)
-
-# Query to find the top 10 most common metrics for Vald data
-sql_toexecute_vald_metrics = """
+# Query to find the top 10 most common metrics for one data source
+# ('hawkins', 'kinexon' or 'Vald')
+def top_metrics(conn, data_source):
+  sql_toexecute_metrics = f"""
 SELECT
     data_source,
     metric AS metric_name,
@@ -154,29 +94,81 @@ SELECT
     MIN(timestamp) AS earliest_date,
     MAX(timestamp) AS latest_date,
     COUNT(DISTINCT timestamp) AS unique_dates
-FROM research_experiment_refactor_test
-WHERE data_source = 'Vald'
+FROM {table}
+WHERE data_source = '{data_source}'
 GROUP BY metric
 ORDER BY record_count DESC
 LIMIT 10;
 """
-
-vald_metrics_response = pd.read_sql(sql_toexecute_vald_metrics, conn)
-vald_metrics_response
-print("Top 10 most common metrics for Vald data:")
-print(vald_metrics_response)
+  return pd.read_sql(sql_toexecute_metrics, conn)
 
 # Query to find the number of unique metrics across all data sources
-sql_to_execute_unique_metrics = """
+def unique_metrics(conn):
+  sql_to_execute_unique_metrics = f"""
 SELECT
     COUNT(DISTINCT metric) AS total_unique_metrics,
     COUNT(DISTINCT CASE WHEN data_source = 'hawkins' THEN metric END) AS hawkins_unique_metrics,
     COUNT(DISTINCT CASE WHEN data_source = 'kinexon' THEN metric END) AS kinexon_unique_metrics,
     COUNT(DISTINCT CASE WHEN data_source = 'Vald' THEN metric END) AS vald_unique_metrics
-FROM research_experiment_refactor_test;
+FROM {table};
 """
+  return pd.read_sql(sql_to_execute_unique_metrics, conn)
+
+
+def exact_answers(conn):
+  """Every Part 1 answer from the exact queries above."""
+  return {
+    "unique_athletes": unique_athletes(conn),
+    "unique_teams": unique_teams(conn),
+    "data_range": data_range(conn),
+    "most_records": most_records(conn),
+    "missing_names": missing_names(conn),
+    "multiple_sources": multiple_sources(conn),
+    "top_metrics": {source: top_metrics(conn, source) for source in ["hawkins", "kinexon", "Vald"]},
+    "unique_metrics": unique_metrics(conn),
+  }
+
+
+def print_answers(answers):
+  # Sketch answers carry an "errors" dict of +/- bounds (see sketches.py)
+  errors = answers.get("errors", {})
+  def bound(key):
+    return f" (approx. +/- {errors[key]:.0f})" if key in errors else ""
+
+  print(f"There are {answers['unique_athletes']} unique athletes in the database.{bound('unique_athletes')}")
+  print(f"There are {answers['unique_teams']} unique teams in the database.{bound('unique_teams')}")
+
+  earliest, latest = answers["data_range"]
+  print(f"The date range of available data is between {earliest} and {latest}")
+
+  print(f"The following are the sources with their amount of corresponding records {answers['most_records']}")
+  print(f"There are {answers['missing_names']} athletes with missing or invalid names.{bound('missing_names')}")
+  print(f"There are {answers['multiple_sources']} athletes with data from multiple sources.{bound('multiple_sources')}")
+
+  for source, label in [("hawkins", "Hawkins"), ("kinexon", "Kinexon"), ("Vald", "Vald")]:
+    print(f"Top 10 most common metrics for {label} data:")
+    print(answers["top_metrics"].get(source, pd.DataFrame()))
+
+  print("Number of unique metrics across all data sources:")
+  print(answers["unique_metrics"])
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Part 1 database exploration and metric discovery.")
+  parser.add_argument("--exact", action="store_true",
+                      help="run the exact COUNT(DISTINCT) queries instead of the incremental sketches (sketches.py)")
+  args = parser.parse_args(argv)
+
+  conn = get_engine()
+  print(sample_rows(conn))
+
+  if args.exact:
+    answers = exact_answers(conn)
+  else:
+    from sketches import refresh
+    answers = refresh(conn).answers()
+  print_answers(answers)
+
 
-unique_metrics_response = pd.read_sql(sql_to_execute_unique_metrics, conn)
-unique_metrics_response
-print("Number of unique metrics across all data sources:")
-print(unique_metrics_response) 
+if __name__ == "__main__":
+  main()
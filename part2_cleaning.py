@@ -1,30 +1,28 @@
-# 2.1 Missing Data Analysis (Group)
-
-from sqlalchemy import create_engine
-import pandas as pd
-from pathlib import Path
-import os
-from dotenv import load_dotenv
+"""Part 2 — missing data analysis, data transformation and derived metrics.
 
-env_path = Path(__file__).resolve().parent / ".env"
-load_dotenv(env_path)
-
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE')
+Run `python part2_cleaning.py` to print every section. Importing the module
+only defines the functions (for example `transform_player_metrics`); no
+database connection is made and scipy is loaded only for the z-scores.
+"""
+import argparse
 
-DB_USER
+import pandas as pd
 
-url_string = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
+from db import METRICS, get_engine, table_name
+from dedup import collapse_readings
+from manifest import Run
+from profiling import profiled
+from query_cache import cached_read_sql
+from ranking import top_bottom
+from sessions import SESSION_METRICS, force_plate_sessions
 
-conn = create_engine(url_string)
+metrics_str = "','".join(METRICS)
 
-table = "research_experiment_refactor_test"
+# 2.1 Missing Data Analysis (Group)
 
 ## Question 1: Identify which of your selected metrics have the most NULL or zero values
-query1_focused = """
+def null_zero_analysis(conn):
+    query1_focused = f"""
 SELECT
     metric,
     COUNT(*) as total_records,
@@ -32,36 +30,30 @@ SELECT
     SUM(CASE WHEN value = 0 THEN 1 ELSE 0 END) as zero_count,
     SUM(CASE WHEN value IS NULL OR value = 0 THEN 1 ELSE 0 END) as null_or_zero_count,
     ROUND(100.0 * SUM(CASE WHEN value IS NULL OR value = 0 THEN 1 ELSE 0 END) / COUNT(*), 2) as null_zero_percentage
-FROM research_experiment_refactor_test
-WHERE metric IN (
-    'accel_load_accum',
-    'Jump Height(m)',
-    'Peak Propulsive Force(N)',
-    'distance_total',
-    'leftMaxForce',
-    'rightMaxForce'
-)
+FROM {table_name()}
+WHERE metric IN ('{metrics_str}')
 GROUP BY metric
 ORDER BY null_zero_percentage DESC
 """
-
-df_null_focused = pd.read_sql(query1_focused, conn)
-
-print("="*80)
-print("NULL/Zero Analysis - Sorted from HIGHEST to LOWEST percentage:")
-print("="*80)
-print(df_null_focused.to_string(index=False))
-
-# Print the metric with the MOST NULL/zero values
-worst_metric = df_null_focused.iloc[0]
-print("\n" + "="*80)
-print("METRIC WITH MOST NULL/ZERO VALUES:")
-print("="*80)
-print(f"Metric: {worst_metric['metric']}")
-print(f"NULL Count: {worst_metric['null_count']:.0f}")
-print(f"Zero Count: {worst_metric['zero_count']:.0f}")
-print(f"Total NULL or Zero: {worst_metric['null_or_zero_count']:.0f}")
-print(f"Percentage: {worst_metric['null_zero_percentage']:.2f}%")
+    return pd.read_sql(query1_focused, conn)
+
+
+def print_null_zero_analysis(df_null_focused):
+    print("="*80)
+    print("NULL/Zero Analysis - Sorted from HIGHEST to LOWEST percentage:")
+    print("="*80)
+    print(df_null_focused.to_string(index=False))
+
+    # Print the metric with the MOST NULL/zero values
+    worst_metric = df_null_focused.iloc[0]
+    print("\n" + "="*80)
+    print("METRIC WITH MOST NULL/ZERO VALUES:")
+    print("="*80)
+    print(f"Metric: {worst_metric['metric']}")
+    print(f"NULL Count: {worst_metric['null_count']:.0f}")
+    print(f"Zero Count: {worst_metric['zero_count']:.0f}")
+    print(f"Total NULL or Zero: {worst_metric['null_or_zero_count']:.0f}")
+    print(f"Percentage: {worst_metric['null_zero_percentage']:.2f}%")
 
 """ NULL/Zero Analysis - Sorted from HIGHEST to LOWEST percentage:
 ================================================================================
@@ -84,7 +76,8 @@ Percentage: 1.19%
 """
 
 ## Question 2: For each sport/team, calculate what percentage of athletes have at least 5 measurements for your selected metrics
-query2_option2 = """
+def team_coverage(conn):
+    query2_option2 = f"""
 SELECT
     team,
     metric,
@@ -97,25 +90,15 @@ FROM (
         team,
         metric,
         COUNT(*) as measurement_count
-    FROM research_experiment_refactor_test
+    FROM {table_name()}
     WHERE value IS NOT NULL
-      AND metric IN (
-          'accel_load_accum',
-          'Jump Height(m)',
-          'Peak Propulsive Force(N)',
-          'distance_total',
-          'leftMaxForce',
-          'rightMaxForce'
-      )
+      AND metric IN ('{metrics_str}')
     GROUP BY playername, team, metric
 ) subquery
 GROUP BY team, metric
 ORDER BY team, metric
 """
-
-df_coverage_option = pd.read_sql(query2_option2, conn)
-print("Option 2: Athletes with ≥5 measurements PER METRIC (by Team):")
-df_coverage_option
+    return pd.read_sql(query2_option2, conn)
 
 """ Athletes with ≥5 measurements PER METRIC (by Team):
     team	            metric	           total_athletes	athletes_with_5plus  percentage_with_5plus
@@ -134,20 +117,11 @@ df_coverage_option
 """
 
 # Question 3 (Part 2.1): Identify athletes who haven't been tested in the last 6 months (for your selected metrics)
-import datetime as dt
 REFERENCE_DATE = '2025-10-21' #Last Date from dataset
 STALE_DAYS_THRESHOLD = 182 # Threshold for stale data (6 months ~ 182 days)
-METRICS = [
-    'accel_load_accum',
-    'Jump Height(m)',
-    'Peak Propulsive Force(N)',
-    'distance_total',
-    'leftMaxForce',
-    'rightMaxForce'
-]
-metrics_str = "','".join(METRICS)
 
-query_tested = f"""
+def tested_time(conn):
+    query_tested = f"""
 SELECT
     playername,
     team,
@@ -159,36 +133,37 @@ SELECT
         WHEN DATEDIFF('{REFERENCE_DATE}', MAX(timestamp)) > {STALE_DAYS_THRESHOLD} THEN 'STALE (> 6 Months)'
         ELSE 'RECENT (<= 6 Months)'
     END AS time_status
-FROM {table}
+FROM {table_name()}
 WHERE metric IN ('{metrics_str}')
   AND value IS NOT NULL
 GROUP BY playername, team, metric
 ORDER BY days_since_last_measurement DESC
 """
+    return pd.read_sql(query_tested, conn)
 
-df_tested_time = pd.read_sql(query_tested, conn)
 
-# Filter for athletes who have NOT been tested in the last 6 months
-stale_data_df = df_tested_time[df_tested_time['time_status'] == 'STALE (> 6 Months)']
+def print_stale_athletes(df_tested_time):
+    # Filter for athletes who have NOT been tested in the last 6 months
+    stale_data_df = df_tested_time[df_tested_time['time_status'] == 'STALE (> 6 Months)']
 
-print(f"\nTotal Unique Player-Metric Records: {len(df_tested_time)}")
-print(f"\nNumber of Player-Metric combinations with data older than 6 months: {len(stale_data_df)}")
+    print(f"\nTotal Unique Player-Metric Records: {len(df_tested_time)}")
+    print(f"\nNumber of Player-Metric combinations with data older than 6 months: {len(stale_data_df)}")
 
-print("\nSample of Player-Metric Combinations with STALE Data -Newest Date shown:")
-# Display a sample of the oldest stale data points
-print(stale_data_df.tail(5).to_string(index=False))
+    print("\nSample of Player-Metric Combinations with STALE Data -Newest Date shown:")
+    # Display a sample of the oldest stale data points
+    print(stale_data_df.tail(5).to_string(index=False))
 
-# Calculate unique players with any stale metric
-stale_players = stale_data_df['playername'].unique()
-print(f"\nTotal unique athletes with at least one metric older than 6 months: {len(stale_players)}")
+    # Calculate unique players with any stale metric
+    stale_players = stale_data_df['playername'].unique()
+    print(f"\nTotal unique athletes with at least one metric older than 6 months: {len(stale_players)}")
+    return stale_data_df
 
 # Question 4 (Part 2.1): Determine if you have sufficient data to answer your research question
 # Yes, we have sufficient data to answer our 5 research questions, since we have thousands of rows of relevant data that are new and fill the critera for having been tested with atleast one of the metrics.
 
 # 2.2 Data Transformation Challenge
 
-import pandas as pd
-def transform_player_metrics(df, player_name, metrics):
+def transform_player_metrics(df, player_name, metrics, policy='mean', sessions=None):
     """
     Filters a DataFrame for a specific player and a list of metrics,
     then pivots the data to a wide format.
@@ -197,6 +172,11 @@ def transform_player_metrics(df, player_name, metrics):
         df (pd.DataFrame): The input DataFrame containing player metrics.
         player_name (str): The name of the player to filter for.
         metrics (list): A list of metric names to include.
+        policy (str): How repeated timestamp-metric readings are collapsed
+                      (mean/max/last/best, see dedup.py).
+        sessions (pd.DataFrame): Optional force-plate session table (sessions.py);
+                      its metrics are then read from the player's tests
+                      instead of the rows of `df`.
 
     Returns:
         pd.DataFrame: A wide-format DataFrame with timestamps as index
@@ -208,17 +188,23 @@ def transform_player_metrics(df, player_name, metrics):
         (df["metric"].isin(metrics))
     ]
 
-    # Pivot the filtered DataFrame to a wide format
-    wide_df = filtered_df.pivot_table(
-        index="timestamp",
-        columns="metric",
-        values="value",
-        aggfunc="mean" # Use mean to handle potential duplicates for a timestamp-metric pair
-    )
+    # Force-plate metrics come from the session table (already cleaned and collapsed)
+    if sessions is not None:
+        session_metrics = [m for m in SESSION_METRICS if m in metrics]
+        tests = sessions[sessions["playername"] == player_name].astype({"playername": object})
+        tests = tests.melt(id_vars=["playername", "timestamp"], value_vars=session_metrics,
+                           var_name="metric", value_name="value").dropna(subset=["value"])
+        rest = filtered_df[~filtered_df["metric"].isin(session_metrics)]
+        rest = rest.assign(timestamp=pd.to_datetime(rest["timestamp"], errors="coerce"))
+        filtered_df = pd.concat([rest, tests], ignore_index=True)
+
+    # Collapse duplicate timestamp-metric pairs first, then pivot to a wide format
+    collapsed = collapse_readings(filtered_df, policy)
+    wide_df = collapsed.pivot(index="timestamp", columns="metric", values="value")
     return wide_df
 
 # Example outputs for 3 athletes from different teams
-def print_example_transforms(df):
+def print_example_transforms(df, sessions=None):
     selected_metrics = ["jump_height", "Peak Propulsive Force(N)	", "distance_total	", "accel_load_accum", "leftMaxForce","rightMaxForce"]
 
     players_to_test = [
@@ -232,24 +218,22 @@ def print_example_transforms(df):
         print(f"WIDE FORMAT OUTPUT FOR {p}")
         print("=====================================")
 
-        transformed = transform_player_metrics(df, p, selected_metrics)
-        print(transformed.head())  
+        transformed = transform_player_metrics(df, p, selected_metrics, sessions=sessions)
+        print(transformed.head())
 
-sql_toexecute = """
+def fetch_all_rows(conn):
+    sql_toexecute = f"""
 SELECT playername, metric, timestamp, value
-FROM research_experiment_refactor_test
+FROM {table_name()}
 """
-
-# Use the 'response' DataFrame, which contains the data from the database
-response = pd.read_sql(sql_toexecute, conn)
-print_example_transforms(response)      
+    return cached_read_sql(sql_toexecute, conn)
 
 """
 =====================================
 WIDE FORMAT OUTPUT FOR PLAYER_005
 =====================================
 metric               leftMaxForce  rightMaxForce
-timestamp                                       
+timestamp
 2024-08-06 14:24:21         351.0         312.75
 2024-10-30 17:55:56         462.5         375.75
 
@@ -257,7 +241,7 @@ timestamp
 WIDE FORMAT OUTPUT FOR PLAYER_014
 =====================================
 metric               accel_load_accum  leftMaxForce  rightMaxForce
-timestamp                                                         
+timestamp
 2023-06-16 12:01:47        607.066123           NaN            NaN
 2023-06-20 11:58:40          0.009541           NaN            NaN
 2023-06-20 11:59:15        629.562592           NaN            NaN
@@ -268,7 +252,7 @@ timestamp
 WIDE FORMAT OUTPUT FOR PLAYER_015
 =====================================
 metric               leftMaxForce  rightMaxForce
-timestamp                                       
+timestamp
 2024-09-09 11:35:50        467.75         442.00
 2025-03-18 20:04:21        394.50         392.75
 2025-09-08 12:25:41        506.25         473.50
@@ -289,157 +273,162 @@ Metrics:
 - rightMaxForce
 """
 
-from sqlalchemy import create_engine
-import pandas as pd
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-
-# Load environment variables from .env
-env_path = Path(__file__).resolve().parent / ".env"
-load_dotenv(env_path)
-
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE', 'research_experiment_refactor_test')
-
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
-    raise SystemExit("Missing DB credentials in .env")
-
-url_string = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-conn = create_engine(url_string)
-
-table = DB_TABLE
-
-# Define the 6 metrics
-METRICS = [
-    'accel_load_accum',
-    'Jump Height(m)',
-    'Peak Propulsive Force(N)',
-    'distance_total',
-    'leftMaxForce',
-    'rightMaxForce'
-]
-
 # ============================================================================
 # Step 1: Fetch all data for these metrics (long format)
 # ============================================================================
-metrics_str = "','".join(METRICS)
-query_fetch = f"""
-SELECT 
+def fetch_metrics(conn):
+    query_fetch = f"""
+SELECT
     playername,
     team,
     metric,
     value,
     timestamp
-FROM {table}
+FROM {table_name()}
 WHERE metric IN ('{metrics_str}')
   AND value IS NOT NULL
 ORDER BY team, playername, metric, timestamp
 """
-
-print("Fetching data for the 6 metrics...")
-df_all = pd.read_sql(query_fetch, conn)
-print(f"Fetched {len(df_all)} records for {len(df_all['playername'].unique())} athletes")
-print(f"Metrics found: {df_all['metric'].unique().tolist()}")
+    return cached_read_sql(query_fetch, conn)
 
 # ============================================================================
 # Step 2: Calculate team means (per metric)
 # ============================================================================
-print("\n" + "="*80)
-print("TEAM MEANS FOR EACH METRIC")
-print("="*80)
-
-team_means = df_all.groupby(['team', 'metric'])['value'].mean().reset_index()
-team_means.columns = ['team', 'metric', 'team_mean']
-
-# Pivot to see metrics as columns
-team_means_pivot = team_means.pivot(index='team', columns='metric', values='team_mean')
-print(team_means_pivot.to_string())
+@profiled('part2.compute_team_means')
+def compute_team_means(df_all):
+    team_means = df_all.groupby(['team', 'metric'])['value'].mean().reset_index()
+    team_means.columns = ['team', 'metric', 'team_mean']
+    return team_means
 
 # ============================================================================
 # Step 3: Add percent difference for each measurement
 # ============================================================================
-print("\n" + "="*80)
-print("CALCULATING PERCENT DIFFERENCE FOR EACH ATHLETE MEASUREMENT")
-print("="*80)
-
-# Merge team means back onto the original data
-df_with_means = df_all.merge(team_means, on=['team', 'metric'], how='left')
-
-# Calculate percent difference: (value - team_mean) / team_mean * 100
-df_with_means['pct_diff_from_team'] = (
-    (df_with_means['value'] - df_with_means['team_mean']) / df_with_means['team_mean'] * 100
-)
-
-print("\nSample of data with percent differences (first 20 rows):")
-print(df_with_means[['playername', 'team', 'metric', 'value', 'team_mean', 'pct_diff_from_team']].head(20).to_string(index=False))
+@profiled('part2.add_pct_diff')
+def add_pct_diff(df_all, team_means):
+    # Merge team means back onto the original data
+    df_with_means = df_all.merge(team_means, on=['team', 'metric'], how='left')
+
+    # Calculate percent difference: (value - team_mean) / team_mean * 100
+    df_with_means['pct_diff_from_team'] = (
+        (df_with_means['value'] - df_with_means['team_mean']) / df_with_means['team_mean'] * 100
+    )
+    return df_with_means
 
 # ============================================================================
 # Step 4: Summary statistics
 # ============================================================================
-print("\n" + "="*80)
-print("SUMMARY: PERCENT DIFFERENCE STATISTICS BY METRIC")
-print("="*80)
-
-summary = df_with_means.groupby('metric').agg({
-    'pct_diff_from_team': ['min', 'max', 'mean', 'std']
-}).round(2)
-summary.columns = ['Min %', 'Max %', 'Mean %', 'Std Dev %']
-print(summary.to_string())
+def pct_diff_summary(df_with_means):
+    summary = df_with_means.groupby('metric').agg({
+        'pct_diff_from_team': ['min', 'max', 'mean', 'std']
+    }).round(2)
+    summary.columns = ['Min %', 'Max %', 'Mean %', 'Std Dev %']
+    return summary
 
 
 # Identify the top 5 and bottom 5 performers relative to their team mean
-
-print("\n" + "="*80)
-print("Top 5 and bottom 5 performers per metric")
-print("="*80)
-
-# Dictionary to store results for each metric
-top_bottom_results = {}
-
-# Create a loop to pull metrics for each athlete 
-for m in METRICS:
-    df_metric = df_with_means[df_with_means['metric'] == m].copy()
-
-    # Sort highest to lowest percent difference
-    df_sorted = df_metric.sort_values('pct_diff_from_team', ascending=False)
-
-# Sorts out the top 5 and bottom 5 players by pulling the following columns
-    top5 = df_sorted.head(5)[['playername', 'team', 'value', 'team_mean', 'pct_diff_from_team']]
-    bottom5 = df_sorted.tail(5)[['playername', 'team', 'value', 'team_mean', 'pct_diff_from_team']]
-
-# Stored the results in the dictionary
-    top_bottom_results[m] = {
-        'top5': top5,
-        'bottom5': bottom5
-    }
-
-# Print the results 
-    print(f"\n--- Metric: {m} ---")
-    print("\nTop 5 performers:")
-    print(top5.to_string(index=False))
-
-    print("\nBottom 5 performers:")
-    print(bottom5.to_string(index=False))
+@profiled('part2.top_bottom_performers')
+def top_bottom_performers(df_with_means, metrics=METRICS, k=5):
+    # Select the top/bottom k per metric in one partitioned pass (see ranking.py)
+    columns = ['playername', 'team', 'value', 'team_mean', 'pct_diff_from_team']
+    df_metrics = df_with_means[df_with_means['metric'].isin(metrics)]
+    top, bottom = top_bottom(df_metrics, 'pct_diff_from_team', k, groups=['metric'])
+
+    # Dictionary to store results for each metric (bottom rows listed highest to lowest, as before)
+    top_bottom_results = {}
+    for m in metrics:
+        top_bottom_results[m] = {
+            'top5': top.loc[top['metric'] == m, columns],
+            'bottom5': bottom.loc[bottom['metric'] == m, columns].iloc[::-1]
+        }
+    return top_bottom_results
 
 # Z-score
-from scipy.stats import zscore
-
-print("\n" + "="*80)
-print("Z-scores per team per metric (scipy version)")
-print("="*80)
+@profiled('part2.team_zscores')
+def team_zscores(df_with_means):
+    from scipy.stats import zscore
 
-# Make a copy of the dataframe
-df_z = df_with_means.copy()
+    # Make a copy of the dataframe
+    df_z = df_with_means.copy()
 
-# Compute z-scores separately for each team and metric group
-df_z['z_score'] = df_z.groupby(['team', 'metric'])['value'].transform(
-    lambda x: zscore(x, nan_policy='omit')
-)
-
-# Print results
-print("\nSample Z-scores (first 20 rows):")
-print(df_z[['playername', 'team', 'metric', 'value', 'z_score']].head(20).to_string(index=False))
+    # Compute z-scores separately for each team and metric group
+    df_z['z_score'] = df_z.groupby(['team', 'metric'])['value'].transform(
+        lambda x: zscore(x, nan_policy='omit')
+    )
+    return df_z
+
+
+SECTIONS = ['missing', 'transform', 'derived']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Part 2 missing data analysis, transformation and derived metrics.")
+    parser.add_argument('--section', choices=SECTIONS, action='append',
+                        help='run only these sections (default: all)')
+    args = parser.parse_args(argv)
+    sections = args.section or SECTIONS
+
+    conn = get_engine()
+
+    # Queries and intermediate tables are kept as a run manifest (see manifest.py)
+    with Run('part2_cleaning', config={'sections': sections, 'metrics': METRICS}) as run:
+        if 'missing' in sections:
+            print_null_zero_analysis(run.record('null_zero', null_zero_analysis(conn)))
+
+            df_coverage_option = run.record('team_coverage', team_coverage(conn))
+            print("Option 2: Athletes with ≥5 measurements PER METRIC (by Team):")
+            print(df_coverage_option.to_string(index=False))
+
+            print_stale_athletes(run.record('tested_time', tested_time(conn)))
+
+        if 'transform' in sections:
+            # Use the 'response' DataFrame, which contains the data from the database
+            response = fetch_all_rows(conn)
+            print_example_transforms(response, force_plate_sessions(engine=conn))
+
+        if 'derived' in sections:
+            print("Fetching data for the 6 metrics...")
+            df_all = fetch_metrics(conn)
+            print(f"Fetched {len(df_all)} records for {len(df_all['playername'].unique())} athletes")
+            print(f"Metrics found: {df_all['metric'].unique().tolist()}")
+
+            print("\n" + "="*80)
+            print("TEAM MEANS FOR EACH METRIC")
+            print("="*80)
+            team_means = run.cached('team_means', compute_team_means, df_all)
+            # Pivot to see metrics as columns
+            team_means_pivot = team_means.pivot(index='team', columns='metric', values='team_mean')
+            print(team_means_pivot.to_string())
+
+            print("\n" + "="*80)
+            print("CALCULATING PERCENT DIFFERENCE FOR EACH ATHLETE MEASUREMENT")
+            print("="*80)
+            df_with_means = run.cached('pct_diff', add_pct_diff, df_all, team_means)
+            print("\nSample of data with percent differences (first 20 rows):")
+            print(df_with_means[['playername', 'team', 'metric', 'value', 'team_mean', 'pct_diff_from_team']].head(20).to_string(index=False))
+
+            print("\n" + "="*80)
+            print("SUMMARY: PERCENT DIFFERENCE STATISTICS BY METRIC")
+            print("="*80)
+            print(pct_diff_summary(df_with_means).to_string())
+
+            print("\n" + "="*80)
+            print("Top 5 and bottom 5 performers per metric")
+            print("="*80)
+            for m, result in top_bottom_performers(df_with_means).items():
+                print(f"\n--- Metric: {m} ---")
+                print("\nTop 5 performers:")
+                print(result['top5'].to_string(index=False))
+
+                print("\nBottom 5 performers:")
+                print(result['bottom5'].to_string(index=False))
+
+            print("\n" + "="*80)
+            print("Z-scores per team per metric (scipy version)")
+            print("="*80)
+            df_z = run.cached('zscores', team_zscores, df_with_means)
+            print("\nSample Z-scores (first 20 rows):")
+            print(df_z[['playername', 'team', 'metric', 'value', 'z_score']].head(20).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
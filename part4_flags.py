@@ -2,141 +2,116 @@
 Performance Monitoring Flag System - Basketball only, Men's and Women's team are flag separately
 Flag Formulas: Asymmetry: ((strong - weak) / strong) * 100%
 Acceleration Load: value > 90th percentile of all players within the same team
+
+Run `python part4_flags.py` to print the flags and export
+`part4_flagged_athletes.csv`; importing the module makes no DB connection.
 """
 
-from sqlalchemy import create_engine
-import pandas as pd
-import os
+import argparse
 from pathlib import Path
-from dotenv import load_dotenv
 
-# Load environment variables from .env
-env_path = Path(__file__).resolve().parent / ".env"
-load_dotenv(env_path)
+import pandas as pd
 
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE', 'research_experiment_refactor_test')
+from cohorts import BASKETBALL_TEAMS, infer_gender
+from db import get_engine, table_name
+from manifest import Run
+from profiling import profiled
+from query_cache import cached_read_sql
+from rule_engine import evaluate, load_rules, rule_set
+from sessions import force_plate_sessions, to_sessions
 
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
-    raise SystemExit("Missing DB credentials in .env")
+# Load team list
+basketball_teams = BASKETBALL_TEAMS
 
-url_string = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-conn = create_engine(url_string)
+BILATERAL_METRICS = ['leftMaxForce', 'rightMaxForce']
 
-table = DB_TABLE
+OUTPUT_PATH = Path(__file__).resolve().parent / 'part4_flagged_athletes.csv'
 
-print("="*80)
-print("PART 4.1: PERFORMANCE MONITORING FLAG SYSTEM - BASKETBALL ONLY")
-print("\nAnalyzing all basketball team variations")
-print("\nFlagging Criteria:")
-print("  1. Bilateral Asymmetry: ((strong - weak) / strong) * 100% > 10%")
-print("  2. Acceleration Load: value > 90th percentile by GENDER")
 
-# Load team list
-basketball_teams = [
-    'Mens Basketball',
-    'Womens Basketball',
-    "Men's Basketball",
-    "Women's Basketball"
-]
-
-# Load acceleration load data
-query_accel = f"""
-SELECT 
+def load_accel(conn):
+    # Load acceleration load data
+    query_accel = f"""
+SELECT
     playername,
     team,
     metric,
     value,
     timestamp
-FROM {table}
+FROM {table_name()}
 WHERE metric = 'accel_load_accum'
   AND value IS NOT NULL
   AND team IN ('Mens Basketball', 'Womens Basketball', "Men's Basketball", "Women's Basketball")
 ORDER BY playername, timestamp
 """
+    df_accel = cached_read_sql(query_accel, conn)
+    df_accel['timestamp'] = pd.to_datetime(df_accel['timestamp'])
 
-df_accel = pd.read_sql(query_accel, conn)
-df_accel['timestamp'] = pd.to_datetime(df_accel['timestamp'])
+    # Create gender column
+    df_accel['gender'] = df_accel['team'].apply(infer_gender)
+    return df_accel
+
+
+def paired_tests(sessions):
+    # Left/right tests of the session table (sessions.py) under the column names used below
+    df = sessions.dropna(subset=['leftMaxForce', 'rightMaxForce'])
+    df = df.rename(columns={'leftMaxForce': 'value_left', 'rightMaxForce': 'value_right'})
+    df = df[['playername', 'team', 'timestamp', 'value_left', 'value_right', 'asymmetry_pct', 'stronger_side']]
+    return df.astype({'playername': object, 'team': object, 'stronger_side': object}).reset_index(drop=True)
+
+
+def load_bilateral(conn):
+    # Load paired left/right max force tests from the materialised session table
+    sessions = force_plate_sessions(teams=basketball_teams, metrics=BILATERAL_METRICS, engine=conn)
+    return paired_tests(sessions)
+
+
+def print_breakdown(df_accel, df_bilateral):
+    print(f"\nLoaded {len(df_accel)} accel_load measurements")
+    print(f"Loaded {len(df_bilateral)} bilateral force tests")
+
+    print(f"\nBreakdown by team (accel load):")
+    total_team_count = 0
+    for team in basketball_teams:
+        count = len(df_accel[df_accel['team']==team]['playername'].unique())
+        if count > 0:
+            print(f"  {team}: {count} athletes")
+            total_team_count += count
+
+    print(f"\nTotal athlete-team combinations: {total_team_count}")
+    print(f"Unique athletes across all teams: {df_accel['playername'].nunique()}")
+
+    print(f"\nBreakdown by gender:")
+    print(f"  Male: {len(df_accel[df_accel['gender']=='Male'])} measurements")
+    print(f"  Female: {len(df_accel[df_accel['gender']=='Female'])} measurements")
 
-# Load left/right max force data
-query_bilateral = f"""
-SELECT 
-    playername,
-    team,
-    metric,
-    value,
-    timestamp
-FROM {table}
-WHERE metric IN ('leftMaxForce', 'rightMaxForce')
-  AND value IS NOT NULL
-  AND team IN ('Mens Basketball', 'Womens Basketball', "Men's Basketball", "Women's Basketball")
-ORDER BY playername, timestamp
-"""
 
-df_bilateral_raw = pd.read_sql(query_bilateral, conn)
-df_bilateral_raw['timestamp'] = pd.to_datetime(df_bilateral_raw['timestamp'])
-
-# Create gender column
-df_accel['gender'] = df_accel['team'].apply(lambda x: 'Male' if 'Men' in x else 'Female')
-
-print(f"\nLoaded {len(df_accel)} accel_load measurements")
-print(f"Loaded {len(df_bilateral_raw)} bilateral force measurements")
-
-print(f"\nBreakdown by team (accel load):")
-total_team_count = 0
-for team in basketball_teams:
-    count = len(df_accel[df_accel['team']==team]['playername'].unique())
-    if count > 0:
-        print(f"  {team}: {count} athletes")
-        total_team_count += count
-
-print(f"\nTotal athlete-team combinations: {total_team_count}")
-print(f"Unique athletes across all teams: {df_accel['playername'].nunique()}")
-
-print(f"\nBreakdown by gender:")
-print(f"  Male: {len(df_accel[df_accel['gender']=='Male'])} measurements")
-print(f"  Female: {len(df_accel[df_accel['gender']=='Female'])} measurements")
-
-print("\n" + "="*80)
-print("FLAG 1: BILATERAL ASYMMETRY >10%")
-print("Formula: ((strong - weak) / strong) * 100%")
-
-if len(df_bilateral_raw) > 0:
-    # Get left and right force measurements
-    df_left = df_bilateral_raw[df_bilateral_raw['metric'] == 'leftMaxForce'].copy()
-    df_right = df_bilateral_raw[df_bilateral_raw['metric'] == 'rightMaxForce'].copy()
-    
-    # Merge on playername and timestamp
-    df_bilateral = pd.merge(
-        df_left[['playername', 'team', 'timestamp', 'value']],
-        df_right[['playername', 'timestamp', 'value']],
-        on=['playername', 'timestamp'],
-        suffixes=('_left', '_right')
-    )
-    
-    # Calculate asymmetry using correct formula: ((strong - weak) / strong) * 100
-    df_bilateral['strong'] = df_bilateral[['value_left', 'value_right']].max(axis=1)
-    df_bilateral['weak'] = df_bilateral[['value_left', 'value_right']].min(axis=1)
-    df_bilateral['asymmetry_pct'] = ((df_bilateral['strong'] - df_bilateral['weak']) / df_bilateral['strong']) * 100
-    
-    # Determine which side is stronger
-    df_bilateral['stronger_side'] = df_bilateral.apply(
-        lambda row: 'Left' if row['value_left'] > row['value_right'] else 'Right', axis=1
-    )
-    
-    # Flag if asymmetry > 10%
-    df_bilateral['flagged'] = df_bilateral['asymmetry_pct'] > 10
-    
+def pair_bilateral(df_bilateral_raw, dedup_policy='mean'):
+    # Long left/right rows -> paired tests through the session table's own pivot
+    # (sessions.to_sessions collapses repeated readings first)
+    return paired_tests(to_sessions(df_bilateral_raw, dedup_policy))
+
+
+@profiled('part4.flag_asymmetry')
+def flag_asymmetry(df_bilateral):
+    print("\n" + "="*80)
+    print("FLAG 1: BILATERAL ASYMMETRY >10%")
+    print("Formula: ((strong - weak) / strong) * 100%")
+
+    if len(df_bilateral) == 0:
+        print("\nNo bilateral force data available for basketball athletes.")
+        return pd.DataFrame()
+
+    df_bilateral = df_bilateral.copy()
+    # Flag if asymmetry > 10% (rule 'bilateral_asymmetry' in flag_rules.json)
+    df_bilateral['flagged'] = evaluate(rule_set('part4'), df_bilateral, only=['bilateral_asymmetry'])['bilateral_asymmetry']
+
     # Get most recent test for each athlete
     df_bilateral_latest = df_bilateral.sort_values('timestamp').groupby('playername').tail(1)
     flagged_asymmetry = df_bilateral_latest[df_bilateral_latest['flagged']].copy()
-    
+
     print(f"\nFound {len(flagged_asymmetry)} athletes with >10% bilateral asymmetry")
     print(f"Out of {len(df_bilateral_latest)} athletes tested with bilateral force metrics\n")
-    
+
     if len(flagged_asymmetry) > 0:
         print("Top 10 cases (highest asymmetry):")
         top_cases = flagged_asymmetry.nlargest(10, 'asymmetry_pct')[[
@@ -144,97 +119,116 @@ if len(df_bilateral_raw) > 0:
         ]].copy()
         top_cases.columns = ['playername', 'team', 'left_force', 'right_force', 'stronger_side', 'asymmetry_%', 'last_test']
         print(top_cases.to_string(index=False))
-    
+
     flagged_asymmetry['flag_reason'] = 'Bilateral asymmetry >10%'
     flagged_asymmetry['metric_name'] = 'leftMaxForce vs rightMaxForce'
     flagged_asymmetry['flag_value'] = flagged_asymmetry['asymmetry_pct'].round(2)
     flagged_asymmetry['last_test'] = flagged_asymmetry['timestamp']
-else:
-    print("\nNo bilateral force data available for basketball athletes.")
-    flagged_asymmetry = pd.DataFrame()
+    return flagged_asymmetry
+
+
+@profiled('part4.flag_accel_load')
+def flag_accel_load(df_accel):
+    print("\n" + "="*80)
+    print("ACCELERATION LOAD ACCUMULATION >90th PERCENTILE (BY GENDER)")
 
-print("\n" + "="*80)
-print("ACCELERATION LOAD ACCUMULATION >90th PERCENTILE (BY GENDER)")
+    # Flag values above gender's 90th percentile (rule 'accel_load' in flag_rules.json)
+    flags = evaluate(rule_set('part4'), df_accel, only=['accel_load'], with_thresholds=True)
+    df_accel = df_accel.assign(percentile_90=flags['accel_load_threshold'], flagged=flags['accel_load'])
+    gender_percentiles = df_accel.groupby('gender')['percentile_90'].first().reset_index()
 
-# Calculate 90th percentile by gender
-gender_percentiles = df_accel.groupby('gender')['value'].quantile(0.90).reset_index()
-gender_percentiles.columns = ['gender', 'percentile_90']
+    print(f"\nTotal accel_load_accum measurements: {len(df_accel)}")
+    print(f"\n90th percentile thresholds by gender:")
+    print(gender_percentiles.to_string(index=False))
 
-print(f"\nTotal accel_load_accum measurements: {len(df_accel)}")
-print(f"\n90th percentile thresholds by gender:")
-print(gender_percentiles.to_string(index=False))
+    # Get most recent test for each athlete
+    df_accel_latest = df_accel.sort_values('timestamp').groupby('playername').tail(1)
+    flagged_accel = df_accel_latest[df_accel_latest['flagged']].copy()
+
+    print(f"\nFound {len(flagged_accel)} athletes with recent accel_load_accum >90th percentile of their gender")
+    print(f"Out of {len(df_accel_latest)} athletes tested")
+
+    # Breakdown by gender
+    print("\nFlags by gender:")
+    for gender in ['Male', 'Female']:
+        gender_flags = len(flagged_accel[flagged_accel['gender'] == gender])
+        gender_total = len(df_accel_latest[df_accel_latest['gender'] == gender])
+        if gender_total > 0:
+            print(f"  {gender}: {gender_flags} / {gender_total} ({gender_flags/gender_total*100:.1f}%)")
+
+    if len(flagged_accel) > 0:
+        print("\n" + "="*80)
+        print("TOP 10 CASES (highest acceleration load relative to gender):")
+        print("="*80)
+        top_cases = flagged_accel.nlargest(10, 'value')[[
+            'playername', 'team', 'gender', 'value', 'percentile_90', 'timestamp'
+        ]].copy()
+        top_cases['pct_above_threshold'] = ((top_cases['value'] - top_cases['percentile_90']) /
+                                            top_cases['percentile_90'] * 100).round(1)
+        top_cases.columns = ['playername', 'team', 'gender', 'accel_load', 'gender_90th', 'last_test', '%_above_threshold']
+        print(top_cases.to_string(index=False))
 
-# Merge gender percentiles back to data
-df_accel = df_accel.merge(gender_percentiles, on='gender', how='left')
+    flagged_accel['flag_reason'] = 'Accel load >90th percentile (gender)'
+    flagged_accel['metric_name'] = 'accel_load_accum'
+    flagged_accel['flag_value'] = flagged_accel['value'].round(2)
+    flagged_accel['last_test'] = flagged_accel['timestamp']
+    return flagged_accel
 
-# Flag values above gender's 90th percentile
-df_accel['flagged'] = df_accel['value'] > df_accel['percentile_90']
 
-# Get most recent test for each athlete
-df_accel_latest = df_accel.sort_values('timestamp').groupby('playername').tail(1)
-flagged_accel = df_accel_latest[df_accel_latest['flagged']].copy()
+def accel_thresholds(df_accel):
+    # 90th percentile per gender from the 'accel_load' rule (the thresholds flag_accel_load applies)
+    flags = evaluate(rule_set('part4'), df_accel, only=['accel_load'], with_thresholds=True)
+    thresholds = df_accel.assign(percentile_90=flags['accel_load_threshold'])
+    return thresholds.groupby('gender')['percentile_90'].first().reset_index()
 
-print(f"\nFound {len(flagged_accel)} athletes with recent accel_load_accum >90th percentile of their gender")
-print(f"Out of {len(df_accel_latest)} athletes tested")
 
-# Breakdown by gender
-print("\nFlags by gender:")
-for gender in ['Male', 'Female']:
-    gender_flags = len(flagged_accel[flagged_accel['gender'] == gender])
-    gender_total = len(df_accel_latest[df_accel_latest['gender'] == gender])
-    if gender_total > 0:
-        print(f"  {gender}: {gender_flags} / {gender_total} ({gender_flags/gender_total*100:.1f}%)")
+def build_report(flagged_accel, flagged_asymmetry):
+    # Selecting required columns from both flagged dataframes
+    columns_to_keep = ['playername', 'team', 'flag_reason', 'flag_value', 'last_test']
 
-if len(flagged_accel) > 0:
-    print("\n" + "="*80)
-    print("TOP 10 CASES (highest acceleration load relative to gender):")
-    print("="*80)
-    top_cases = flagged_accel.nlargest(10, 'value')[[
-        'playername', 'team', 'gender', 'value', 'percentile_90', 'timestamp'
-    ]].copy()
-    top_cases['pct_above_threshold'] = ((top_cases['value'] - top_cases['percentile_90']) / 
-                                        top_cases['percentile_90'] * 100).round(1)
-    top_cases.columns = ['playername', 'team', 'gender', 'accel_load', 'gender_90th', 'last_test', '%_above_threshold']
-    print(top_cases.to_string(index=False))
-
-flagged_accel['flag_reason'] = 'Accel load >90th percentile (gender)'
-flagged_accel['metric_name'] = 'accel_load_accum'
-flagged_accel['flag_value'] = flagged_accel['value'].round(2)
-flagged_accel['last_test'] = flagged_accel['timestamp']
-
-# Exporting to CSV
-from pathlib import Path
-import os
-from dotenv import load_dotenv
+    df_accel_output = flagged_accel.reindex(columns=columns_to_keep)
+    df_asymmetry_output = flagged_asymmetry.reindex(columns=columns_to_keep)
+
+    # Combining the two dataframes
+    final_report_df = pd.concat([df_accel_output, df_asymmetry_output], ignore_index=True)
+
+    # Renaming columns
+    final_report_df.columns = ['Player Name', 'Team', 'Flag Reason', 'Metric Value', 'Last Test Date']
+    return final_report_df
 
-# Determining the script's directory, making sure it works for everyone regardless of user's current directory or username
-try:
-    # Directory of the currently executing file
-    script_dir = Path(__file__).resolve().parent
-except NameError:
-    print("File not defined.")
-    script_dir = Path(os.getcwd())
 
-# Loading environment variables from .env
-env_path = script_dir / ".env"
-load_dotenv(env_path)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Part 4.1 basketball flag system (asymmetry and acceleration load).")
+    parser.add_argument('--output', type=Path, default=OUTPUT_PATH, help='CSV path for the flagged athletes report')
+    args = parser.parse_args(argv)
 
-# Selecting required columns from both flagged dataframes
-columns_to_keep = ['playername', 'team', 'flag_reason', 'flag_value', 'last_test']
+    conn = get_engine()
+
+    print("="*80)
+    print("PART 4.1: PERFORMANCE MONITORING FLAG SYSTEM - BASKETBALL ONLY")
+    print("\nAnalyzing all basketball team variations")
+    print("\nFlagging Criteria:")
+    print("  1. Bilateral Asymmetry: ((strong - weak) / strong) * 100% > 10%")
+    print("  2. Acceleration Load: value > 90th percentile by GENDER")
 
-df_accel_output = flagged_accel.reindex(columns=columns_to_keep)
-df_asymmetry_output = flagged_asymmetry.reindex(columns=columns_to_keep)
+    # Queries, thresholds, pairing results and flags are kept as a run manifest (see manifest.py)
+    config = {'rules': load_rules()['part4'], 'teams': basketball_teams, 'output': str(args.output)}
+    with Run('part4_flags', config=config) as run:
+        df_accel = run.record('accel_load', load_accel(conn))
+        # Paired tests from sessions.py, as in flag_backtest.py (the pipeline pivots its rows with to_sessions)
+        df_bilateral = run.record('bilateral_tests', load_bilateral(conn))
+        print_breakdown(df_accel, df_bilateral)
 
-# Combining the two dataframes
-final_report_df = pd.concat([df_accel_output, df_asymmetry_output], ignore_index=True)
+        flagged_asymmetry = run.record('asymmetry_flags', flag_asymmetry(df_bilateral))
+        flagged_accel = run.record('accel_flags', flag_accel_load(df_accel))
+        run.record('accel_thresholds', accel_thresholds(df_accel))
 
-# Renaming columns
-final_report_df.columns = ['Player Name', 'Team', 'Flag Reason', 'Metric Value', 'Last Test Date']
+        # Exporting to CSV
+        final_report_df = run.record('report', build_report(flagged_accel, flagged_asymmetry))
+        final_report_df.to_csv(args.output, index=False)
 
-# Output path
-final_output_filename = 'part4_flagged_athletes.csv'
-final_output_path = script_dir / final_output_filename
+    print(f"\nSuccessfully exported to {args.output.name}")
 
-final_report_df.to_csv(final_output_path, index=False)
 
-print("\nSuccessfully exported to part4_flagged_athletes.csv")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
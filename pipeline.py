@@ -0,0 +1,387 @@
+"""pipeline.py
+
+Single entry point that runs the project scripts as stages of a dependency
+graph:
+
+    load -> clean -> derived   (part2 team means, pct_diff, z-scores, shrinkage.py scores)
+                  -> flags     (part4 asymmetry / acceleration-load flags)
+                  -> plots     (Q4 Basketball risk chart)
+                  -> report    (test.py research summary and question flow)
+    derived + flags -> export  (Parquet partitions + current tables, see export.py)
+
+Each stage records a fingerprint of its inputs (the source code it runs,
+the fingerprints of its upstream outputs and, for `load`, the table
+watermark). The code is every project module the stage imports, followed
+transitively, plus the data files those modules read (flag_rules.json). A stage whose fingerprint is unchanged and whose outputs exist
+is skipped; stages whose dependencies are satisfied run in parallel worker
+processes. `load` appends only the rows newer than the previous run when
+the table has only grown.
+
+Usage:
+    python pipeline.py                  # run everything that is out of date
+    python pipeline.py flags plots      # selected stages (+ their upstream)
+    python pipeline.py --force report   # ignore fingerprints
+    python pipeline.py --list
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import hashlib
+import inspect
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import pandas as pd
+
+from db import METRICS, get_engine, table_mark, table_name
+from profiling import frame_bytes, print_summary, read_log, span
+
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_OUT_DIR = ROOT / '.pipeline'
+STATE_FILE = 'state.json'
+# data files read by a project module, fingerprinted with it
+DATA_FILES = {'rule_engine.py': ['flag_rules.json']}
+
+LOAD_WHERE = "WHERE metric IN ('{metrics}') AND value IS NOT NULL"
+LOAD_SQL = "SELECT playername, team, metric, value, timestamp, data_source FROM {table} " + LOAD_WHERE
+
+
+def _sha(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_fingerprint(path: Path) -> str | None:
+    if not path.exists():
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _project_imports(source: str) -> set[str]:
+    """Project module files (ROOT/<name>.py) imported anywhere in `source`."""
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return {f"{n}.py" for n in names if (ROOT / f"{n}.py").exists()}
+
+
+def stage_code(stage: dict) -> list[str]:
+    """Files a stage runs: its `code` and the modules its run function imports, transitively."""
+    todo = set(stage['code']) | _project_imports(inspect.getsource(stage['run']))
+    files: set[str] = set()
+    while todo:
+        name = todo.pop()
+        if name in files:
+            continue
+        files.add(name)
+        files.update(DATA_FILES.get(name, []))
+        if name.endswith('.py'):
+            todo |= _project_imports((ROOT / name).read_text())
+    return sorted(files)
+
+
+def load_watermark(engine, table: str) -> dict:
+    """Max timestamp and row count of the rows the load stage reads."""
+    return table_mark(engine, table, LOAD_WHERE.format(metrics="','".join(METRICS)))
+
+
+def dedup_policy() -> str:
+    """Policy the clean stage uses to collapse repeated readings (DEDUP_POLICY, default mean)."""
+    return os.getenv('DEDUP_POLICY', 'mean')
+
+
+def stage_external(name: str) -> dict | None:
+    """Inputs outside the artifact directory that a stage's fingerprint depends on."""
+    if name == 'load':
+        return load_watermark(get_engine(), table_name())
+    if name == 'clean':
+        return {'dedup_policy': dedup_policy()}
+    return None
+
+
+def _read_sql(sql: str, engine) -> pd.DataFrame:
+    with span('read_sql') as rec:
+        df = pd.read_sql(sql, engine)
+        rec.update(rows_out=len(df), bytes=frame_bytes(df))
+    return df
+
+
+# ============================================================================
+# Stages — each reads its inputs from and writes its outputs to `out_dir`
+# ============================================================================
+
+def stage_load(out_dir: Path):
+    engine = get_engine()
+    table = table_name()
+    sql = LOAD_SQL.format(table=table, metrics="','".join(METRICS))
+    path = out_dir / 'load.feather'
+    meta_path = out_dir / 'load.json'
+    mark = load_watermark(engine, table)
+
+    if path.exists() and meta_path.exists():
+        prev = json.loads(meta_path.read_text())
+        delta = _read_sql(sql + f" AND timestamp > '{prev['max_ts']}'", engine)
+        if prev['rows'] + len(delta) == mark['rows']:
+            print(f"Incremental load: {len(delta)} new rows after {prev['max_ts']}")
+            df = pd.concat([pd.read_feather(path), delta], ignore_index=True)
+        else:
+            print('Table changed beyond appended rows; reloading everything')
+            df = _read_sql(sql, engine)
+    else:
+        df = _read_sql(sql, engine)
+
+    df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+    df.to_feather(path)
+    meta_path.write_text(json.dumps(mark))
+    print(f"Loaded {len(df)} rows for {df['playername'].nunique()} athletes")
+
+
+def stage_clean(out_dir: Path):
+    from data_quality import clean_rows
+    from dedup import collapse_readings
+
+    df = pd.read_feather(out_dir / 'load.feather')
+    before = len(df)
+    df = collapse_readings(clean_rows(df), dedup_policy()).drop(columns='readings')
+    df = df.sort_values(['team', 'playername', 'metric', 'timestamp'], kind='stable').reset_index(drop=True)
+    df.to_feather(out_dir / 'clean.feather')
+    print(f"Cleaned {before} -> {len(df)} rows")
+
+
+def stage_derived(out_dir: Path):
+    from part2_cleaning import add_pct_diff, compute_team_means, pct_diff_summary, team_zscores
+    from shrinkage import ShrinkageModel, adjusted_zscores
+
+    df = pd.read_feather(out_dir / 'clean.feather')
+    team_means = compute_team_means(df)
+    df_z = team_zscores(add_pct_diff(df, team_means))
+    df_z = adjusted_zscores(df_z, ShrinkageModel.from_frame(df).fit())
+    df_z.to_feather(out_dir / 'derived.feather')
+    print(pct_diff_summary(df_z).to_string())
+
+
+def stage_flags(out_dir: Path):
+    from cohorts import BASKETBALL_TEAMS, infer_gender
+    from part4_flags import build_report, flag_accel_load, flag_asymmetry, pair_bilateral
+
+    df = pd.read_feather(out_dir / 'clean.feather')
+    df = df[df['team'].isin(BASKETBALL_TEAMS)]
+    df_accel = df[df['metric'] == 'accel_load_accum'].sort_values(['playername', 'timestamp']).copy()
+    df_accel['gender'] = df_accel['team'].apply(infer_gender)
+    df_bilateral_raw = df[df['metric'].isin(['leftMaxForce', 'rightMaxForce'])].sort_values(['playername', 'timestamp'])
+
+    # sessions.to_sessions pairs the tests, as in the session table part4_flags.py reads
+    df_bilateral = pair_bilateral(df_bilateral_raw, dedup_policy())
+    report = build_report(flag_accel_load(df_accel), flag_asymmetry(df_bilateral))
+    report.to_csv(out_dir / 'part4_flagged_athletes.csv', index=False)
+
+
+def stage_plots(out_dir: Path):
+    from plot_q4_risk_distribution_basketball_gender import METRICS as PLOT_METRICS, basketball_risk, plot_by_gender
+
+    df = pd.read_feather(out_dir / 'clean.feather')
+    df_risk = basketball_risk(df[df['metric'].isin(PLOT_METRICS)])
+    out = out_dir / 'q4_basketball_risk_by_gender.png'
+    if df_risk.empty:
+        out.unlink(missing_ok=True)
+        return
+    plot_by_gender(df_risk, out)
+
+
+def stage_report(out_dir: Path):
+    from test import (per_player_means, research_correlations, research_left_right_asymmetry,
+                      research_team_means, research_top_loaders, run_question_flow, yearly_trends)
+
+    df = pd.read_feather(out_dir / 'clean.feather')
+    with open(out_dir / 'research_report.txt', 'w') as fh, redirect_stdout(fh):
+        research_team_means(df)
+        player_means = per_player_means(df)
+        research_correlations(player_means)
+        research_left_right_asymmetry(player_means, threshold_pct=10.0)
+        research_top_loaders(df, top_n=10)
+        yearly_trends(df)
+        run_question_flow(df, asym_threshold=10.0)
+
+
+def stage_export(out_dir: Path):
+    from export import export_run, pipeline_frames
+
+    entry = export_run(pipeline_frames(out_dir), out_dir / 'exports')
+    for name, d in entry['datasets'].items():
+        print(f"{name}: appended {d['rows']} rows in {len(d['files'])} files; current table {d['current_rows']} rows")
+
+
+STAGES = {
+    'load': {'deps': [], 'code': ['db.py'], 'outputs': ['load.feather'], 'run': stage_load},
+    'clean': {'deps': ['load'], 'code': ['data_quality.py', 'dedup.py'], 'outputs': ['clean.feather'], 'run': stage_clean},
+    'derived': {'deps': ['clean'], 'code': ['part2_cleaning.py', 'shrinkage.py'], 'outputs': ['derived.feather'], 'run': stage_derived},
+    'flags': {'deps': ['clean'], 'code': ['part4_flags.py', 'cohorts.py'],
+              'outputs': ['part4_flagged_athletes.csv'], 'run': stage_flags},
+    'plots': {'deps': ['clean'], 'code': ['plot_q4_risk_distribution_basketball_gender.py', 'cohorts.py'],
+              'outputs': ['q4_basketball_risk_by_gender.png'], 'run': stage_plots},
+    'report': {'deps': ['clean'], 'code': ['test.py', 'cohorts.py'], 'outputs': ['research_report.txt'], 'run': stage_report},
+    'export': {'deps': ['derived', 'flags'], 'code': ['export.py', 'plot_q4_risk_distribution_basketball_gender.py'],
+               'outputs': ['exports/manifest.json'], 'run': stage_export},
+}
+
+
+# ============================================================================
+# Scheduler
+# ============================================================================
+
+def with_upstream(selected: list[str]) -> list[str]:
+    """Selected stages plus everything they depend on, in topological order."""
+    needed: set[str] = set()
+
+    def visit(name):
+        if name not in needed:
+            needed.add(name)
+            for dep in STAGES[name]['deps']:
+                visit(dep)
+
+    for name in selected:
+        visit(name)
+    return [name for name in STAGES if name in needed]
+
+
+def stage_fingerprint(name: str, out_dir: Path, state: dict, external: dict | None = None) -> str:
+    """Hash of the stage's code, its upstream output fingerprints and external inputs."""
+    stage = STAGES[name]
+    parts = {
+        'code': {f: file_fingerprint(ROOT / f) for f in ['pipeline.py'] + stage_code(stage)},
+        'deps': {dep: state.get(dep, {}).get('outputs') for dep in stage['deps']},
+        'external': external,
+    }
+    return _sha(json.dumps(parts, sort_keys=True).encode())
+
+
+def _run_stage(name: str, out_dir: str) -> float:
+    """Worker entry point: run one stage with its stdout captured in logs/<stage>.log."""
+    out_dir = Path(out_dir)
+    log_dir = out_dir / 'logs'
+    log_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    with open(log_dir / f"{name}.log", 'w') as fh, redirect_stdout(fh), span(f"stage.{name}", dump=True):
+        STAGES[name]['run'](out_dir)
+    return time.perf_counter() - start
+
+
+def read_state(out_dir: Path) -> dict:
+    path = out_dir / STATE_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def write_state(out_dir: Path, state: dict) -> None:
+    (out_dir / STATE_FILE).write_text(json.dumps(state, indent=2, sort_keys=True))
+
+
+def run(selected: list[str] | None = None, out_dir: Path = DEFAULT_OUT_DIR, force: bool = False,
+        jobs: int = 4, dry_run: bool = False) -> dict[str, str]:
+    """Run the selected stages (default: all); returns {stage: 'ran'|'skipped'|'would run'}.
+
+    Timing records of every stage (and the spans inside it) are appended
+    to `profile.jsonl` and summarised at the end of the run.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    profile_log = out_dir / 'profile.jsonl'
+    run_id = uuid.uuid4().hex[:12]
+    os.environ['PROFILE_LOG'] = str(profile_log)
+    os.environ['PROFILE_RUN_ID'] = run_id
+    order = with_upstream(selected or list(STAGES))
+    state = read_state(out_dir)
+    status: dict[str, str] = {}
+    pending = list(order)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        while pending:
+            ready = [n for n in pending if all(d in status for d in STAGES[n]['deps'] if d in order)]
+            pending = [n for n in pending if n not in ready]
+            to_run = {}
+            for name in ready:
+                external = stage_external(name)
+                fp = stage_fingerprint(name, out_dir, state, external)
+                outputs_exist = all((out_dir / o).exists() for o in STAGES[name]['outputs'])
+                if not force and outputs_exist and state.get(name, {}).get('inputs') == fp:
+                    status[name] = 'skipped'
+                elif dry_run:
+                    status[name] = 'would run'
+                else:
+                    to_run[name] = fp
+
+            futures = {name: pool.submit(_run_stage, name, str(out_dir)) for name in to_run}
+            failed = {}
+            for name, future in futures.items():
+                try:
+                    seconds = future.result()
+                except Exception as exc:
+                    # keep waiting: the stages of this wave that succeed still get their state written
+                    failed[name] = exc
+                    print(f"  {name:<8} failed: {exc!r} (log: {out_dir / 'logs' / (name + '.log')})")
+                    continue
+                state[name] = {
+                    'inputs': to_run[name],
+                    'outputs': {o: file_fingerprint(out_dir / o) for o in STAGES[name]['outputs']},
+                    'seconds': round(seconds, 3),
+                    'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                }
+                status[name] = 'ran'
+                print(f"  {name:<8} ran in {seconds:.2f}s (log: {out_dir / 'logs' / (name + '.log')})")
+            write_state(out_dir, state)
+            if failed:
+                raise next(iter(failed.values()))
+
+    for name in order:
+        if status[name] != 'ran':
+            print(f"  {name:<8} {status[name]}")
+    print_summary(read_log(profile_log, run_id))
+    return status
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1], formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"stages to run (default: all): {', '.join(STAGES)}")
+    parser.add_argument('--out-dir', type=Path, default=DEFAULT_OUT_DIR, help='artifact directory')
+    parser.add_argument('--force', action='store_true', help='rerun selected stages even if up to date')
+    parser.add_argument('--jobs', type=int, default=4, help='parallel worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='only report which stages would run')
+    parser.add_argument('--list', action='store_true', help='list stages and their last run')
+    parser.add_argument('--profile-dir', type=Path, help='write a cProfile dump per stage into this directory')
+    parser.add_argument('--memory', action='store_true', help='record peak memory per span (tracemalloc)')
+    parser.add_argument('--dedup-policy', choices=['mean', 'max', 'last', 'best'],
+                        help='how the clean stage collapses repeated readings (default: mean)')
+    args = parser.parse_args(argv)
+    unknown = [s for s in args.stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    if args.list:
+        state = read_state(args.out_dir)
+        for name, stage in STAGES.items():
+            last = state.get(name, {})
+            print(f"{name:<8} deps={','.join(stage['deps']) or '-':<6} last={last.get('finished', 'never')} ({last.get('seconds', '-')}s)")
+        return
+    if args.profile_dir:
+        os.environ['PROFILE_DIR'] = str(args.profile_dir)
+    if args.memory:
+        os.environ['PROFILE_MEMORY'] = '1'
+    if args.dedup_policy:
+        os.environ['DEDUP_POLICY'] = args.dedup_policy
+    return run(args.stages, args.out_dir, args.force, args.jobs, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,39 +9,30 @@ Classifies players into:
 Produces `q4_basketball_risk_by_gender.png` and prints counts/percentages.
 """
 from __future__ import annotations
-import os
+import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
 
-ENV_PATH = Path(__file__).resolve().parent / '.env'
-load_dotenv(ENV_PATH)
-
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE', 'research_experiment_refactor_test')
-
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
-    raise SystemExit('Missing DB credentials in .env')
-
-URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-engine = create_engine(URL)
+from cohorts import infer_gender, infer_sport
+from db import get_engine, table_name
+from profiling import profiled
+from query_cache import cached_read_sql
+from rule_engine import evaluate, rule_set
 
 METRICS = ['leftMaxForce', 'rightMaxForce', 'accel_load_accum']
 
-SQL = f"""
+
+def build_sql(table: str) -> str:
+    return f"""
 SELECT playername, team, metric, value
-FROM {DB_TABLE}
+FROM {table}
 WHERE metric IN ({','.join([f"'{m}'" for m in METRICS])})
   AND value IS NOT NULL
 """
 
 def fetch_df():
-    df = pd.read_sql(SQL, engine)
+    df = cached_read_sql(build_sql(table_name()), get_engine())
     return df
 
 
@@ -51,60 +42,20 @@ def per_player_wide(df):
     return pm
 
 
-def infer_gender(team: str) -> str:
-    if not isinstance(team, str):
-        return 'Unknown'
-    t = team.lower()
-    if "women" in t or "women's" in t or "womens" in t:
-        return 'Female'
-    if "men" in t or "men's" in t or "mens" in t:
-        return 'Male'
-    return 'Unknown'
-
-
-def infer_sport(team: str) -> str:
-    if not isinstance(team, str):
-        return 'Unknown'
-    t = team.lower()
-    if 'basketball' in t:
-        return 'Basketball'
-    if 'football' in t:
-        return 'Football'
-    return 'Other'
-
-
-def compute_asym_pct_series(left, right):
-    left = left.fillna(0)
-    right = right.fillna(0)
-    maxv = np.maximum(left, right)
-    asym = np.zeros(len(left))
-    mask = maxv > 0
-    asym[mask] = np.abs(left[mask] - right[mask]) / maxv[mask] * 100.0
-    return asym
-
-
 def classify_risk(pm: pd.DataFrame, accel_thresh: float, asym_threshold: float = 10.0):
+    """Risk categories from the `q4_risk` rule set in flag_rules.json."""
     df = pm.copy()
-    if 'leftMaxForce' in df.columns and 'rightMaxForce' in df.columns:
-        df['asym_pct'] = compute_asym_pct_series(df['leftMaxForce'], df['rightMaxForce'])
-    else:
-        df['asym_pct'] = np.nan
-    df['high_asym'] = df['asym_pct'] >= asym_threshold
-    df['high_load'] = df['accel_load_accum'] >= accel_thresh
-
-    def label_row(r):
-        if r['high_asym'] and r['high_load']:
-            return 'Combined Risk'
-        if r['high_asym']:
-            return 'High Asymmetry'
-        if r['high_load']:
-            return 'High Load'
-        return 'Low Risk'
-
-    df['risk_category'] = df.apply(label_row, axis=1)
+    has_forces = 'leftMaxForce' in df.columns and 'rightMaxForce' in df.columns
+    frame = df if has_forces else df.assign(leftMaxForce=np.nan, rightMaxForce=np.nan)
+    flags = evaluate(rule_set('q4_risk'), frame, accel_thresh=accel_thresh, asym_threshold=asym_threshold)
+    df['asym_pct'] = flags['asym_pct'] if has_forces else np.nan
+    df['high_asym'] = flags['high_asym']
+    df['high_load'] = flags['high_load']
+    df['risk_category'] = flags['risk_category']
     return df
 
 
+@profiled('plot.render')
 def plot_by_gender(df_risk: pd.DataFrame, out_path: Path):
     import matplotlib.pyplot as plt
     import seaborn as sns
@@ -151,12 +102,9 @@ def plot_by_gender(df_risk: pd.DataFrame, out_path: Path):
     plt.close(fig)
 
 
-def main():
-    print('Fetching left/right forces and accel loads...')
-    df = fetch_df()
-    if df.empty:
-        print('No data returned for required metrics')
-        return
+@profiled('plot.basketball_risk')
+def basketball_risk(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-player Basketball risk categories from long-format rows (empty if none)."""
     pm = per_player_wide(df)
     pm['gender'] = pm['team'].apply(infer_gender)
     pm['sport'] = pm['team'].apply(infer_sport)
@@ -167,7 +115,7 @@ def main():
 
     if pm_b.empty:
         print('No Basketball players found')
-        return
+        return pm_b
 
     # accel 90th percentile threshold computed on Basketball players only
     if 'accel_load_accum' in pm_b.columns:
@@ -182,8 +130,24 @@ def main():
     counts = df_risk.groupby(['gender','risk_category']).size().unstack(fill_value=0)
     print('\nCounts by gender and risk category:')
     print(counts.to_string())
+    return df_risk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Plot the Basketball Q4 risk categories by gender.')
+    parser.add_argument('--output', type=Path, default=Path('q4_basketball_risk_by_gender.png'), help='PNG output path')
+    args = parser.parse_args(argv)
+
+    print('Fetching left/right forces and accel loads...')
+    df = fetch_df()
+    if df.empty:
+        print('No data returned for required metrics')
+        return
+    df_risk = basketball_risk(df)
+    if df_risk.empty:
+        return
 
-    out = Path('q4_basketball_risk_by_gender.png')
+    out = args.output
     plot_by_gender(df_risk, out)
     print(f'Bar chart saved to {out.resolve()}')
 
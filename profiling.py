@@ -0,0 +1,194 @@
+"""profiling.py
+
+Lightweight timing instrumentation for queries and pipeline stages.
+
+Wrap code in `span(name)` (context manager) or decorate a function with
+`@profiled(name)`. Each span records wall time, rows in/out, bytes fetched
+and, when memory tracking is on, peak traced memory (tracemalloc).
+
+Environment switches:
+    PROFILE=1               print a summary table when the process exits
+    PROFILE_LOG=path.jsonl  append every record as a JSON line
+    PROFILE_MEMORY=1        track peak memory with tracemalloc (slower)
+    PROFILE_DIR=dir         dump a cProfile (or pyinstrument, with
+                            PROFILE_ENGINE=pyinstrument) file per top-level span
+
+Records are kept in memory for `summary()` / `print_summary()`.
+"""
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+
+RECORDS: list[dict] = []
+_stack: list[dict] = []
+
+
+def _flag(name: str) -> bool:
+    return os.getenv(name, '').lower() not in ('', '0', 'false', 'no')
+
+
+def _rows(obj) -> int | None:
+    try:
+        return len(obj) if isinstance(obj, (pd.DataFrame, pd.Series)) else None
+    except TypeError:
+        return None
+
+
+def frame_bytes(df) -> int | None:
+    """In-memory size of a DataFrame/Series (deep, so strings are counted)."""
+    if isinstance(df, pd.DataFrame):
+        return int(df.memory_usage(deep=True).sum())
+    if isinstance(df, pd.Series):
+        return int(df.memory_usage(deep=True))
+    return None
+
+
+def enable_memory() -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextmanager
+def span(name: str, rows_in: int | None = None, dump: bool | None = None, **fields):
+    """Time a block. The yielded dict can be updated with rows_out/bytes/etc.
+
+    `dump=True` writes a cProfile/pyinstrument file for this span when
+    PROFILE_DIR is set (default: only for top-level spans).
+    """
+    if _flag('PROFILE_MEMORY'):
+        enable_memory()
+    tracing = tracemalloc.is_tracing()
+    record = {'name': name, 'rows_in': rows_in, 'rows_out': None, 'bytes': None, **fields}
+    frame = {'record': record, 'child_peak': 0}
+    if tracing:
+        start_mem = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    profile_dir = os.getenv('PROFILE_DIR')
+    profiler = None
+    if profile_dir and (dump if dump is not None else not _stack):
+        profiler = _start_profiler()
+
+    _stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        _stack.pop()
+        if tracing:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            record['peak_bytes'] = int(peak - start_mem)
+            if _stack:
+                _stack[-1]['child_peak'] = max(_stack[-1]['child_peak'], peak)
+        if profiler is not None:
+            _stop_profiler(profiler, Path(profile_dir), name)
+        record['depth'] = len(_stack)
+        record['pid'] = os.getpid()
+        record['ts'] = time.time()
+        _emit(record)
+
+
+def profiled(name: str | None = None):
+    """Decorator form of `span`; rows_in/rows_out come from DataFrame args/results."""
+    def decorator(func):
+        label = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = next((r for r in map(_rows, args) if r is not None), None)
+            with span(label, rows_in=rows_in) as rec:
+                result = func(*args, **kwargs)
+                rec['rows_out'] = _rows(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def _start_profiler():
+    if os.getenv('PROFILE_ENGINE') == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            pass
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, out_dir: Path, name: str) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+    if hasattr(profiler, 'output_html'):
+        profiler.stop()
+        (out_dir / f"{safe}.html").write_text(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(out_dir / f"{safe}.prof")
+
+
+def _emit(record: dict) -> None:
+    RECORDS.append(record)
+    path = os.getenv('PROFILE_LOG')
+    if path:
+        record = {**record, 'run_id': os.getenv('PROFILE_RUN_ID')}
+        with open(path, 'a') as fh:
+            fh.write(json.dumps(record, default=str) + '\n')
+
+
+def read_log(path, run_id: str | None = None) -> list[dict]:
+    """Load JSON-lines records (optionally only one run's)."""
+    path = Path(path)
+    if not path.exists():
+        return []
+    records = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+    return [r for r in records if run_id is None or r.get('run_id') == run_id]
+
+
+def summary(records: list[dict] | None = None) -> pd.DataFrame:
+    """Aggregate records per span name, slowest first."""
+    df = pd.DataFrame(records if records is not None else RECORDS)
+    if df.empty:
+        return df
+    for col in ['rows_in', 'rows_out', 'bytes', 'peak_bytes']:
+        if col not in df.columns:
+            df[col] = None
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    out = df.groupby('name').agg(
+        calls=('seconds', 'size'),
+        total_s=('seconds', 'sum'),
+        mean_ms=('seconds', lambda s: s.mean() * 1000),
+        rows_in=('rows_in', 'sum'),
+        rows_out=('rows_out', 'sum'),
+        mb_fetched=('bytes', lambda s: s.sum() / 1e6),
+        peak_mb=('peak_bytes', lambda s: s.max() / 1e6),
+    )
+    return out.sort_values('total_s', ascending=False).round(3)
+
+
+def print_summary(records: list[dict] | None = None) -> None:
+    table = summary(records)
+    if table.empty:
+        return
+    print('\n== Timing summary ==')
+    print(table.to_string())
+
+
+if _flag('PROFILE'):
+    atexit.register(print_summary)
@@ -0,0 +1,218 @@
+"""query_cache.py
+
+On-disk cache for `pd.read_sql` results.
+
+Notebooks and scripts re-run the same queries (team list, comparison data,
+the big six-metric fetch) over and over. `cached_read_sql` is a drop-in
+replacement for `pd.read_sql` that stores each result as a Feather file
+keyed by a hash of the database URL, the normalized SQL and its parameters.
+
+An entry is reused while
+- it is younger than the TTL (QUERY_CACHE_TTL seconds, default 24h), and
+- the source table's watermark (max timestamp, row count) is unchanged.
+
+The cache is size bounded (QUERY_CACHE_MAX_MB, default 512) with least
+recently used entries evicted first.
+
+Usage:
+    from query_cache import cached_read_sql
+    df = cached_read_sql(sql, engine)
+
+    python query_cache.py --stats
+    python query_cache.py --clear
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from db import table_mark
+from profiling import frame_bytes, span
+
+
+CACHE_DIR = Path(os.getenv('QUERY_CACHE_DIR', Path(__file__).resolve().parent / '.query_cache'))
+DEFAULT_TTL = float(os.getenv('QUERY_CACHE_TTL', 24 * 3600))
+MAX_BYTES = int(float(os.getenv('QUERY_CACHE_MAX_MB', 512)) * 1024 * 1024)
+# Watermarks are re-checked at most this often, so a notebook re-run issues
+# one cheap MAX/COUNT query instead of one per cached call.
+WATERMARK_TTL = float(os.getenv('QUERY_CACHE_WATERMARK_TTL', 60))
+
+_watermarks: dict[tuple[str, str], tuple[float, list]] = {}
+
+# Callables (sql, watermarks, df, cache_hit) told about every cached_read_sql
+# call, e.g. the run manifests of manifest.py.
+QUERY_LISTENERS: list = []
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and drop trailing semicolons (literals keep their case)."""
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+
+def cache_key(sql: str, params=None, read_kwargs: dict | None = None, con=None) -> str:
+    """Key of a query: database URL, normalised SQL, params and any extra `pd.read_sql` arguments."""
+    parts = [str(getattr(con, 'url', '')), normalize_sql(sql), params] + ([read_kwargs] if read_kwargs else [])
+    payload = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def source_tables(sql: str) -> list[str]:
+    """Table names referenced after FROM/JOIN (subqueries are skipped)."""
+    return sorted(set(re.findall(r'\b(?:from|join)\s+`?([A-Za-z_][\w]*)`?', sql, flags=re.IGNORECASE)))
+
+
+def table_watermark(con, table: str) -> list:
+    """Return [max(timestamp), count(*)] for `table`, re-queried at most every WATERMARK_TTL seconds."""
+    memo_key = (str(getattr(con, 'url', id(con))), table)
+    hit = _watermarks.get(memo_key)
+    if hit and time.time() - hit[0] < WATERMARK_TTL:
+        return hit[1]
+    try:
+        mark = list(table_mark(con, table).values())
+    except Exception:
+        mark = None
+    _watermarks[memo_key] = (time.time(), mark)
+    return mark
+
+
+def _paths(key: str) -> tuple[Path, Path]:
+    return CACHE_DIR / f"{key}.feather", CACHE_DIR / f"{key}.json"
+
+
+def _read_meta(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def cached_read_sql(sql: str, con, params=None, ttl: float | None = None, refresh: bool = False, **kwargs) -> pd.DataFrame:
+    """`pd.read_sql` with an on-disk, watermark-validated cache.
+
+    `ttl=0` or `refresh=True` forces a database read (and refreshes the entry).
+    Extra keyword arguments are passed to `pd.read_sql`.
+    """
+    ttl = DEFAULT_TTL if ttl is None else ttl
+    key = cache_key(sql, params, kwargs, con)
+    data_path, meta_path = _paths(key)
+    tables = source_tables(sql)
+    marks = {t: table_watermark(con, t) for t in tables}
+
+    meta = _read_meta(meta_path)
+    if (not refresh and meta and data_path.exists()
+            and time.time() - meta['created'] < ttl and meta.get('watermarks') == marks):
+        meta['last_access'] = time.time()
+        meta['hits'] = meta.get('hits', 0) + 1
+        meta_path.write_text(json.dumps(meta))
+        with span('read_sql[cache]', key=key) as rec:
+            df = pd.read_feather(data_path)
+            if meta.get('index'):
+                df = df.set_index(meta['index'])
+                df.index.names = meta['index_names']
+            rec.update(rows_out=len(df), bytes=data_path.stat().st_size)
+        for listener in QUERY_LISTENERS:
+            listener(sql, marks, df, True)
+        return df
+
+    with span('read_sql', key=key) as rec:
+        df = pd.read_sql(sql, con, params=params, **kwargs)
+        rec.update(rows_out=len(df), bytes=frame_bytes(df))
+    _store(key, sql, params, marks, df)
+    for listener in QUERY_LISTENERS:
+        listener(sql, marks, df, False)
+    return df
+
+
+def _store(key: str, sql: str, params, marks: dict, df: pd.DataFrame) -> None:
+    data_path, meta_path = _paths(key)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # a non-default index (e.g. index_col=...) is stored as columns and restored on a hit
+    keep_index = not isinstance(df.index, pd.RangeIndex)
+    # copy before renaming so the caller's frame keeps its column labels
+    frame = df.reset_index() if keep_index else df.copy(deep=False)
+    frame.columns = [str(c) for c in frame.columns]
+    tmp = data_path.with_suffix('.tmp')
+    frame.to_feather(tmp)
+    tmp.replace(data_path)
+    now = time.time()
+    meta = {
+        'sql': normalize_sql(sql),
+        'params': json.loads(json.dumps(params, default=str)),
+        'index': list(frame.columns[:df.index.nlevels]) if keep_index else None,
+        'index_names': list(df.index.names) if keep_index else None,
+        'watermarks': marks,
+        'created': now,
+        'last_access': now,
+        'hits': 0,
+        'rows': len(df),
+        'bytes': data_path.stat().st_size,
+    }
+    meta_path.write_text(json.dumps(meta))
+    evict()
+
+
+def entries() -> pd.DataFrame:
+    """One row per cache entry with its metadata."""
+    rows = []
+    for meta_path in CACHE_DIR.glob('*.json'):
+        meta = _read_meta(meta_path)
+        if meta:
+            rows.append({'key': meta_path.stem, **meta})
+    return pd.DataFrame(rows, columns=['key', 'sql', 'params', 'watermarks', 'created', 'last_access', 'hits', 'rows', 'bytes'])
+
+
+def evict(max_bytes: int = MAX_BYTES, ttl: float | None = None) -> list[str]:
+    """Remove expired entries, then least recently used ones until under `max_bytes`."""
+    ttl = DEFAULT_TTL if ttl is None else ttl
+    df = entries()
+    if df.empty:
+        return []
+    now = time.time()
+    expired = df[now - df['created'] >= ttl]
+    live = df.drop(expired.index).sort_values('last_access', ascending=False)
+    over = live[live['bytes'].cumsum() > max_bytes]
+    removed = list(expired['key']) + list(over['key'])
+    for key in removed:
+        for path in _paths(key):
+            path.unlink(missing_ok=True)
+    return removed
+
+
+def clear_cache() -> int:
+    """Delete every cache entry; returns the number removed."""
+    keys = list(entries()['key'])
+    for key in keys:
+        for path in _paths(key):
+            path.unlink(missing_ok=True)
+    _watermarks.clear()
+    return len(keys)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Inspect or clear the read_sql result cache.')
+    parser.add_argument('--stats', action='store_true', help='list cache entries')
+    parser.add_argument('--clear', action='store_true', help='delete all cache entries')
+    args = parser.parse_args(argv)
+
+    if args.clear:
+        print(f"Removed {clear_cache()} cache entries from {CACHE_DIR}")
+        return
+    df = entries()
+    if df.empty:
+        print(f"Cache at {CACHE_DIR} is empty")
+        return
+    df['age_h'] = ((time.time() - df['created']) / 3600).round(2)
+    df['sql'] = df['sql'].str.slice(0, 60)
+    print(df[['key', 'rows', 'bytes', 'hits', 'age_h', 'sql']].to_string(index=False))
+    print(f"\nTotal: {len(df)} entries, {df['bytes'].sum() / 1024 / 1024:.1f} MB (limit {MAX_BYTES / 1024 / 1024:.0f} MB)")
+
+
+if __name__ == '__main__':
+    main()
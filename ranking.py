@@ -0,0 +1,136 @@
+"""ranking.py
+
+Top-k / bottom-k rows per group without sorting whole slices.
+
+Rows are bucketed by their group codes (metric, team, cohort ...) with one
+stable integer argsort; inside every bucket `np.argpartition` selects the k
+extreme values in linear time and only those k are sorted. Ties are broken by
+input order, so results are deterministic. Rows whose ranking value is NaN
+are never ranked.
+
+Rankings can use any numeric column: the raw `value`, `pct_diff_from_team`
+or `z_score` from part2, the shrinkage-adjusted `shrunk_z` / `athlete_z`
+(shrinkage.py), or a player-mean column.
+
+Usage:
+    from ranking import top_k, top_bottom
+    top, bottom = top_bottom(df_z, by='z_score', k=5, groups=['metric', 'team'])
+
+    python ranking.py --by pct_diff_from_team --group metric --group gender -k 5
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from profiling import profiled
+
+
+RANK_COLUMNS = ['value', 'pct_diff_from_team', 'z_score', 'shrunk_z', 'athlete_z']
+
+
+def select_k(values: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """Positions of the k largest (or smallest) non-NaN values, best first, ties by position."""
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    pos = np.flatnonzero(~np.isnan(values))
+    v = values[pos] if largest else -values[pos]
+    if k < len(v):
+        cut = np.argpartition(v, len(v) - k)[len(v) - k:]
+        threshold = v[cut].min()
+        above = np.flatnonzero(v > threshold)
+        ties = np.flatnonzero(v == threshold)[:k - len(above)]
+        keep = np.concatenate([above, ties])
+    else:
+        keep = np.arange(len(v))
+    order = np.lexsort((pos[keep], -v[keep]))
+    return pos[keep][order]
+
+
+def _buckets(df: pd.DataFrame, groups: list) -> tuple[list[tuple], list[np.ndarray]]:
+    """Group keys and the row positions of each group (in input order)."""
+    if not groups:
+        return [()], [np.arange(len(df))]
+    codes, levels = [], []
+    for g in groups:
+        col_codes, uniques = pd.factorize(df[g] if isinstance(g, str) else g, sort=True)
+        codes.append(col_codes)
+        levels.append(uniques)
+    valid = np.all([c >= 0 for c in codes], axis=0)      # rows with a NaN group key are not ranked
+    combined = np.ravel_multi_index([c[valid] for c in codes], [len(u) for u in levels])
+    rows = np.flatnonzero(valid)[np.argsort(combined, kind='stable')]
+    counts = np.bincount(combined, minlength=int(np.prod([len(u) for u in levels])))
+    bounds = np.r_[0, np.cumsum(counts)]
+    present = np.flatnonzero(counts)
+    keys = [tuple(u[i] for u, i in zip(levels, np.unravel_index(flat, [len(u) for u in levels]))) for flat in present]
+    return keys, [rows[bounds[i]:bounds[i + 1]] for i in present]
+
+
+@profiled('ranking.top_k')
+def top_k(df: pd.DataFrame, by: str, k: int = 5, groups: list | None = None, largest: bool = True) -> pd.DataFrame:
+    """The k rows with the largest (or smallest) `by` per group, best first, with a `rank` column.
+
+    `groups` holds column names or Series aligned with `df` (e.g. a cohort label).
+    """
+    groups = list(groups or [])
+    values = df[by].to_numpy(float)
+    keys, buckets = _buckets(df, groups)
+    picked, ranks, labels = [], [], []
+    for key, rows in zip(keys, buckets):
+        sel = rows[select_k(values[rows], k, largest)]
+        picked.append(sel)
+        ranks.append(np.arange(1, len(sel) + 1))
+        labels.extend([key] * len(sel))
+    positions = np.concatenate(picked) if picked else np.array([], dtype=int)
+    out = df.iloc[positions].copy()
+    for i, g in enumerate(groups):
+        if not isinstance(g, str):
+            out[g.name or f"group_{i}"] = [key[i] for key in labels]
+    out['rank'] = np.concatenate(ranks) if ranks else np.array([], dtype=int)
+    return out
+
+
+def top_bottom(df: pd.DataFrame, by: str, k: int = 5, groups: list | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """(top k, bottom k) per group; bottom rows are worst first."""
+    return top_k(df, by, k, groups, largest=True), top_k(df, by, k, groups, largest=False)
+
+
+def top_k_series(s: pd.Series, k: int, largest: bool = True) -> pd.Series:
+    """Series counterpart of `top_k` (same as `s.dropna().sort_values().head(k)` with stable ties)."""
+    return s.iloc[select_k(s.to_numpy(float), k, largest)]
+
+
+def main(argv: list[str] | None = None):
+    from cohorts import infer_gender, infer_sport
+
+    parser = argparse.ArgumentParser(description='Top-k / bottom-k athletes per metric, team or cohort from the derived metrics.')
+    parser.add_argument('--artifacts', type=Path, default=Path(__file__).resolve().parent / '.pipeline',
+                        help='pipeline artifact directory with derived.feather')
+    parser.add_argument('--by', choices=RANK_COLUMNS, default='pct_diff_from_team', help='column to rank by')
+    parser.add_argument('--group', action='append', choices=['metric', 'team', 'gender', 'sport'],
+                        help='group by these (default: metric)')
+    parser.add_argument('-k', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    df = pd.read_feather(args.artifacts / 'derived.feather')
+    df['gender'] = df['team'].map(infer_gender)
+    df['sport'] = df['team'].map(infer_sport)
+    groups = args.group or ['metric']
+    top, bottom = top_bottom(df, args.by, args.k, groups)
+    cols = list(dict.fromkeys(groups + ['rank', 'playername', 'team', 'value', args.by]))
+    print("="*80)
+    print(f"TOP {args.k} BY {args.by} (per {', '.join(groups)})")
+    print("="*80)
+    print(top[cols].to_string(index=False))
+    print("\n" + "="*80)
+    print(f"BOTTOM {args.k} BY {args.by} (per {', '.join(groups)})")
+    print("="*80)
+    print(bottom[cols].to_string(index=False))
+    return top, bottom
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""resampling.py
+
+Bootstrap CIs and permutation p-values for two-group comparisons
+(Male vs Female, a team vs the rest of its gender), clustered by athlete.
+
+Session rows of one athlete are not independent, so the resampling unit is
+the athlete (player, team): every athlete is reduced to the count, sum and
+sum of squares of their (centred) values, and a resample is a set of
+athletes. Group means, the mean difference and Cohen's d (pooled SD) follow
+from the summed statistics:
+
+    mean = s / n        ss = q - s * mean        d = (mean_a - mean_b) / sqrt((ss_a + ss_b) / (n_a + n_b - 2))
+
+With `unit='athlete'` every athlete counts once with their mean value
+(the per-player-means comparison of test.py Q1); with `unit='session'`
+every session counts, but athletes are still resampled as whole clusters.
+
+Resamples are batched index matrices: a (B, k) matrix of athlete indices
+drawn with replacement within each group for the bootstrap, and a (B, k)
+matrix of row-wise shuffled indices over both groups for the permutation
+test (labels exchanged between athletes). One gather and sum gives the
+statistics of B resamples at once. Every metric x comparison runs in its own
+worker process with an independent seed.
+
+Usage:
+    from resampling import compare_groups
+    table = compare_groups(df, by='gender', metrics=['Jump Height(m)'])
+
+    python resampling.py                          # gender comparisons -> group_comparisons.csv
+    python resampling.py --by team --unit athlete --boot 10000 --perm 10000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import infer_gender, infer_sport
+from db import METRICS, get_engine, table_name
+from profiling import profiled
+from query_cache import cached_read_sql
+
+
+DEFAULT_RESAMPLES = 10000
+MIN_ATHLETES = 2
+BATCH = 1000
+OUTPUT_PATH = Path(__file__).resolve().parent / 'group_comparisons.csv'
+KEY = ['playername', 'team']
+COLUMNS = ['cohort', 'group_a', 'group_b', 'metric', 'athletes_a', 'athletes_b', 'n_a', 'n_b', 'mean_a', 'mean_b',
+           'diff', 'cohens_d', 'diff_lo', 'diff_hi', 'd_lo', 'd_hi', 'p_perm']
+
+
+def cluster_sums(df: pd.DataFrame, metrics: list[str] | None = None,
+                 unit: str = 'session') -> tuple[pd.DataFrame, pd.Series]:
+    """Per (metric, player, team): n, s, q of the values centred on the metric mean.
+
+    Returns (sums, centres); a group mean is s.sum() / n.sum() + centres[metric].
+    """
+    if unit not in ('session', 'athlete'):
+        raise ValueError(f"unit must be 'session' or 'athlete', not {unit!r}")
+    rows = df[['playername', 'team', 'metric', 'value']].dropna(subset=['value'])
+    if metrics is not None:
+        rows = rows[rows['metric'].isin(metrics)]
+    if unit == 'athlete':
+        rows = rows.groupby(KEY + ['metric'], as_index=False, sort=False)['value'].mean()
+    centres = rows.groupby('metric')['value'].mean()
+    v = rows['value'].to_numpy(float) - rows['metric'].map(centres).to_numpy(float)
+    sums = (rows[KEY + ['metric']].assign(n=1.0, s=v, q=v * v)
+            .groupby(['metric'] + KEY, sort=True)[['n', 's', 'q']].sum().reset_index())
+    return sums, centres
+
+
+def comparisons(athletes: pd.DataFrame, by: str = 'gender') -> list[tuple[str, str, str, np.ndarray, np.ndarray]]:
+    """(cohort, group_a, group_b, mask_a, mask_b) over the rows of `athletes` (player, team).
+
+    by='gender': Male vs Female over all athletes and within every sport that has both.
+    by='team':   each team vs the other athletes of the same gender.
+    """
+    gender = athletes['team'].map(infer_gender)
+    sport = athletes['team'].map(infer_sport)
+    out = []
+    if by == 'gender':
+        male, female = (gender == 'Male').to_numpy(), (gender == 'Female').to_numpy()
+        out.append(('All', 'Male', 'Female', male, female))
+        for s in sorted(sport.unique()):
+            in_sport = (sport == s).to_numpy()
+            out.append((f"sport={s}", 'Male', 'Female', male & in_sport, female & in_sport))
+    elif by == 'team':
+        for team in sorted(athletes['team'].unique()):
+            g = infer_gender(team)
+            mine = (athletes['team'] == team).to_numpy()
+            out.append((f"gender={g}", team, f"other {g}", mine, (gender == g).to_numpy() & ~mine))
+    else:
+        raise ValueError(f"by must be 'gender' or 'team', not {by!r}")
+    return [c for c in out if c[3].sum() >= MIN_ATHLETES and c[4].sum() >= MIN_ATHLETES]
+
+
+def _effect(A: np.ndarray, B: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Mean difference and Cohen's d from summed (n, s, q) along the last axis."""
+    na, sa, qa = A[..., 0], A[..., 1], A[..., 2]
+    nb, sb, qb = B[..., 0], B[..., 1], B[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ma, mb = sa / na, sb / nb
+        pooled = np.sqrt(((qa - sa * ma) + (qb - sb * mb)) / (na + nb - 2))
+        return ma - mb, (ma - mb) / pooled
+
+
+def _resample(args) -> dict:
+    """Worker: bootstrap CIs and permutation p-value for one metric x comparison."""
+    key, a, b, centre, n_boot, n_perm, seed, level, batch = args
+    rng = np.random.default_rng(seed)
+    ka, kb = len(a), len(b)
+    sa, sb = a.sum(axis=0), b.sum(axis=0)
+    diff, d = _effect(sa, sb)
+    out = {**key, 'athletes_a': ka, 'athletes_b': kb, 'n_a': int(sa[0]), 'n_b': int(sb[0]),
+           'mean_a': float(sa[1] / sa[0] + centre), 'mean_b': float(sb[1] / sb[0] + centre),
+           'diff': float(diff), 'cohens_d': float(d)}
+
+    if n_boot > 0:
+        diffs, ds = [], []
+        for start in range(0, n_boot, batch):
+            size = min(batch, n_boot - start)
+            A = a[rng.integers(0, ka, (size, ka))].sum(axis=1)
+            B = b[rng.integers(0, kb, (size, kb))].sum(axis=1)
+            bd, bdd = _effect(A, B)
+            diffs.append(bd)
+            ds.append(bdd)
+        tail = (1 - level) / 2 * 100
+        out['diff_lo'], out['diff_hi'] = np.nanpercentile(np.concatenate(diffs), [tail, 100 - tail])
+        out['d_lo'], out['d_hi'] = np.nanpercentile(np.concatenate(ds), [tail, 100 - tail])
+
+    if n_perm > 0:
+        pooled = np.concatenate([a, b])
+        total = pooled.sum(axis=0)
+        order = np.arange(ka + kb)
+        extreme = 0
+        for start in range(0, n_perm, batch):
+            size = min(batch, n_perm - start)
+            idx = rng.permuted(np.broadcast_to(order, (size, ka + kb)), axis=1)
+            A = pooled[idx[:, :ka]].sum(axis=1)
+            extreme += int((np.abs(_effect(A, total - A)[0]) >= abs(diff) - 1e-12).sum())
+        out['p_perm'] = (extreme + 1) / (n_perm + 1)
+    return out
+
+
+@profiled('resampling.compare')
+def compare_groups(df: pd.DataFrame, by: str = 'gender', metrics: list[str] | None = None,
+                   cohorts: list[str] | None = None, unit: str = 'session',
+                   n_boot: int = DEFAULT_RESAMPLES, n_perm: int = DEFAULT_RESAMPLES, level: float = 0.95,
+                   jobs: int | None = None, seed: int = 0) -> pd.DataFrame:
+    """One row per comparison x metric: group means, diff and Cohen's d with CIs, permutation p.
+
+    Always has the COLUMNS (CI / p columns are NaN when disabled); comparisons with
+    fewer than MIN_ATHLETES athletes on a side are left out.
+    """
+    metrics = [m for m in (metrics or METRICS) if m in set(df['metric'])]
+    sums, centres = cluster_sums(df, metrics, unit)
+    athletes = sums[KEY].drop_duplicates().sort_values(KEY).reset_index(drop=True)
+    groups = comparisons(athletes, by)
+    if cohorts:
+        groups = [g for g in groups if g[0] in cohorts]
+
+    tasks = []
+    for metric, part in sums.groupby('metric', sort=False):
+        present = pd.MultiIndex.from_frame(athletes).isin(pd.MultiIndex.from_frame(part[KEY]))
+        stats = part[['n', 's', 'q']].to_numpy(float)
+        pos = np.cumsum(present) - 1                   # athlete row -> row of `part`
+        for cohort, ga, gb, ma, mb in groups:
+            a, b = stats[pos[ma & present]], stats[pos[mb & present]]
+            if len(a) < MIN_ATHLETES or len(b) < MIN_ATHLETES:
+                continue
+            key = {'cohort': cohort, 'group_a': ga, 'group_b': gb, 'metric': metric}
+            tasks.append((key, a, b, centres[metric], n_boot, n_perm, level))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    tasks = [(*t[:6], s, t[6], BATCH) for t, s in zip(tasks, seeds)]
+
+    if jobs == 1:
+        rows = [_resample(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+            rows = list(pool.map(_resample, tasks))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def fetch_rows(metrics: list[str] | None = None) -> pd.DataFrame:
+    """Session rows (playername, team, metric, value) of the metrics, through the query cache."""
+    metrics = "','".join(metrics or METRICS)
+    sql = f"SELECT playername, team, metric, value FROM {table_name()} WHERE metric IN ('{metrics}') AND value IS NOT NULL"
+    return cached_read_sql(sql, get_engine())
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Athlete-clustered bootstrap CIs and permutation tests for group comparisons.')
+    parser.add_argument('--by', choices=['gender', 'team'], default='gender', help='which groups to compare')
+    parser.add_argument('--unit', choices=['session', 'athlete'], default='session',
+                        help='count every session, or every athlete once (their mean)')
+    parser.add_argument('--metric', action='append', help='only these metrics')
+    parser.add_argument('--cohort', action='append', help='only these cohorts (e.g. All, "sport=Basketball")')
+    parser.add_argument('--boot', type=int, default=DEFAULT_RESAMPLES, help='bootstrap resamples (0 disables CIs)')
+    parser.add_argument('--perm', type=int, default=DEFAULT_RESAMPLES, help='permutations (0 disables p-values)')
+    parser.add_argument('--level', type=float, default=0.95, help='confidence level')
+    parser.add_argument('--jobs', type=int, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=OUTPUT_PATH, help='CSV output path')
+    args = parser.parse_args(argv)
+
+    df = fetch_rows(args.metric)
+    start = time.perf_counter()
+    table = compare_groups(df, by=args.by, metrics=args.metric, cohorts=args.cohort, unit=args.unit,
+                           n_boot=args.boot, n_perm=args.perm, level=args.level, jobs=args.jobs, seed=args.seed)
+    elapsed = time.perf_counter() - start
+    table.to_csv(args.output, index=False)
+
+    print("="*80)
+    print(f"GROUP COMPARISONS by {args.by}, clustered by athlete ({len(table)} metric x comparison, "
+          f"{args.boot} bootstrap / {args.perm} permutation resamples, {elapsed:.2f}s)")
+    print("="*80)
+    if not table.empty:
+        print(table.round(4).to_string(index=False))
+    print(f"\nWrote {args.output}")
+    return table
+
+
+if __name__ == '__main__':
+    main()
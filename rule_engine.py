@@ -0,0 +1,332 @@
+"""rule_engine.py
+
+Declarative flag rules compiled to a vectorized evaluation plan.
+
+Rule sets live in `flag_rules.json` (or a YAML file if PyYAML is installed).
+Each set has optional `derived` columns, a list of `rules` and an optional
+`category` labelling. A rule is either a comparison
+
+    {"name": "high_load", "metric": "accel_load_accum", "op": ">",
+     "threshold": {"stat": "quantile", "q": 0.9, "by": ["gender"]},
+     "where": {"sport": ["Basketball"]}}
+
+or a combinator over other rules / inline comparisons
+
+    {"name": "combined_risk", "all": ["high_asym", "high_load"]}     # AND
+    {"name": "any_flag", "any": ["high_asym", "high_load"]}          # OR
+
+Thresholds are numbers, "$param" placeholders bound at evaluation time, or a
+cohort statistic (quantile/mean/median/std/min/max, optionally grouped `by`
+columns). `metric` names a column of a wide frame; on a long frame
+(metric/value columns) it selects the rows of that metric.
+
+Compiling resolves dependencies and de-duplicates statistics, so every
+threshold is computed once and every rule is a single numpy comparison.
+
+Usage:
+    from rule_engine import rule_set, evaluate
+    flags = evaluate(rule_set('q4_risk'), pm, accel_thresh=123.4, asym_threshold=10)
+
+    python rule_engine.py --explain              # show compiled plans
+    python rule_engine.py --set all_sports       # evaluate on per-player means
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import operator
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+RULES_PATH = Path(__file__).resolve().parent / 'flag_rules.json'
+
+OPS = {
+    '>': operator.gt, '>=': operator.ge,
+    '<': operator.lt, '<=': operator.le,
+    '==': operator.eq, '!=': operator.ne,
+}
+STATS = {'quantile', 'mean', 'median', 'std', 'min', 'max'}
+
+
+def load_rules(path: str | Path | None = None) -> dict:
+    """Read a JSON (or YAML) rules file."""
+    path = Path(path or RULES_PATH)
+    text = path.read_text()
+    if path.suffix in ('.yml', '.yaml'):
+        import yaml
+
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+@lru_cache(maxsize=None)
+def rule_set(name: str, path: str | None = None) -> dict:
+    """Compiled plan for one named set of the rules file."""
+    rules = load_rules(path)
+    if name not in rules:
+        raise KeyError(f"Unknown rule set {name!r}; available: {', '.join(rules)}")
+    return compile_rules(rules[name])
+
+
+# ============================================================================
+# Compilation
+# ============================================================================
+
+def _stat_key(metric: str, spec: dict, where: dict | None) -> tuple:
+    stat = spec.get('stat')
+    if stat not in STATS:
+        raise ValueError(f"Unknown statistic {stat!r} (use one of {sorted(STATS)})")
+    return (metric, stat, spec.get('q'), tuple(spec.get('by', ())), json.dumps(where, sort_keys=True) if where else None)
+
+
+def compile_rules(spec: dict) -> dict:
+    """Turn a rule-set spec into an ordered plan of derived columns, statistics and steps."""
+    rules = {r['name']: r for r in spec.get('rules', [])}
+    steps: list[dict] = []
+    stats: dict[tuple, str] = {}
+    done: set[str] = set()
+    inline = 0
+
+    def add_compare(name: str, rule: dict) -> None:
+        if rule.get('op') not in OPS:
+            raise ValueError(f"Rule {name!r}: unknown op {rule.get('op')!r}")
+        threshold = rule.get('threshold')
+        step = {'name': name, 'kind': 'compare', 'metric': rule['metric'], 'op': rule['op'],
+                'where': rule.get('where'), 'label': rule.get('label', name)}
+        if isinstance(threshold, dict):
+            key = _stat_key(rule['metric'], threshold, rule.get('where'))
+            step['stat'] = stats.setdefault(key, f"__stat{len(stats)}")
+        elif isinstance(threshold, str) and threshold.startswith('$'):
+            step['param'] = threshold[1:]
+        elif isinstance(threshold, (int, float)):
+            step['value'] = float(threshold)
+        else:
+            raise ValueError(f"Rule {name!r}: threshold must be a number, '$param' or a statistic")
+        steps.append(step)
+
+    def visit(name: str, stack: tuple = ()) -> None:
+        nonlocal inline
+        if name in done:
+            return
+        if name in stack:
+            raise ValueError(f"Circular rule reference: {' -> '.join(stack + (name,))}")
+        if name not in rules:
+            raise KeyError(f"Rule {name!r} is referenced but not defined")
+        rule = rules[name]
+        combinator = 'all' if 'all' in rule else 'any' if 'any' in rule else None
+        if combinator is None:
+            add_compare(name, rule)
+        else:
+            parts = []
+            for item in rule[combinator]:
+                if isinstance(item, dict):
+                    inline += 1
+                    part = f"__{name}_{inline}"
+                    add_compare(part, item)
+                else:
+                    visit(item, stack + (name,))
+                    part = item
+                parts.append(part)
+            steps.append({'name': name, 'kind': combinator, 'parts': parts, 'label': rule.get('label', name)})
+        done.add(name)
+
+    for name in rules:
+        visit(name)
+
+    return {
+        'description': spec.get('description', ''),
+        'derived': spec.get('derived', {}),
+        'stats': [{'id': sid, 'metric': k[0], 'stat': k[1], 'q': k[2], 'by': list(k[3]),
+                   'where': json.loads(k[4]) if k[4] else None} for k, sid in stats.items()],
+        'steps': steps,
+        'outputs': list(rules),
+        'category': spec.get('category'),
+    }
+
+
+def explain(plan: dict) -> str:
+    lines = [plan['description']] if plan['description'] else []
+    for name, d in plan['derived'].items():
+        lines.append(f"  derive  {name} = {d['op']}({d['left']}, {d['right']})")
+    for s in plan['stats']:
+        q = f"({s['q']})" if s['q'] is not None else ''
+        by = f" by {', '.join(s['by'])}" if s['by'] else ''
+        lines.append(f"  stat    {s['id']} = {s['stat']}{q}[{s['metric']}]{by}")
+    for step in plan['steps']:
+        if step['kind'] == 'compare':
+            rhs = step.get('stat') or (f"${step['param']}" if 'param' in step else step.get('value'))
+            where = f" where {step['where']}" if step['where'] else ''
+            lines.append(f"  rule    {step['name']} = {step['metric']} {step['op']} {rhs}{where}")
+        else:
+            joiner = ' AND ' if step['kind'] == 'all' else ' OR '
+            lines.append(f"  rule    {step['name']} = {joiner.join(step['parts'])}")
+    if plan['category']:
+        cases = ', '.join(f"{r} -> {label}" for r, label in plan['category']['cases'])
+        lines.append(f"  label   {plan['category']['column']}: {cases} else {plan['category']['default']}")
+    return '\n'.join(lines)
+
+
+# ============================================================================
+# Evaluation
+# ============================================================================
+
+def _asymmetry(left: pd.Series, right: pd.Series, fill=None) -> np.ndarray:
+    if fill is not None:
+        left, right = left.fillna(fill), right.fillna(fill)
+    left, right = left.to_numpy(float), right.to_numpy(float)
+    strong = np.fmax(left, right)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        asym = np.abs(left - right) / strong * 100.0
+    asym[strong == 0] = 0.0
+    return asym
+
+
+DERIVED_OPS = {'asymmetry': _asymmetry}
+
+
+def _metric_values(df: pd.DataFrame, metric: str, where: dict | None) -> pd.Series:
+    """Values of `metric` as a float Series aligned to df (NaN where not applicable)."""
+    if metric in df.columns:
+        values = df[metric].astype(float)
+    elif {'metric', 'value'}.issubset(df.columns):
+        values = df['value'].astype(float).where(df['metric'] == metric)
+    else:
+        raise KeyError(f"Column {metric!r} not found (and frame is not long metric/value format)")
+    if where:
+        mask = np.ones(len(df), dtype=bool)
+        for col, allowed in where.items():
+            allowed = allowed if isinstance(allowed, list) else [allowed]
+            mask &= df[col].isin(allowed).to_numpy()
+        values = values.where(mask)
+    return values
+
+
+def _compute_stat(df: pd.DataFrame, s: dict) -> np.ndarray:
+    values = _metric_values(df, s['metric'], s['where'])
+    args = (s['q'],) if s['stat'] == 'quantile' else ()
+    if s['by']:
+        return values.groupby([df[c] for c in s['by']], dropna=False).transform(s['stat'], *args).to_numpy(float)
+    return np.full(len(df), getattr(values, s['stat'])(*args), dtype=float)
+
+
+def evaluate(plan: dict, df: pd.DataFrame, only: list[str] | None = None,
+             with_thresholds: bool = False, **params) -> pd.DataFrame:
+    """Evaluate a compiled plan; returns one boolean column per rule (index aligned to df).
+
+    `only` restricts evaluation to the named rules (and what they depend on).
+    `with_thresholds=True` adds `<rule>_threshold` columns for comparison rules.
+    A `category` column is added when the plan defines one.
+    """
+    steps = plan['steps']
+    if only is not None:
+        needed = set(only)
+        for step in reversed(steps):
+            if step['name'] in needed and step['kind'] != 'compare':
+                needed.update(step['parts'])
+        steps = [s for s in steps if s['name'] in needed]
+
+    frame = df
+    if plan['derived']:
+        frame = df.copy()
+        for name, d in plan['derived'].items():
+            frame[name] = DERIVED_OPS[d['op']](frame[d['left']], frame[d['right']], d.get('fill'))
+
+    used = {s['stat'] for s in steps if 'stat' in s}
+    stat_values = {s['id']: _compute_stat(frame, s) for s in plan['stats'] if s['id'] in used}
+
+    results: dict[str, np.ndarray] = {}
+    thresholds: dict[str, np.ndarray] = {}
+    for step in steps:
+        if step['kind'] == 'compare':
+            values = _metric_values(frame, step['metric'], step['where']).to_numpy(float)
+            if 'stat' in step:
+                rhs = stat_values[step['stat']]
+            elif 'param' in step:
+                if step['param'] not in params:
+                    raise KeyError(f"Rule {step['name']!r} needs parameter {step['param']!r}")
+                rhs = float(params[step['param']])
+            else:
+                rhs = step['value']
+            with np.errstate(invalid='ignore'):
+                results[step['name']] = OPS[step['op']](values, rhs) & ~np.isnan(values)
+            thresholds[step['name']] = np.broadcast_to(rhs, values.shape)
+        else:
+            parts = [results[p] for p in step['parts']]
+            reduce = np.logical_and.reduce if step['kind'] == 'all' else np.logical_or.reduce
+            results[step['name']] = reduce(parts)
+
+    names = [n for n in plan['outputs'] if n in results]
+    out = pd.DataFrame({n: results[n] for n in names}, index=df.index)
+    if with_thresholds:
+        for n in names:
+            if n in thresholds:
+                out[f"{n}_threshold"] = thresholds[n]
+    category = plan['category']
+    if category and (only is None or all(r in results for r, _ in category['cases'])):
+        out[category['column']] = np.select([results[r] for r, _ in category['cases']],
+                                            [label for _, label in category['cases']],
+                                            default=category['default'])
+    for name in plan['derived']:
+        out[name] = frame[name].to_numpy()
+    return out
+
+
+def passes(plan: dict, rule: str, **values) -> bool:
+    """Evaluate one rule against scalar values (e.g. a single decision in a script)."""
+    row = pd.DataFrame([values])
+    return bool(evaluate(plan, row, only=[rule])[rule].iloc[0])
+
+
+def flag_reasons(plan: dict, flags: pd.DataFrame, rules: list[str] | None = None) -> pd.Series:
+    """'; '-joined labels of the rules that fired per row ('' if none)."""
+    labels = {s['name']: s['label'] for s in plan['steps']}
+    rules = rules or [n for n in plan['outputs'] if n in flags.columns and flags[n].dtype == bool]
+    reasons = pd.Series('', index=flags.index)
+    for name in rules:
+        hit = flags[name]
+        reasons = reasons.where(~hit, reasons.where(reasons == '', reasons + '; ') + labels[name])
+    return reasons
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Compile and evaluate declarative flag rules.')
+    parser.add_argument('--rules', type=Path, default=RULES_PATH, help='rules file (JSON, or YAML with PyYAML)')
+    parser.add_argument('--set', dest='rule_set', help='evaluate this set on per-player means from the database')
+    parser.add_argument('--explain', action='store_true', help='print the compiled plan of every set')
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.rules)
+    if args.explain or not args.rule_set:
+        for name, spec in rules.items():
+            print(f"[{name}]")
+            print(explain(compile_rules(spec)))
+            print()
+        return
+
+    from cohorts import infer_gender, infer_sport
+    from plot_q4_risk_distribution_basketball_gender import per_player_wide
+    from db import METRICS, get_engine, table_name
+    from query_cache import cached_read_sql
+
+    plan = compile_rules(rules[args.rule_set])
+    metrics = "','".join(METRICS)
+    sql = f"SELECT playername, team, metric, value FROM {table_name()} WHERE metric IN ('{metrics}') AND value IS NOT NULL"
+    pm = per_player_wide(cached_read_sql(sql, get_engine()))
+    pm['gender'] = pm['team'].apply(infer_gender)
+    pm['sport'] = pm['team'].apply(infer_sport)
+
+    flags = evaluate(plan, pm)
+    rule_cols = [n for n in plan['outputs'] if n in flags.columns]
+    print("="*80)
+    print(f"RULE SET: {args.rule_set} ({len(pm)} players)")
+    print("="*80)
+    print(flags[rule_cols].groupby(pm['sport']).sum().to_string())
+    return flags
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""sessions.py
+
+Materialised force-plate session table: one narrow row per test.
+
+Rows are (playername, team, timestamp, data_source) with one column per
+force-plate metric:
+
+    Jump Height(m), Peak Propulsive Force(N)    (Hawkins)
+    leftMaxForce, rightMaxForce                 (VALD, paired per test)
+    asymmetry_pct, stronger_side                (part4 formula: (strong - weak) / strong * 100)
+
+Rows are selected by metric, whatever their `data_source` (NULL or unusual
+spellings included), cleaned (data_quality), collapsed per (player, metric,
+timestamp) (dedup) and pivoted once by `to_sessions`; data_source is the
+source of the session's last reading. It is stored as
+`.sessions/sessions.feather` with the watermark of the force-plate rows
+(db.refresh_plan): a refresh appends only the sessions newer than it, and
+rebuilds when older rows changed.
+
+This is the one left/right pairing path: part4_flags.py and flag_backtest.py
+read the paired tests from the table, the pipeline's flags stage pivots its
+cleaned rows with `to_sessions`, and load_window, the test.py per-player
+means and part2's `transform_player_metrics` read force-plate metrics from it
+instead of pivoting EAV rows.
+
+Usage:
+    from sessions import force_plate_sessions
+    tests = force_plate_sessions(teams=BASKETBALL_TEAMS)
+
+    python sessions.py                  # refresh and summarise
+    python sessions.py --rebuild
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_quality import clean_rows
+from db import get_engine, metrics_where, refresh_plan, table_name
+from dedup import DEFAULT_POLICY, collapse_readings
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SESSIONS_DIR', Path(__file__).resolve().parent / '.sessions'))
+SESSION_METRICS = ['Jump Height(m)', 'Peak Propulsive Force(N)', 'leftMaxForce', 'rightMaxForce']
+KEY = ['playername', 'team', 'timestamp']
+COLUMNS = KEY + ['data_source'] + SESSION_METRICS + ['asymmetry_pct', 'stronger_side']
+TYPES = {'playername': 'string', 'team': 'string', 'timestamp': 'datetime64[ns]', 'data_source': 'string',
+         **{m: 'float64' for m in SESSION_METRICS}, 'asymmetry_pct': 'float64', 'stronger_side': 'string'}
+ORDER = ['playername', 'timestamp', 'data_source']
+
+
+def to_sessions(rows: pd.DataFrame, dedup_policy: str | dict = DEFAULT_POLICY) -> pd.DataFrame:
+    """Long force-plate rows (any data_source) -> one typed row per (playername, team, timestamp)."""
+    if 'data_source' not in rows.columns:
+        rows = rows.assign(data_source=None)
+    df = collapse_readings(clean_rows(rows[rows['metric'].isin(SESSION_METRICS)]), dedup_policy)
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNS).astype(TYPES)
+    wide = df.set_index(KEY + ['metric'])['value'].unstack('metric').reindex(columns=SESSION_METRICS)
+    wide.columns.name = None
+    wide.insert(0, 'data_source', df.groupby(KEY, dropna=False)['data_source'].last().reindex(wide.index).to_numpy())
+    wide = wide.reset_index()
+    left, right = wide['leftMaxForce'], wide['rightMaxForce']
+    strong = np.fmax(left, right).where(left.notna() & right.notna())
+    wide['asymmetry_pct'] = (strong - np.fmin(left, right)) / strong * 100
+    wide['stronger_side'] = np.where(left > right, 'Left', np.where(right > left, 'Right', 'Equal'))
+    wide['stronger_side'] = wide['stronger_side'].where(strong.notna())
+    return wide.astype(TYPES)[COLUMNS].sort_values(ORDER, kind='stable').reset_index(drop=True)
+
+
+@profiled('sessions.refresh')
+def refresh(directory: Path = STORE_DIR, rebuild: bool = False, engine=None) -> pd.DataFrame:
+    """The session table after reading new rows (appended, or rebuilt when history changed)."""
+    engine = engine or get_engine()
+    table = table_name()
+    path, meta_path = directory / 'sessions.feather', directory / 'meta.json'
+    meta = json.loads(meta_path.read_text()) if meta_path.exists() and path.exists() and not rebuild else None
+    mark, where, incremental = refresh_plan(engine, table, metrics_where(SESSION_METRICS), meta, 'Sessions')
+    if where is None:
+        return pd.read_feather(path).astype(TYPES)
+
+    rows = pd.read_sql(f"SELECT playername, team, metric, value, timestamp, data_source FROM {table} {where}", engine)
+    out = to_sessions(rows)
+    if incremental and meta is not None:
+        out = pd.concat([pd.read_feather(path).astype(TYPES), out], ignore_index=True)
+        out = out.sort_values(ORDER, kind='stable').reset_index(drop=True)
+        print(f"Sessions: +{len(rows)} rows")
+    directory.mkdir(parents=True, exist_ok=True)
+    out.to_feather(path)
+    meta_path.write_text(json.dumps(mark))
+    return out
+
+
+def force_plate_sessions(teams: list[str] | None = None, metrics: list[str] | None = None,
+                         directory: Path = STORE_DIR, engine=None) -> pd.DataFrame:
+    """Up-to-date sessions, optionally only `teams` and rows where any of `metrics` is present."""
+    df = refresh(directory, engine=engine)
+    if teams is not None:
+        df = df[df['team'].isin(teams)]
+    if metrics is not None:
+        df = df[df[metrics].notna().any(axis=1)]
+    return df.reset_index(drop=True)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Materialised per-test force-plate session table.')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the session table')
+    args = parser.parse_args(argv)
+
+    df = refresh(rebuild=args.rebuild)
+    print("="*80)
+    print(f"FORCE-PLATE SESSIONS: {len(df):,} tests, {df['playername'].nunique()} athletes")
+    print("="*80)
+    print(df.groupby('data_source', dropna=False)[SESSION_METRICS].count().to_string())
+    paired = df[['leftMaxForce', 'rightMaxForce']].notna().all(axis=1)
+    print(f"\nPaired left/right tests: {int(paired.sum()):,}; "
+          f"asymmetry > 10%: {int((df['asymmetry_pct'] > 10).sum()):,}")
+    print(df.tail(5).to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    main()
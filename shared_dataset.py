@@ -0,0 +1,318 @@
+"""shared_dataset.py
+
+Share one copy of the measurement table with every analysis worker.
+
+The long table (playername, team, metric, value, timestamp) is encoded once
+into flat arrays: int32 player/team codes, int16 metric codes, float64 values
+and datetime64 timestamps, sorted by (team, metric, player, timestamp), plus
+`team_offsets` so team t owns rows team_offsets[t]:team_offsets[t + 1]. The
+string tables (players, teams, metrics) are kept in a small JSON sidecar.
+
+Two backends hold the arrays:
+
+    mmap   .npy files in a directory (default `.shared_dataset/`), opened
+           with `np.load(mmap_mode='r')`; the OS page cache is shared by all
+           processes and the files are reused while the table is unchanged
+    shm    `multiprocessing.shared_memory` blocks owned by the parent
+
+`publish()` returns a small picklable handle. Workers `attach(handle)` and
+get read-only views of the same pages, so a worker costs no extra RAM for the
+dataset. A worker only materialises the DataFrame slice of its partition
+(`SharedDataset.frame(teams)`).
+
+`map_partitions()` fans a task out over teams, sports or genders with a
+ProcessPoolExecutor. Built-in tasks: per-team z-scores (as
+part2.team_zscores), the question flow of test.py per sport, and the part4
+accel-load flag per gender (basketball teams only, as part4_flags.py; the
+percentile is over the partition, so this task only runs `--by gender`).
+
+Usage:
+    python shared_dataset.py --task zscores --by team --jobs 16
+    python shared_dataset.py --task flow --by sport --backend shm
+    python shared_dataset.py --task flags --by gender
+"""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import BASKETBALL_TEAMS, infer_gender, infer_sport
+from db import METRICS, get_engine, metrics_where, table_mark, table_name
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SHARED_DATASET_DIR', Path(__file__).resolve().parent / '.shared_dataset'))
+ARRAYS = ['player', 'team', 'metric', 'value', 'timestamp', 'team_offsets']
+BACKENDS = ['mmap', 'shm']
+PARTITIONS = ['team', 'sport', 'gender']
+
+
+class SharedDataset:
+    """Read-only encoded measurement arrays (views onto a memory map or shared memory)."""
+
+    def __init__(self, arrays: dict[str, np.ndarray], labels: dict[str, list[str]], blocks=None):
+        self.arrays = arrays
+        self.players = labels['players']
+        self.teams = labels['teams']
+        self.metrics = labels['metrics']
+        self._blocks = blocks or []       # SharedMemory objects kept alive with the views
+
+    @staticmethod
+    def encode(df: pd.DataFrame) -> tuple[dict[str, np.ndarray], dict[str, list[str]]]:
+        """Long rows -> (arrays, labels), sorted by team, metric, player, timestamp."""
+        player, players = pd.factorize(df['playername'], sort=True)
+        team, teams = pd.factorize(df['team'], sort=True)
+        metric, metrics = pd.factorize(df['metric'], sort=True)
+        ts = pd.to_datetime(df['timestamp'], errors='coerce').to_numpy('datetime64[ns]')
+        order = np.lexsort((ts, player, metric, team))
+        team = team[order].astype(np.int32)
+        arrays = {
+            'player': player[order].astype(np.int32),
+            'team': team,
+            'metric': metric[order].astype(np.int16),
+            'value': df['value'].to_numpy(float)[order],
+            'timestamp': ts[order],
+            'team_offsets': np.searchsorted(team, np.arange(len(teams) + 1)).astype(np.int64),
+        }
+        labels = {'players': list(players), 'teams': list(teams), 'metrics': list(metrics)}
+        return arrays, labels
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def __len__(self) -> int:
+        return len(self.arrays['value'])
+
+    def rows(self, teams: list[str] | None = None) -> np.ndarray:
+        """Row positions of the given teams (all rows when None)."""
+        if teams is None:
+            return np.arange(len(self))
+        off = self.arrays['team_offsets']
+        codes = [self.teams.index(t) for t in teams if t in self.teams]
+        return np.concatenate([np.arange(off[c], off[c + 1]) for c in codes]) if codes else np.array([], np.int64)
+
+    def frame(self, teams: list[str] | None = None) -> pd.DataFrame:
+        """The long DataFrame (playername, team, metric, value, timestamp) for `teams`."""
+        r = self.rows(teams) if teams is not None else slice(None)
+        a = self.arrays
+        return pd.DataFrame({
+            'playername': pd.Categorical.from_codes(a['player'][r], self.players).astype(object),
+            'team': pd.Categorical.from_codes(a['team'][r], self.teams).astype(object),
+            'metric': pd.Categorical.from_codes(a['metric'][r], self.metrics).astype(object),
+            'value': a['value'][r],
+            'timestamp': a['timestamp'][r],
+        })
+
+    def partitions(self, by: str) -> dict[str, list[str]]:
+        """Team lists per partition label (one per team, or grouped by cohorts.py sport/gender)."""
+        if by == 'team':
+            return {t: [t] for t in self.teams}
+        infer = {'sport': infer_sport, 'gender': infer_gender}[by]
+        groups: dict[str, list[str]] = {}
+        for t in self.teams:
+            groups.setdefault(infer(t), []).append(t)
+        return groups
+
+    def close(self) -> None:
+        self.arrays = {}
+        for block in self._blocks:
+            block.close()
+
+
+# ---------------------------------------------------------------- publishing
+
+def _write_mmap(arrays: dict, labels: dict, directory: Path, mark: dict | None) -> dict:
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, arr in arrays.items():
+        out = np.lib.format.open_memmap(directory / f'{name}.npy', mode='w+', dtype=arr.dtype, shape=arr.shape)
+        out[:] = arr
+        out.flush()
+        del out
+    (directory / 'meta.json').write_text(json.dumps({'mark': mark, 'labels': labels}))
+    return {'backend': 'mmap', 'path': str(directory)}
+
+
+def _write_shm(arrays: dict, labels: dict) -> tuple[dict, list]:
+    blocks, spec = [], {}
+    for name, arr in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[:] = arr
+        blocks.append(block)
+        spec[name] = (block.name, arr.dtype.str, arr.shape)
+    return {'backend': 'shm', 'arrays': spec, 'labels': labels}, blocks
+
+
+@profiled('shared_dataset.publish')
+def publish(df: pd.DataFrame | None = None, backend: str = 'mmap', directory: Path = STORE_DIR,
+            engine=None) -> tuple[dict, SharedDataset]:
+    """Encode the table once and share it; returns (handle for workers, the parent's view).
+
+    With the mmap backend and no `df`, the files in `directory` are reused while
+    the table's watermark is unchanged. For shm the parent must keep the
+    returned dataset alive and call `unlink(handle)` when the workers are done.
+    """
+    mark = None
+    if df is None:
+        from test import fetch_metrics_table
+
+        engine = engine or get_engine()
+        mark = table_mark(engine, table_name(), metrics_where())
+        meta_path = directory / 'meta.json'
+        if backend == 'mmap' and meta_path.exists() and json.loads(meta_path.read_text())['mark'] == mark:
+            handle = {'backend': 'mmap', 'path': str(directory)}
+            return handle, attach(handle)
+        df = fetch_metrics_table(table_name(), METRICS)
+    arrays, labels = SharedDataset.encode(df)
+    if backend == 'mmap':
+        handle = _write_mmap(arrays, labels, directory, mark)
+        return handle, attach(handle)
+    if backend != 'shm':
+        raise ValueError(f"Unknown backend {backend!r} (use one of {BACKENDS})")
+    handle, blocks = _write_shm(arrays, labels)
+    views = {name: np.ndarray(a.shape, a.dtype, buffer=b.buf) for (name, a), b in zip(arrays.items(), blocks)}
+    return handle, SharedDataset(views, labels, blocks)
+
+
+def attach(handle: dict) -> SharedDataset:
+    """Zero-copy, read-only view of a published dataset."""
+    if handle['backend'] == 'mmap':
+        directory = Path(handle['path'])
+        labels = json.loads((directory / 'meta.json').read_text())['labels']
+        return SharedDataset({name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in ARRAYS}, labels)
+    arrays, blocks = {}, []
+    for name, (block_name, dtype, shape) in handle['arrays'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        view = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        arrays[name] = view
+        blocks.append(block)
+    return SharedDataset(arrays, handle['labels'], blocks)
+
+
+def unlink(handle: dict) -> None:
+    """Free the shared-memory blocks of a shm handle (no-op for mmap)."""
+    if handle['backend'] == 'shm':
+        for block_name, _, _ in handle['arrays'].values():
+            with contextlib.suppress(FileNotFoundError):
+                block = shared_memory.SharedMemory(name=block_name)
+                block.close()
+                block.unlink()
+
+
+# --------------------------------------------------------------------- tasks
+
+def zscores_task(ds: SharedDataset, teams: list[str]) -> pd.DataFrame:
+    """z-score of every reading within its (team, metric) group (ddof=0, as part2.team_zscores)."""
+    df = ds.frame(teams)
+    grouped = df.groupby(['team', 'metric'])['value']
+    df['z_score'] = (df['value'] - grouped.transform('mean')) / grouped.transform('std', ddof=0)
+    return df
+
+
+def flow_task(ds: SharedDataset, teams: list[str]) -> str:
+    """Printed output of test.run_question_flow for these teams."""
+    from test import run_question_flow
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        run_question_flow(ds.frame(teams))
+    return out.getvalue()
+
+
+def flags_task(ds: SharedDataset, teams: list[str]) -> pd.DataFrame:
+    """Latest accel_load_accum per basketball athlete flagged by the part4 `accel_load` rule."""
+    from rule_engine import evaluate, rule_set
+
+    df = ds.frame([t for t in teams if t in BASKETBALL_TEAMS])
+    df = df[df['metric'] == 'accel_load_accum'].assign(gender=lambda d: d['team'].map(infer_gender))
+    flags = evaluate(rule_set('part4'), df, only=['accel_load'], with_thresholds=True)
+    df = df.assign(percentile_90=flags['accel_load_threshold'], flagged=flags['accel_load'])
+    latest = df.sort_values('timestamp', kind='stable').groupby('playername').tail(1)
+    return latest[latest['flagged']]
+
+
+TASKS = {'zscores': zscores_task, 'flow': flow_task, 'flags': flags_task}
+# tasks whose result is only meaningful for some partitionings
+TASK_PARTITIONS = {'flags': ['gender']}
+
+
+def _run_partition(args):
+    handle, task, label, teams = args
+    ds = attach(handle)
+    try:
+        result = TASKS[task](ds, teams)
+    finally:
+        ds.close()
+    return label, result, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@profiled('shared_dataset.map_partitions')
+def map_partitions(handle: dict, task: str, by: str = 'team', jobs: int | None = None,
+                   labels: list[str] | None = None) -> tuple[dict, dict]:
+    """Run `task` once per partition in worker processes; returns ({label: result}, {label: worker peak RSS KiB})."""
+    if by not in TASK_PARTITIONS.get(task, PARTITIONS):
+        raise ValueError(f"Task {task!r} runs by {', '.join(TASK_PARTITIONS[task])}, not {by!r}")
+    ds = attach(handle)
+    parts = ds.partitions(by)
+    ds.close()
+    if labels:
+        parts = {k: v for k, v in parts.items() if k in labels}
+    results, rss = {}, {}
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        for label, result, peak in pool.map(_run_partition, [(handle, task, k, v) for k, v in parts.items()]):
+            results[label] = result
+            rss[label] = peak
+    return results, rss
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run analysis tasks in worker processes over one shared copy of the data.')
+    parser.add_argument('--task', choices=list(TASKS), default='zscores')
+    parser.add_argument('--by', choices=PARTITIONS, default='team', help='partition the work by team, sport or gender')
+    parser.add_argument('--only', action='append', help='only these partition labels')
+    parser.add_argument('--backend', choices=BACKENDS, default='mmap')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+    if args.by not in TASK_PARTITIONS.get(args.task, PARTITIONS):
+        parser.error(f"--task {args.task} runs --by {' / '.join(TASK_PARTITIONS[args.task])}")
+
+    handle, ds = publish(backend=args.backend)
+    shared_mb = ds.nbytes / 1e6
+    try:
+        print("="*80)
+        print(f"SHARED DATASET ({args.backend}): {len(ds):,} rows, {shared_mb:.1f} MB, "
+              f"{len(ds.teams)} teams, {len(ds.players)} athletes")
+        print("="*80)
+        results, rss = map_partitions(handle, args.task, args.by, args.jobs, args.only)
+    finally:
+        ds.close()
+        unlink(handle)
+
+    for label in sorted(results):
+        result = results[label]
+        if isinstance(result, str):
+            print(f"\n--- {args.by} = {label} ---")
+            print(result.rstrip())
+        else:
+            print(f"{args.by} = {label}: {len(result):,} rows")
+    if args.task == 'flags':
+        flagged = pd.concat(results.values(), ignore_index=True)
+        print(f"\n{len(flagged)} basketball athletes flagged (accel load >90th percentile of gender)")
+    print(f"\nPeak worker RSS: {max(rss.values(), default=0) / 1024:.1f} MB "
+          f"(dataset {shared_mb:.1f} MB shared, not copied)")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""shrinkage.py
+
+Team-adjusted scores with empirical-Bayes partial pooling (athlete -> team -> sport).
+
+part2 compares every reading with its raw team mean and team z-score, which
+are noisy for small teams and for athletes with few tests. Here, for every
+metric at once:
+
+    sigma2      within-athlete (test-to-test) variance, pooled over athletes
+    tau2_athlete  between-athlete variance inside a team (method of moments)
+    tau2_team     between-team variance inside a sport (method of moments)
+
+Each team mean is shrunk toward its sport mean by
+B_t = v_t / (v_t + tau2_team), where v_t is the sampling variance of the team
+mean. Each athlete mean is shrunk toward the shrunk team mean by
+B_i = (sigma2 / n_i) / (sigma2 / n_i + tau2_athlete), so an athlete with two
+tests sits close to the team and one with fifty keeps their own mean. Teams
+in a sport with no other teams are not shrunk. Sports come from
+cohorts.infer_sport, with its 'Other' group split by team name so Baseball is
+not pooled with Soccer.
+
+Scores:
+    athlete_z   (shrunk athlete mean - shrunk team mean) / sqrt(tau2_athlete)
+    shrunk_z    (reading - shrunk team mean) / sqrt(tau2_athlete + sigma2)
+
+Only sufficient statistics (n, sum, sum of squares per metric, team and
+athlete) are stored in `.shrinkage/`. They are updated from newly appended
+rows with the table watermark, like the trend cube. The fit is recomputed
+from them with grouped vectorised operations, which takes milliseconds.
+
+Usage:
+    from shrinkage import ShrinkageModel, adjusted_zscores
+    df = adjusted_zscores(df, ShrinkageModel.from_frame(df).fit())
+
+    python shrinkage.py                     # variance components + most-shrunk teams
+    python shrinkage.py --metric "Jump Height(m)" --team Baseball
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cohorts import infer_sport
+from data_quality import clean_rows
+from db import METRICS, get_engine, metrics_where, refresh_plan, table_name
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SHRINKAGE_DIR', Path(__file__).resolve().parent / '.shrinkage'))
+KEY = ['metric', 'team', 'playername']
+TINY = 1e-12
+
+
+def sport_of(team: str) -> str:
+    """cohorts.infer_sport, with the 'Other' teams split by name ("Womens Soccer" -> "Soccer")."""
+    sport = infer_sport(team)
+    if sport != 'Other':
+        return sport
+    return re.sub(r"^(wo)?men'?s\s+", '', team.strip(), flags=re.IGNORECASE).title()
+
+
+class ShrinkageModel:
+    """Per-athlete sufficient statistics and the hierarchical shrinkage fit over them."""
+
+    def __init__(self, stats: pd.DataFrame | None = None):
+        self.stats = stats if stats is not None else pd.DataFrame(
+            {'n': pd.Series(dtype='int64'), 'sum': pd.Series(dtype=float), 'sumsq': pd.Series(dtype=float)},
+            index=pd.MultiIndex.from_tuples([], names=KEY))
+        self._fit = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'ShrinkageModel':
+        model = cls()
+        model.update(df)
+        return model
+
+    @profiled('shrinkage.update')
+    def update(self, df: pd.DataFrame) -> int:
+        """Fold long rows (playername, team, metric, value) into the statistics; returns athletes touched."""
+        values = df['value'].astype(float)
+        add = (df.assign(n=1, sum=values, sumsq=values * values)
+                 .groupby(KEY)[['n', 'sum', 'sumsq']].sum())
+        self.stats = self.stats.add(add, fill_value=0)
+        self.stats['n'] = self.stats['n'].astype('int64')
+        self._fit = None
+        return len(add)
+
+    @profiled('shrinkage.fit')
+    def fit(self) -> dict[str, pd.DataFrame]:
+        """{'components': per metric, 'teams': per (metric, team), 'athletes': per (metric, team, athlete)}."""
+        if self._fit is not None:
+            return self._fit
+        a = self.stats.reset_index()
+        a['sport'] = a['team'].map(sport_of)
+        a['raw_mean'] = a['sum'] / a['n']
+        a['ss_within'] = (a['sumsq'] - a['sum'] * a['raw_mean']).clip(lower=0)
+
+        # within-athlete variance, pooled per metric over athletes with repeat tests
+        by_metric = a.groupby('metric')
+        dof = by_metric['n'].sum() - by_metric['n'].count()
+        sigma2 = (by_metric['ss_within'].sum() / dof.where(dof > 0)).fillna(0.0)
+        a['se2'] = a['metric'].map(sigma2) / a['n']
+
+        # between-athlete variance inside teams
+        team_key = ['metric', 'team']
+        team_grp = a.groupby(team_key)
+        a['team_raw'] = team_grp['raw_mean'].transform('mean')
+        dev2 = ((a['raw_mean'] - a['team_raw']) ** 2).groupby(a['metric']).sum()
+        k_dof = (team_grp.size() - 1).groupby('metric').sum()
+        tau2_athlete = (dev2 / k_dof.where(k_dof > 0) - by_metric['se2'].mean()).clip(lower=TINY).fillna(TINY)
+
+        teams = team_grp.agg(sport=('sport', 'first'), athletes=('raw_mean', 'size'), tests=('n', 'sum'),
+                             raw_mean=('raw_mean', 'mean'), mean_se2=('se2', 'mean')).reset_index()
+        teams['v'] = (teams['metric'].map(tau2_athlete) + teams['mean_se2']) / teams['athletes']
+
+        # between-team variance inside sports; sport mean is precision weighted
+        w = 1 / teams['v']
+        sport_key = [teams['metric'], teams['sport']]
+        teams['sport_mean'] = (teams['raw_mean'] * w).groupby(sport_key).transform('sum') / w.groupby(sport_key).transform('sum')
+        teams['teams_in_sport'] = teams.groupby(['metric', 'sport'])['team'].transform('size')
+        t_dev2 = ((teams['raw_mean'] - teams['sport_mean']) ** 2).groupby(teams['metric']).sum()
+        t_dof = (teams.groupby(['metric', 'sport']).size() - 1).groupby('metric').sum()
+        tau2_team = (t_dev2 / t_dof.where(t_dof > 0)
+                     - teams.loc[teams['teams_in_sport'] > 1].groupby('metric')['v'].mean()).clip(lower=TINY)
+        tau2_team = tau2_team.reindex(teams['metric'].unique()).fillna(np.inf)
+
+        shrink = teams['v'] / (teams['v'] + teams['metric'].map(tau2_team))
+        teams['shrinkage'] = shrink.where(teams['teams_in_sport'] > 1, 0.0)
+        teams['shrunk_mean'] = teams['sport_mean'] + (1 - teams['shrinkage']) * (teams['raw_mean'] - teams['sport_mean'])
+        teams['shrunk_var'] = (1 - teams['shrinkage']) * teams['v']
+
+        # athletes toward the shrunk team mean
+        a = a.merge(teams[team_key + ['shrunk_mean', 'shrunk_var']].rename(
+            columns={'shrunk_mean': 'team_shrunk_mean', 'shrunk_var': 'team_shrunk_var'}), on=team_key)
+        t2 = a['metric'].map(tau2_athlete)
+        a['shrinkage'] = a['se2'] / (a['se2'] + t2)
+        a['shrunk_mean'] = a['team_shrunk_mean'] + (1 - a['shrinkage']) * (a['raw_mean'] - a['team_shrunk_mean'])
+        a['shrunk_var'] = (1 - a['shrinkage']) * a['se2'] + a['shrinkage'] ** 2 * a['team_shrunk_var']
+        a['athlete_z'] = (a['shrunk_mean'] - a['team_shrunk_mean']) / np.sqrt(t2)
+
+        components = pd.DataFrame({'sigma2': sigma2, 'tau2_athlete': tau2_athlete, 'tau2_team': tau2_team})
+        components.index.name = 'metric'
+        self._fit = {
+            'components': components.reset_index(),
+            'teams': teams[team_key + ['sport', 'athletes', 'tests', 'raw_mean', 'shrunk_mean', 'shrunk_var', 'shrinkage']],
+            'athletes': a[['metric', 'sport', 'team', 'playername', 'n', 'raw_mean', 'shrunk_mean', 'shrunk_var',
+                           'shrinkage', 'team_shrunk_mean', 'athlete_z']],
+        }
+        return self._fit
+
+    # ------------------------------------------------------------------ storage
+
+    def save(self, directory: Path, mark: dict) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self.stats.reset_index().to_feather(directory / 'stats.feather')
+        for name, frame in self.fit().items():
+            frame.to_feather(directory / f'{name}.feather')
+        (directory / 'meta.json').write_text(json.dumps(mark))
+
+    @classmethod
+    def load(cls, directory: Path) -> tuple['ShrinkageModel | None', dict | None]:
+        if not (directory / 'meta.json').exists():
+            return None, None
+        stats = pd.read_feather(directory / 'stats.feather').set_index(KEY)
+        return cls(stats), json.loads((directory / 'meta.json').read_text())
+
+
+def adjusted_zscores(df: pd.DataFrame, fit: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Add `shrunk_team_mean`, `shrunk_z` (per reading) and `athlete_z` (per athlete) to long rows."""
+    comp = fit['components'].set_index('metric')
+    out = df.merge(fit['teams'][['metric', 'team', 'shrunk_mean']].rename(columns={'shrunk_mean': 'shrunk_team_mean'}),
+                   on=['metric', 'team'], how='left')
+    out = out.merge(fit['athletes'][['metric', 'team', 'playername', 'athlete_z']],
+                    on=['metric', 'team', 'playername'], how='left')
+    scale = np.sqrt(out['metric'].map(comp['tau2_athlete'] + comp['sigma2']))
+    out.insert(out.columns.get_loc('shrunk_team_mean') + 1, 'shrunk_z', (out['value'] - out['shrunk_team_mean']) / scale)
+    return out
+
+
+@profiled('shrinkage.refresh')
+def refresh(engine=None, table: str | None = None, directory: Path = STORE_DIR, rebuild: bool = False) -> ShrinkageModel:
+    """The stored model, updated with rows appended since the watermark (or rebuilt)."""
+    engine = engine or get_engine()
+    table = table or table_name()
+    model, meta = (None, None) if rebuild else ShrinkageModel.load(directory)
+    mark, where, incremental = refresh_plan(engine, table, metrics_where(), meta, 'Shrinkage')
+    if where is None:
+        return model
+
+    rows = clean_rows(pd.read_sql(f"SELECT playername, team, metric, value, timestamp FROM {table} {where}", engine))
+    if incremental:
+        touched = model.update(rows)
+        print(f"Shrinkage: {len(rows)} new rows updated {touched} athlete statistics")
+    else:
+        model = ShrinkageModel.from_frame(rows)
+    model.save(directory, mark)
+    return model
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Empirical-Bayes shrunk team and athlete means with adjusted z-scores.')
+    parser.add_argument('--metric', action='append', help='only these metrics')
+    parser.add_argument('--team', action='append', help='list the athletes of these teams')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the statistics from the full table')
+    args = parser.parse_args(argv)
+
+    fit = refresh(rebuild=args.rebuild).fit()
+    metrics = args.metric or METRICS
+    teams = fit['teams'][fit['teams']['metric'].isin(metrics)]
+
+    print("="*80)
+    print("VARIANCE COMPONENTS (within athlete, between athletes, between teams)")
+    print("="*80)
+    print(fit['components'][fit['components']['metric'].isin(metrics)].round(4).to_string(index=False))
+
+    print("\n" + "="*80)
+    print("MOST SHRUNK TEAM MEANS")
+    print("="*80)
+    print(teams.sort_values('shrinkage', ascending=False).head(15).round(3).to_string(index=False))
+
+    if args.team:
+        athletes = fit['athletes']
+        athletes = athletes[athletes['metric'].isin(metrics) & athletes['team'].isin(args.team)]
+        print("\n" + "="*80)
+        print(f"ATHLETES ({', '.join(args.team)})")
+        print("="*80)
+        print(athletes.sort_values(['metric', 'athlete_z'], ascending=[True, False]).round(3).to_string(index=False))
+    return fit
+
+
+if __name__ == '__main__':
+    main()
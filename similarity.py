@@ -0,0 +1,205 @@
+"""similarity.py
+
+Find the athletes most similar to a given athlete across the six-metric
+profile (per-player means, as in `test.per_player_means`).
+
+Profiles are kept as running sums and counts per (player, team) and metric,
+so new readings update the means without re-aggregating the table. Each
+metric is standardised across athletes (z-score of the player means) and a
+missing metric counts as the roster mean (z = 0), so every athlete is a point
+in the same six-dimensional space.
+
+Queries use an exact vectorised search (squared distances from one matrix
+product, `np.argpartition` for the k nearest). `method='kdtree'` answers
+the same queries from a `scipy.spatial.cKDTree`. The normalised matrix and
+the tree are rebuilt lazily after an update.
+
+The profile sums are stored in `.similarity/` with the table watermark and
+refreshed from newly appended rows, like the trend cube.
+
+Usage:
+    python similarity.py PLAYER_663                 # 10 most similar athletes
+    python similarity.py PLAYER_663 -k 5 --method kdtree
+    python similarity.py --all -k 10                # neighbours for the whole roster (timed)
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db import METRICS, get_engine, metrics_where, refresh_plan, table_name
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SIMILARITY_DIR', Path(__file__).resolve().parent / '.similarity'))
+KEY = ['playername', 'team']
+METHODS = ['exact', 'kdtree']
+BATCH = 1024            # query rows per distance block in the exact search
+
+
+class ProfileIndex:
+    """Per-athlete metric means with a nearest-neighbour index over their z-scores."""
+
+    def __init__(self, sums: pd.DataFrame | None = None, counts: pd.DataFrame | None = None,
+                 metrics: list[str] = METRICS):
+        self.metrics = list(metrics)
+        empty = pd.DataFrame(columns=self.metrics, index=pd.MultiIndex.from_tuples([], names=KEY), dtype=float)
+        self.sums = sums if sums is not None else empty
+        self.counts = counts if counts is not None else empty.copy()
+        self._X = None
+        self._tree = None
+
+    @profiled('similarity.update')
+    def update(self, df: pd.DataFrame) -> int:
+        """Fold long rows (playername, team, metric, value) into the running sums; returns athletes touched."""
+        df = df[df['metric'].isin(self.metrics)].dropna(subset=['value'])
+        if df.empty:
+            return 0
+        grouped = df.groupby(KEY + ['metric'])['value'].agg(['sum', 'count']).unstack('metric')
+        add_sums = grouped['sum'].reindex(columns=self.metrics)
+        add_counts = grouped['count'].reindex(columns=self.metrics)
+        self.sums = self.sums.add(add_sums, fill_value=0).fillna(0)
+        self.counts = self.counts.add(add_counts, fill_value=0).fillna(0)
+        self._X = self._tree = None
+        return len(grouped)
+
+    @property
+    def means(self) -> pd.DataFrame:
+        return self.sums / self.counts.where(self.counts > 0)
+
+    def features(self) -> np.ndarray:
+        """Standardised profile matrix (athletes x metrics); missing metrics are 0."""
+        if self._X is None:
+            means = self.means
+            z = (means - means.mean()) / means.std(ddof=0).replace(0, np.nan)
+            self._X = z.fillna(0.0).to_numpy()
+        return self._X
+
+    def _positions(self, player: str) -> np.ndarray:
+        pos = np.flatnonzero(self.sums.index.get_level_values('playername') == player)
+        if not len(pos):
+            raise KeyError(f"Unknown athlete {player!r}")
+        return pos
+
+    def neighbours(self, rows: np.ndarray, k: int = 10, method: str = 'exact') -> tuple[np.ndarray, np.ndarray]:
+        """(indices, distances), each (len(rows), k): nearest athletes to each row, excluding itself."""
+        X = self.features()
+        k = min(k, len(X) - 1)
+        if method == 'kdtree':
+            from scipy.spatial import cKDTree
+
+            if self._tree is None:
+                self._tree = cKDTree(X)
+            dist, idx = self._tree.query(X[rows], k=k + 1)
+            # drop the query point itself (or the farthest neighbour if an exact duplicate took its place)
+            first = np.argsort(idx == rows[:, None], axis=1, kind='stable')[:, :k]
+            return np.take_along_axis(idx, first, axis=1), np.take_along_axis(dist, first, axis=1)
+        if method != 'exact':
+            raise ValueError(f"Unknown method {method!r} (use one of {METHODS})")
+        sq = np.einsum('ij,ij->i', X, X)
+        idx = np.empty((len(rows), k), dtype=np.int64)
+        dist = np.empty((len(rows), k))
+        for start in range(0, len(rows), BATCH):
+            batch = rows[start:start + BATCH]
+            d2 = np.maximum(sq[batch, None] + sq[None, :] - 2 * X[batch] @ X.T, 0)
+            d2[np.arange(len(batch)), batch] = np.inf
+            part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(d2, part, axis=1), axis=1, kind='stable')
+            part = np.take_along_axis(part, order, axis=1)
+            idx[start:start + len(batch)] = part
+            dist[start:start + len(batch)] = np.sqrt(np.take_along_axis(d2, part, axis=1))
+        return idx, dist
+
+    def similar(self, player: str, k: int = 10, method: str = 'exact') -> pd.DataFrame:
+        """The k athletes closest to `player` (every team the name appears in), with their means."""
+        rows = self._positions(player)
+        idx, dist = self.neighbours(rows, k, method)
+        means = self.means
+        out = []
+        for r, (i, d) in enumerate(zip(idx, dist)):
+            block = means.iloc[i].reset_index()
+            block.insert(0, 'query_team', means.index[rows[r]][1])
+            block.insert(1, 'rank', np.arange(1, len(i) + 1))
+            block.insert(4, 'distance', d)
+            out.append(block)
+        return pd.concat(out, ignore_index=True)
+
+    # ------------------------------------------------------------------ storage
+
+    def save(self, directory: Path, mark: dict) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        flat = pd.concat([self.sums.add_prefix('sum|'), self.counts.add_prefix('count|')], axis=1)
+        flat.reset_index().to_feather(directory / 'profiles.feather')
+        (directory / 'meta.json').write_text(json.dumps(mark))
+
+    @classmethod
+    def load(cls, directory: Path) -> tuple['ProfileIndex | None', dict | None]:
+        if not (directory / 'meta.json').exists():
+            return None, None
+        flat = pd.read_feather(directory / 'profiles.feather').set_index(KEY)
+        sums = flat[[c for c in flat.columns if c.startswith('sum|')]].rename(columns=lambda c: c[len('sum|'):])
+        counts = flat[[c for c in flat.columns if c.startswith('count|')]].rename(columns=lambda c: c[len('count|'):])
+        return cls(sums, counts), json.loads((directory / 'meta.json').read_text())
+
+
+@profiled('similarity.refresh')
+def refresh(engine=None, table: str | None = None, directory: Path = STORE_DIR, rebuild: bool = False) -> ProfileIndex:
+    """The stored profiles, updated with rows appended since the watermark (or rebuilt)."""
+    engine = engine or get_engine()
+    table = table or table_name()
+    index, meta = (None, None) if rebuild else ProfileIndex.load(directory)
+    mark, where, incremental = refresh_plan(engine, table, metrics_where(), meta, 'Similarity')
+    if where is None:
+        return index
+
+    rows = pd.read_sql(f"SELECT playername, team, metric, value FROM {table} {where}", engine)
+    if incremental:
+        touched = index.update(rows)
+        print(f"Similarity: {len(rows)} new rows updated {touched} athlete profiles")
+    else:
+        index = ProfileIndex()
+        index.update(rows)
+    index.save(directory, mark)
+    return index
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Nearest-neighbour search over per-athlete metric profiles.')
+    parser.add_argument('player', nargs='?', help='athlete to find similar players for')
+    parser.add_argument('-k', type=int, default=10, help='number of similar athletes')
+    parser.add_argument('--method', choices=METHODS, default='exact')
+    parser.add_argument('--all', action='store_true', help='neighbours for every athlete (timed)')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the profiles from the full table')
+    args = parser.parse_args(argv)
+    if not args.player and not args.all:
+        parser.error('give a player name or --all')
+
+    index = refresh(rebuild=args.rebuild)
+    print("="*80)
+    if args.all:
+        index.neighbours(np.arange(1), args.k, args.method)     # build the matrix / tree outside the timing
+        start = time.perf_counter()
+        idx, dist = index.neighbours(np.arange(len(index.sums)), args.k, args.method)
+        elapsed = time.perf_counter() - start
+        print(f"{args.k} nearest neighbours for {len(idx)} athletes ({args.method}) in {elapsed * 1000:.1f} ms")
+        print("="*80)
+        names = index.sums.index.get_level_values('playername')
+        print(pd.DataFrame({'playername': names, 'nearest': names[idx[:, 0]], 'distance': dist[:, 0]})
+              .head(20).round(3).to_string(index=False))
+        return idx, dist
+
+    result = index.similar(args.player, args.k, args.method)
+    print(f"ATHLETES MOST SIMILAR TO {args.player} ({args.method}, z-scored {len(index.metrics)}-metric profile)")
+    print("="*80)
+    print(result.round(3).to_string(index=False))
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""sketches.py
+
+Approximate distinct counts and frequencies for the Part 1 exploration.
+
+`part1_exploration.py` answers its questions with exact COUNT(DISTINCT ...)
+queries over the whole table. The sketch store keeps small summaries instead,
+updated incrementally per data source / metric / month:
+
+- HyperLogLog registers (2**p per key) for distinct players and teams per
+  (source, month) and distinct timestamps per (source, metric, month).
+  Merging keys is an element-wise max, so any union (all sources, one
+  metric across months, all sources but one) is answered from the registers.
+  Relative standard error is 1.04 / sqrt(2**p).
+- A count-min sketch of rows per player name (for the missing/invalid name
+  count). Estimates never undercount and overcount by at most eps * rows
+  with probability 1 - delta.
+- Exact per-cell row counts and first/last timestamps (these are tiny).
+
+Athletes with two or more sources come from unions: with U the union over
+all sources and U_-s the union without source s, athletes seen in only s
+number |U| - |U_-s|, so multi-source athletes are |U| - sum_s (|U| - |U_-s|).
+
+The store lives in `.sketches/` with the table watermark (max timestamp and
+row count); a refresh ingests only newer rows in chunks and rebuilds if the
+table changed in any other way.
+
+Usage:
+    python sketches.py                 # refresh the store and print the Part 1 answers
+    python sketches.py --rebuild
+    python part1_exploration.py        # sketch-backed; --exact runs the original queries
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db import get_engine, refresh_plan, table_name
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SKETCH_DIR', Path(__file__).resolve().parent / '.sketches'))
+PLAYER_P = 14          # 16384 registers, 0.8% standard error
+TEAM_P = 10
+TIMESTAMP_P = 12
+CMS_EPS = 1e-4
+CMS_DELTA = 0.01
+CHUNK_ROWS = 200_000
+INVALID_NAMES = ['NA', 'N/A', 'na', 'n/a']
+MISSING = '\x00NULL'
+
+
+def hash64(values) -> np.ndarray:
+    """Deterministic 64-bit hash of every value (strings, numbers, datetimes)."""
+    values = np.asarray(values)
+    if values.dtype.kind in 'US':
+        values = values.astype(object)
+    return pd.util.hash_array(values)
+
+
+def hll_estimate(registers: np.ndarray) -> np.ndarray:
+    """HyperLogLog cardinality of each row of registers (small-range corrected)."""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(float)), axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class HLLBank:
+    """HyperLogLog registers for many keys: one row of 2**p uint8 registers per key."""
+
+    def __init__(self, p: int, keys: list[tuple] | None = None, registers: np.ndarray | None = None):
+        self.p = p
+        self.keys = [tuple(k) for k in keys or []]
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        self.registers = registers if registers is not None else np.zeros((0, 1 << p), np.uint8)
+
+    @property
+    def rel_error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.p)
+
+    def _rows(self, keys: pd.DataFrame) -> np.ndarray:
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(keys))
+        rows = np.empty(len(uniques), dtype=np.int64)
+        for i, key in enumerate(uniques):
+            if key not in self.index:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+            rows[i] = self.index[key]
+        if len(self.keys) > len(self.registers):
+            grow = np.zeros((len(self.keys) - len(self.registers), 1 << self.p), np.uint8)
+            self.registers = np.vstack([self.registers, grow])
+        return rows[codes]
+
+    def add(self, keys: pd.DataFrame, items: pd.Series) -> None:
+        """Add `items` (NULLs skipped) to the sketch of the key in the same row of `keys`."""
+        keep = items.notna().to_numpy()
+        if not keep.any():
+            return
+        rows = self._rows(keys[keep])
+        h = hash64(items[keep])
+        bucket = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = (h & np.uint64((1 << (64 - self.p)) - 1)).astype(float)
+        bit_length = np.where(rest > 0, np.frexp(rest)[1], 0)
+        rho = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, (rows, bucket), rho)
+
+    def distinct(self, where=lambda key: True) -> float:
+        """Estimated distinct items across every key for which `where(key)` is true."""
+        rows = [i for i, k in enumerate(self.keys) if where(k)]
+        if not rows:
+            return 0.0
+        return float(hll_estimate(self.registers[rows].max(axis=0))[0])
+
+
+class CountMin:
+    """Count-min sketch: frequency estimates within eps * total with probability 1 - delta."""
+
+    def __init__(self, eps: float = CMS_EPS, delta: float = CMS_DELTA, table: np.ndarray | None = None):
+        self.eps, self.delta = eps, delta
+        width, depth = math.ceil(math.e / eps), math.ceil(math.log(1 / delta))
+        self.table = table if table is not None else np.zeros((depth, width), np.int64)
+
+    @property
+    def total(self) -> int:
+        return int(self.table[0].sum())
+
+    def _cols(self, h: np.ndarray) -> list[np.ndarray]:
+        h1 = h & np.uint64(0xFFFFFFFF)
+        h2 = (h >> np.uint64(32)) | np.uint64(1)
+        width = np.uint64(self.table.shape[1])
+        return [((h1 + np.uint64(i) * h2) % width).astype(np.int64) for i in range(self.table.shape[0])]
+
+    def add(self, items) -> None:
+        for i, cols in enumerate(self._cols(hash64(items))):
+            self.table[i] += np.bincount(cols, minlength=self.table.shape[1])
+
+    def query(self, items) -> np.ndarray:
+        cols = self._cols(hash64(items))
+        return np.min([self.table[i, c] for i, c in enumerate(cols)], axis=0)
+
+
+class SketchStore:
+    """All Part 1 sketches plus exact per-(source, metric, month) row counts."""
+
+    def __init__(self):
+        self.players = HLLBank(PLAYER_P)
+        self.teams = HLLBank(TEAM_P)
+        self.timestamps = HLLBank(TIMESTAMP_P)
+        self.names = CountMin()
+        self.cells: pd.DataFrame | None = None
+        self.watermark: dict = {'max_ts': None, 'rows': 0}
+
+    @profiled('sketches.update')
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Fold a chunk of raw rows (playername, team, metric, timestamp, data_source) into the sketches."""
+        ts = pd.to_datetime(chunk['timestamp'], errors='coerce')
+        keys = pd.DataFrame({
+            'data_source': chunk['data_source'].fillna(MISSING).astype(str),
+            'metric': chunk['metric'].fillna(MISSING).astype(str),
+            'month': ts.dt.strftime('%Y-%m').fillna(MISSING),
+        })
+        self.players.add(keys[['data_source', 'month']], chunk['playername'])
+        self.teams.add(keys[['data_source', 'month']], chunk['team'])
+        self.timestamps.add(keys, ts)
+        self.names.add(chunk['playername'].fillna(MISSING))
+
+        cells = keys.assign(ts=ts).groupby(['data_source', 'metric', 'month']).agg(
+            rows=('ts', 'size'), first=('ts', 'min'), last=('ts', 'max')).reset_index()
+        merged = cells if self.cells is None else pd.concat([self.cells, cells], ignore_index=True)
+        self.cells = merged.groupby(['data_source', 'metric', 'month'], as_index=False).agg(
+            rows=('rows', 'sum'), first=('first', 'min'), last=('last', 'max'))
+        self.watermark['rows'] += len(chunk)
+        if ts.notna().any():
+            latest = str(ts.max())
+            self.watermark['max_ts'] = max(filter(None, [self.watermark['max_ts'], latest]))
+
+    # ------------------------------------------------------------------ storage
+
+    def save(self, directory: Path = STORE_DIR) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        np.savez(directory / 'registers.npz', players=self.players.registers, teams=self.teams.registers,
+                 timestamps=self.timestamps.registers, names=self.names.table)
+        if self.cells is not None:
+            self.cells.to_feather(directory / 'cells.feather')
+        meta = {'watermark': self.watermark,
+                'keys': {n: getattr(self, n).keys for n in ('players', 'teams', 'timestamps')}}
+        (directory / 'meta.json').write_text(json.dumps(meta))
+
+    @classmethod
+    def load(cls, directory: Path = STORE_DIR) -> 'SketchStore | None':
+        if not (directory / 'meta.json').exists():
+            return None
+        store = cls()
+        meta = json.loads((directory / 'meta.json').read_text())
+        arrays = np.load(directory / 'registers.npz')
+        store.players = HLLBank(PLAYER_P, meta['keys']['players'], arrays['players'])
+        store.teams = HLLBank(TEAM_P, meta['keys']['teams'], arrays['teams'])
+        store.timestamps = HLLBank(TIMESTAMP_P, meta['keys']['timestamps'], arrays['timestamps'])
+        store.names = CountMin(table=arrays['names'])
+        if (directory / 'cells.feather').exists():
+            store.cells = pd.read_feather(directory / 'cells.feather')
+        store.watermark = meta['watermark']
+        return store
+
+    # ------------------------------------------------------------------ answers
+
+    def answers(self) -> dict:
+        """The Part 1 answers (same keys as `part1_exploration.exact_answers`) with ± bounds."""
+        sources = sorted({k[0] for k in self.players.keys})
+        n_all = self.players.distinct()
+        err = {'unique_athletes': 2 * self.players.rel_error * n_all}
+
+        only = {s: n_all - self.players.distinct(lambda k, s=s: k[0] != s) for s in sources}
+        multi = max(n_all - sum(only.values()), 0.0) if len(sources) > 1 else 0.0
+        err['multiple_sources'] = 2 * self.players.rel_error * (n_all + sum(n_all - o for o in only.values()))
+
+        n_teams = self.teams.distinct()
+        err['unique_teams'] = 2 * self.teams.rel_error * n_teams
+
+        invalid = int(self.names.query(INVALID_NAMES + [MISSING]).sum())
+        err['missing_names'] = (len(INVALID_NAMES) + 1) * self.names.eps * self.names.total
+
+        cells = self.cells
+        records = (cells.groupby('data_source')['rows'].sum().sort_values(ascending=False)
+                   .rename('records').reset_index())
+        top = {}
+        for source in cells['data_source'].unique():
+            sub = cells[cells['data_source'] == source]
+            by_metric = sub.groupby('metric').agg(record_count=('rows', 'sum'), earliest_date=('first', 'min'),
+                                                  latest_date=('last', 'max'))
+            by_metric = by_metric.sort_values('record_count', ascending=False).head(10)
+            by_metric['unique_dates'] = [
+                round(self.timestamps.distinct(lambda k, m=m: k[0] == source and k[1] == m)) for m in by_metric.index]
+            top[source] = by_metric.rename_axis('metric_name').reset_index().assign(data_source=source)[
+                ['data_source', 'metric_name', 'record_count', 'earliest_date', 'latest_date', 'unique_dates']]
+        metric_counts = {'total_unique_metrics': cells['metric'].nunique()}
+        for source, label in [('hawkins', 'hawkins'), ('kinexon', 'kinexon'), ('Vald', 'vald')]:
+            metric_counts[f"{label}_unique_metrics"] = cells.loc[cells['data_source'] == source, 'metric'].nunique()
+
+        return {
+            'unique_athletes': round(n_all),
+            'unique_teams': round(n_teams),
+            'data_range': (cells['first'].min(), cells['last'].max()),
+            'most_records': records,
+            'missing_names': invalid,
+            'multiple_sources': round(multi),
+            'top_metrics': top,
+            'unique_metrics': pd.DataFrame([metric_counts]),
+            'errors': err,
+        }
+
+
+@profiled('sketches.refresh')
+def refresh(engine=None, table: str | None = None, directory: Path = STORE_DIR, rebuild: bool = False) -> SketchStore:
+    """Load the stored sketches and fold in rows added since the watermark (or rebuild)."""
+    engine = engine or get_engine()
+    table = table or table_name()
+    store = None if rebuild else SketchStore.load(directory)
+    mark, where, incremental = refresh_plan(engine, table, '', store and store.watermark, 'Sketches')
+    if where is None:
+        return store
+
+    if incremental:
+        print(f"Sketches: adding {mark['rows'] - store.watermark['rows']} rows after {store.watermark['max_ts']}")
+    else:
+        store = SketchStore()
+    for chunk in pd.read_sql(f"SELECT playername, team, metric, timestamp, data_source FROM {table} {where}", engine,
+                             chunksize=CHUNK_ROWS):
+        store.update(chunk)
+    store.watermark = mark
+    store.save(directory)
+    return store
+
+
+def main(argv: list[str] | None = None):
+    from part1_exploration import print_answers
+
+    parser = argparse.ArgumentParser(description='Refresh the Part 1 sketches and print the approximate answers.')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the sketches from the full table')
+    args = parser.parse_args(argv)
+
+    store = refresh(rebuild=args.rebuild)
+    start = time.perf_counter()
+    answers = store.answers()
+    print(f"Answered from sketches in {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({store.watermark['rows']} rows summarised, {len(store.cells)} source/metric/month cells)")
+    print_answers(answers)
+    return answers
+
+
+if __name__ == '__main__':
+    main()
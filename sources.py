@@ -0,0 +1,198 @@
+"""sources.py
+
+Source-aware ingestion: one typed, wide table per data source.
+
+Hawkins, Kinexon and VALD rows share the EAV measurement table and their
+`data_source` spellings differ ('Vald', 'hawkins', 'kinexon'). Each source
+is fetched on its own and the slices are read concurrently from a thread
+pool, one connection per source. Every slice is cleaned (data_quality),
+repeated readings are collapsed (dedup) and the result is pivoted once into
+its own table, one row per session (playername, team, timestamp):
+
+    vald      leftMaxForce, rightMaxForce paired per test, + asymmetry_pct, stronger_side
+    hawkins   Jump Height(m), Peak Propulsive Force(N), mRSI per trial
+    kinexon   accel_load_accum, distance_total, speed_max per session
+
+Column types are fixed by SCHEMAS, and a metric that is absent is still
+present as an all-NaN column. Spellings are matched case-insensitively
+against the distinct `data_source` values, so 'VALD' and 'vald' land in
+the same table.
+
+Tables are stored as `.sources/<source>.feather`, each with its own
+watermark. A run appends only sessions newer than the source's last
+timestamp, or rebuilds that source when older rows changed. Downstream code
+reads them with `load_tables()` / `ingest()` instead of re-pivoting EAV rows
+(see load_window.py).
+
+Usage:
+    from sources import ingest
+    tables = ingest()                    # {'vald': ..., 'hawkins': ..., 'kinexon': ...}
+
+    python sources.py                    # refresh all sources, print a summary
+    python sources.py vald --rebuild
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_quality import clean_rows
+from db import get_engine, refresh_plan, table_name
+from dedup import collapse_readings
+from profiling import profiled
+
+
+STORE_DIR = Path(os.getenv('SOURCES_DIR', Path(__file__).resolve().parent / '.sources'))
+KEY = ['playername', 'team', 'timestamp']
+
+# canonical source -> metric columns of its wide table
+SOURCES = {
+    'vald': ['leftMaxForce', 'rightMaxForce'],
+    'hawkins': ['Jump Height(m)', 'Peak Propulsive Force(N)', 'mRSI'],
+    'kinexon': ['accel_load_accum', 'distance_total', 'speed_max'],
+}
+SCHEMAS = {
+    name: {'playername': 'string', 'team': 'string', 'timestamp': 'datetime64[ns]', 'readings': 'int64',
+           **{m: 'float64' for m in metrics},
+           **({'asymmetry_pct': 'float64', 'stronger_side': 'string'} if name == 'vald' else {})}
+    for name, metrics in SOURCES.items()
+}
+
+
+def spellings(engine, table: str) -> dict[str, list[str]]:
+    """Canonical source -> the `data_source` spellings present in the table."""
+    found = pd.read_sql(f"SELECT DISTINCT data_source FROM {table}", engine)['data_source'].dropna()
+    out: dict[str, list[str]] = {name: [] for name in SOURCES}
+    for raw in found:
+        name = str(raw).strip().lower()
+        if name in out:
+            out[name].append(raw)
+    return out
+
+
+def _where(name: str, names: list[str]) -> str:
+    quoted = "','".join(s.replace("'", "''") for s in names)
+    metrics = "','".join(SOURCES[name])
+    return f"WHERE data_source IN ('{quoted}') AND metric IN ('{metrics}') AND value IS NOT NULL"
+
+
+def _fetch(args) -> tuple[str, dict, pd.DataFrame | None, bool]:
+    """Thread task: (source, watermark, rows still needed, only appended rows?) for one source."""
+    name, names, engine, table, since = args
+    mark, where, incremental = refresh_plan(engine, table, _where(name, names), since, f"Sources: {name}")
+    if where is None:
+        return name, mark, None, True
+    rows = pd.read_sql(f"SELECT playername, team, metric, value, timestamp FROM {table} {where}", engine)
+    return name, mark, rows, incremental
+
+
+def to_wide(name: str, long: pd.DataFrame) -> pd.DataFrame:
+    """Long rows of one source -> its typed session table (SCHEMAS[name] columns)."""
+    metrics = SOURCES[name]
+    df = collapse_readings(clean_rows(long[long['metric'].isin(metrics)]))
+    wide = df.set_index(KEY + ['metric'])['value'].unstack('metric').reindex(columns=metrics)
+    wide.columns.name = None
+    wide.insert(0, 'readings', df.groupby(KEY, dropna=False)['readings'].sum().reindex(wide.index).to_numpy())
+    wide = wide.reset_index()
+    if name == 'vald':
+        left, right = wide['leftMaxForce'], wide['rightMaxForce']
+        strong = np.fmax(left, right).where(left.notna() & right.notna())
+        wide['asymmetry_pct'] = (left - right).abs() / strong * 100
+        wide['stronger_side'] = np.where(left > right, 'Left', np.where(right > left, 'Right', 'Equal'))
+        wide['stronger_side'] = wide['stronger_side'].where(strong.notna())
+    return wide.astype(SCHEMAS[name])[list(SCHEMAS[name])].sort_values(KEY, kind='stable').reset_index(drop=True)
+
+
+def _paths(directory: Path, name: str) -> tuple[Path, Path]:
+    return directory / f'{name}.feather', directory / f'{name}.json'
+
+
+def load_tables(names: list[str] | None = None, directory: Path = STORE_DIR) -> dict[str, pd.DataFrame]:
+    """The stored tables as they are (no database access)."""
+    out = {}
+    for name in names or list(SOURCES):
+        path, _ = _paths(directory, name)
+        if path.exists():
+            out[name] = pd.read_feather(path).astype(SCHEMAS[name])
+    return out
+
+
+@profiled('sources.ingest')
+def ingest(names: list[str] | None = None, engine=None, table: str | None = None,
+           directory: Path = STORE_DIR, rebuild: bool = False, jobs: int | None = None) -> dict[str, pd.DataFrame]:
+    """Fetch every source concurrently and return its up-to-date wide table."""
+    names = names or list(SOURCES)
+    unknown = sorted(set(names) - set(SOURCES))
+    if unknown:
+        raise ValueError(f"Unknown source(s) {unknown} (use {list(SOURCES)})")
+    engine = engine or get_engine()
+    table = table or table_name()
+    directory.mkdir(parents=True, exist_ok=True)
+    spelled = spellings(engine, table)
+
+    previous = {}
+    for name in names:
+        path, meta_path = _paths(directory, name)
+        if not rebuild and path.exists() and meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta.get('spellings') == spelled[name]:
+                previous[name] = {'max_ts': meta['max_ts'], 'rows': meta['rows']}
+
+    tasks = [(name, spelled[name], engine, table, previous.get(name)) for name in names]
+    with ThreadPoolExecutor(max_workers=jobs or len(tasks)) as pool:
+        fetched = list(pool.map(_fetch, tasks))
+
+    tables = {}
+    for name, mark, rows, incremental in fetched:
+        path, meta_path = _paths(directory, name)
+        if rows is None:
+            tables[name] = pd.read_feather(path).astype(SCHEMAS[name])
+            continue
+        if incremental:
+            wide = pd.concat([pd.read_feather(path).astype(SCHEMAS[name]), to_wide(name, rows)], ignore_index=True)
+            wide = wide.sort_values(KEY, kind='stable').reset_index(drop=True)
+            print(f"Sources: {name} +{len(rows)} rows")
+        else:
+            wide = to_wide(name, rows)
+        wide.to_feather(path)
+        meta_path.write_text(json.dumps({**mark, 'spellings': spelled[name], 'sessions': len(wide),
+                                         'updated': time.strftime('%Y-%m-%d %H:%M:%S')}))
+        tables[name] = wide
+    return tables
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Fetch each data source concurrently into its own typed wide table.')
+    parser.add_argument('source', nargs='*', help=f"sources to refresh: {', '.join(SOURCES)} (default: all)")
+    parser.add_argument('--rebuild', action='store_true', help='refetch the sources from scratch')
+    parser.add_argument('--jobs', type=int, help='fetch threads (default: one per source)')
+    args = parser.parse_args(argv)
+    unknown = sorted(set(args.source) - set(SOURCES))
+    if unknown:
+        parser.error(f"unknown source(s): {', '.join(unknown)}")
+
+    start = time.perf_counter()
+    tables = ingest(args.source or None, rebuild=args.rebuild, jobs=args.jobs)
+    elapsed = time.perf_counter() - start
+
+    print("="*80)
+    print(f"SOURCE TABLES ({elapsed:.2f}s)")
+    print("="*80)
+    for name, wide in tables.items():
+        metrics = SOURCES[name]
+        complete = wide[metrics].notna().all(axis=1).mean() * 100 if len(wide) else 0.0
+        print(f"\n--- {name}: {len(wide):,} sessions, {wide['playername'].nunique()} athletes, "
+              f"{complete:.1f}% with every metric ---")
+        print(wide.head(5).to_string(index=False))
+    return tables
+
+
+if __name__ == '__main__':
+    main()
@@ -16,37 +16,24 @@ support each question.
 """
 from __future__ import annotations
 
-import os
-from pathlib import Path
-import pandas as pd
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
-
+import argparse
 
-ENV_PATH = Path(__file__).resolve().parent / ".env"
-load_dotenv(ENV_PATH)
-
-DB_HOST = os.getenv("DB_HOST")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_NAME = os.getenv("DB_NAME")
-DB_TABLE = os.getenv("DB_TABLE", "research_experiment_refactor_test")
+import pandas as pd
 
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
-    raise SystemExit("Missing DB credentials in .env — please set DB_HOST, DB_USER, DB_PASSWORD, DB_NAME")
+from cohorts import infer_gender, infer_sport
+from correlations import correlation_table
+from db import METRICS, get_engine, table_name
+from manifest import Run
+from profiling import profiled
+from query_cache import cached_read_sql
+from ranking import top_k_series
+from resampling import MIN_ATHLETES, compare_groups
+from rule_engine import evaluate, load_rules, passes, rule_set
+from sessions import SESSION_METRICS, force_plate_sessions
+from trend_cube import aggregate, refresh as refresh_cube, slice_cube
 
-URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-ENGINE = create_engine(URL)
 
-# Metric names expected in the DB 'metric' column
-METRICS = [
-    'Jump Height(m)',
-    'Peak Propulsive Force(N)',
-    'distance_total',
-    'accel_load_accum',
-    'leftMaxForce',
-    'rightMaxForce',
-]
+QUESTION_FLOW_RESAMPLES = 1000  # bootstrap / permutation resamples behind the Q1 CIs
 
 
 def fetch_metrics_table(table: str, metrics: list[str]) -> pd.DataFrame:
@@ -61,7 +48,7 @@ FROM {table}
 WHERE metric IN ('{metrics_str}')
   AND value IS NOT NULL
 """
-    df = pd.read_sql(sql, ENGINE)
+    df = cached_read_sql(sql, get_engine())
     # Ensure timestamp is datetime where present
     if 'timestamp' in df.columns:
         df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
@@ -83,20 +70,24 @@ def research_correlations(player_means: pd.DataFrame):
     We compute Pearson correlations between:
     - Jump Height vs Peak Propulsive Force
     - distance_total vs accel_load_accum
+    (the full matrix for every cohort is in correlations.py)
     """
     print('\n== Correlations (per-player means) ==')
     pairs = [
         ('Jump Height(m)', 'Peak Propulsive Force(N)'),
         ('distance_total', 'accel_load_accum'),
     ]
+    metrics = [m for m in dict.fromkeys(m for pair in pairs for m in pair) if m in player_means.columns]
+    pm = player_means.reset_index()
+    table = correlation_table(pm, metrics=metrics, cohorts=['All'], n_boot=0) if len(metrics) > 1 else pd.DataFrame()
     for a, b in pairs:
         if a in player_means.columns and b in player_means.columns:
-            tmp = player_means[[a, b]].dropna()
-            if len(tmp) >= 3:
-                corr = tmp[a].corr(tmp[b])
-                print(f"Correlation {a} vs {b}: {corr:.3f} (N={len(tmp)})")
+            row = table[((table['metric_a'] == a) & (table['metric_b'] == b)) |
+                        ((table['metric_a'] == b) & (table['metric_b'] == a))].iloc[0]
+            if row['n'] >= 3:
+                print(f"Correlation {a} vs {b}: {row['pearson']:.3f} (N={row['n']})")
             else:
-                print(f"Not enough paired data for correlation {a} vs {b} (N={len(tmp)})")
+                print(f"Not enough paired data for correlation {a} vs {b} (N={row['n']})")
         else:
             print(f"Columns missing for correlation: {a} or {b}")
 
@@ -126,7 +117,7 @@ def research_top_loaders(df: pd.DataFrame, top_n: int = 20) -> pd.DataFrame:
     results = {}
     for metric in ['accel_load_accum', 'distance_total']:
         if metric in pm.columns:
-            top = pm[metric].dropna().sort_values(ascending=False).head(top_n)
+            top = top_k_series(pm[metric], top_n)
             results[metric] = top
             print(f"\nTop {top_n} players by {metric}:")
             print(top.to_string())
@@ -135,24 +126,44 @@ def research_top_loaders(df: pd.DataFrame, top_n: int = 20) -> pd.DataFrame:
     return results
 
 
-def per_player_means(df: pd.DataFrame) -> pd.DataFrame:
-    """Return per-player mean values (wide) for the metrics of interest."""
-    pm = df.groupby(['playername', 'team', 'metric'])['value'].mean().unstack()
-    pm = pm.rename_axis(('playername', 'team')).reset_index()
-    return pm.set_index(['playername', 'team'])
-
+@profiled('test.per_player_means')
+def per_player_means(df: pd.DataFrame, sessions: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Return per-player mean values (wide) for the metrics of interest.
 
-def yearly_trends(df: pd.DataFrame):
+    With the force-plate session table (sessions.py), its metrics are averaged
+    over the athlete's cleaned, de-duplicated tests instead of the rows of `df`.
+    """
+    fp = [m for m in SESSION_METRICS if m in set(df['metric'])] if sessions is not None else []
+    keys = df[['playername', 'team']].drop_duplicates()
+    pm = df[~df['metric'].isin(fp)].groupby(['playername', 'team', 'metric'])['value'].mean().unstack()
+    pm = pm.rename_axis(('playername', 'team')).reset_index()
+    pm = pm.set_index(['playername', 'team'])
+    if fp:
+        tests = sessions.astype({'playername': object, 'team': object})
+        means = tests.groupby(['playername', 'team'])[fp].mean()
+        # session teams are stripped (data_quality.clean_rows); match them to the teams of `df`
+        stripped = pd.MultiIndex.from_arrays([keys['playername'], keys['team'].str.strip()])
+        means = pd.DataFrame(means.reindex(stripped).to_numpy(), columns=fp,
+                             index=pd.MultiIndex.from_frame(keys))
+        pm = pm.join(means, how='outer').dropna(how='all')
+        pm = pm[sorted(pm.columns)]
+        pm.columns.name = 'metric'
+    return pm
+
+
+def yearly_trends(df: pd.DataFrame, cube: pd.DataFrame | None = None):
     """Compute yearly averages for each metric (using timestamp).
 
+    Reads from the trend cube (see trend_cube.py) when one is given.
     Useful for research questions about trends over time.
     """
-    if 'timestamp' not in df.columns:
-        print('\nNo timestamp column available to compute trends')
-        return pd.DataFrame()
-    df_ts = df.dropna(subset=['timestamp']).copy()
-    df_ts['year'] = df_ts['timestamp'].dt.year
-    yearly = df_ts.groupby(['year', 'metric'])['value'].mean().unstack()
+    if cube is None:
+        if 'timestamp' not in df.columns:
+            print('\nNo timestamp column available to compute trends')
+            return pd.DataFrame()
+        cube = aggregate(df)
+    yearly = slice_cube(cube, 'year', by=['metric'])
+    yearly = yearly.assign(year=yearly['period'].dt.year).pivot(index='year', columns='metric', values='mean')
     print('\n== Yearly metric means ==')
     print(yearly.round(3).to_string())
     return yearly
@@ -173,7 +184,8 @@ def suggest_research_questions():
     return questions
 
 
-def run_question_flow(df: pd.DataFrame, asym_threshold: float = 10.0):
+@profiled('test.run_question_flow')
+def run_question_flow(df: pd.DataFrame, asym_threshold: float = 10.0, sessions: pd.DataFrame | None = None):
     """Run a 5-question branching flow where each answer directs the next question.
 
     Q1 -> Q2 -> Q3 -> Q4 -> Q5 (branching rules choose relevant sub-questions)
@@ -181,29 +193,9 @@ def run_question_flow(df: pd.DataFrame, asym_threshold: float = 10.0):
     print('\n== Running 5-question branching flow ==')
 
     # Prepare player-level means
-    pm = per_player_means(df).reset_index()
-
-    # Infer gender/sport using same heuristics as gender summary
-    def infer_gender(team: str) -> str:
-        if not isinstance(team, str):
-            return 'Unknown'
-        t = team.lower()
-        if "women" in t or "women's" in t or "womens" in t:
-            return 'Female'
-        if "men" in t or "men's" in t or "mens" in t:
-            return 'Male'
-        return 'Unknown'
-
-    def infer_sport(team: str) -> str:
-        if not isinstance(team, str):
-            return 'Unknown'
-        t = team.lower()
-        if 'basketball' in t:
-            return 'Basketball'
-        if 'football' in t:
-            return 'Football'
-        return 'Other'
+    pm = per_player_means(df, sessions).reset_index()
 
+    # Infer gender/sport from the team name (see cohorts.py)
     pm['gender'] = pm['team'].apply(infer_gender)
     pm['sport'] = pm['team'].apply(infer_sport)
 
@@ -218,17 +210,22 @@ def run_question_flow(df: pd.DataFrame, asym_threshold: float = 10.0):
             print(f"  {sport}: insufficient male/female data (Male={len(sub_m)}, Female={len(sub_f)})")
             difference_found[sport] = False
             continue
-        # metrics to compare
+        # metrics to compare: athlete-level Cohen's d with bootstrap CI and permutation p (resampling.py);
+        # a small in-process run, since the flow also runs inside pipeline and shared_dataset workers
+        comp = compare_groups(df, by='gender', metrics=['Jump Height(m)', 'Peak Propulsive Force(N)'],
+                              cohorts=[f"sport={sport}"], unit='athlete',
+                              n_boot=QUESTION_FLOW_RESAMPLES, n_perm=QUESTION_FLOW_RESAMPLES, jobs=1)
+        if comp.empty:
+            print(f"  {sport}: fewer than {MIN_ATHLETES} male or female athletes with these metrics")
+        comp = comp.set_index('metric')
         for metric in ['Jump Height(m)', 'Peak Propulsive Force(N)']:
-            if metric in sub_m.columns and metric in sub_f.columns:
-                m_mean = sub_m[metric].mean()
-                f_mean = sub_f[metric].mean()
-                # pooled std for effect size
-                pooled_sd = (((sub_m[metric].var(ddof=1) * (len(sub_m)-1)) + (sub_f[metric].var(ddof=1) * (len(sub_f)-1))) / (len(sub_m)+len(sub_f)-2))**0.5 if (len(sub_m)+len(sub_f)-2)>0 else 0
-                effect = abs(m_mean - f_mean) / pooled_sd if pooled_sd > 0 else 0
-                print(f"  {sport} | {metric}: Male_mean={m_mean:.3f}, Female_mean={f_mean:.3f}, effect_size={effect:.3f} (nM={len(sub_m)}, nF={len(sub_f)})")
-                # decision rule: effect_size >= 0.2 and both groups have >=30 -> treat as 'difference'
-                if effect >= 0.2 and len(sub_m) >= 30 and len(sub_f) >= 30:
+            if metric in comp.index:
+                r = comp.loc[metric]
+                print(f"  {sport} | {metric}: Male_mean={r['mean_a']:.3f}, Female_mean={r['mean_b']:.3f}, d={r['cohens_d']:.3f} "
+                      f"(95% CI [{r['d_lo']:.3f}, {r['d_hi']:.3f}], permutation p={r['p_perm']:.4f}; nM={r['athletes_a']}, nF={r['athletes_b']})")
+                # decision rule ('gender_difference' in flag_rules.json): |d| >= 0.2 and both groups have >=30
+                if passes(rule_set('question_flow'), 'gender_difference', effect_size=abs(r['cohens_d']),
+                          n_male=r['athletes_a'], n_female=r['athletes_b']):
                     difference_found[sport] = True
                     break
         else:
@@ -305,8 +302,9 @@ def run_question_flow(df: pd.DataFrame, asym_threshold: float = 10.0):
     if 'accel_load_accum' in pm.columns and 'leftMaxForce' in pm.columns and 'rightMaxForce' in pm.columns:
         accel_thresh = pm['accel_load_accum'].dropna().quantile(0.90)
         tmp = pm.dropna(subset=['leftMaxForce', 'rightMaxForce', 'accel_load_accum']).copy()
-        tmp['asym_pct'] = (tmp['leftMaxForce'] - tmp['rightMaxForce']).abs() / tmp[['leftMaxForce', 'rightMaxForce']].max(axis=1) * 100
-        combined = tmp[(tmp['asym_pct'] >= asym_threshold) & (tmp['accel_load_accum'] >= accel_thresh)]
+        flags = evaluate(rule_set('q4_risk'), tmp, accel_thresh=accel_thresh, asym_threshold=asym_threshold)
+        tmp['asym_pct'] = flags['asym_pct']
+        combined = tmp[flags['combined_risk']]
         print(f"  accel_load_accum 90th pct = {accel_thresh:.2f}; combined-risk N={len(combined)}")
         if not combined.empty:
             print(combined[['playername', 'team', 'asym_pct', 'accel_load_accum']].sort_values(['asym_pct','accel_load_accum'], ascending=False).head(20).to_string(index=False))
@@ -339,26 +337,6 @@ def research_gender_sport_summary(df: pd.DataFrame, asym_threshold: float = 10.0
     pm = per_player_means(df).reset_index()
 
     # derive simple gender and sport tags from team string
-    def infer_gender(team: str) -> str:
-        if not isinstance(team, str):
-            return 'Unknown'
-        t = team.lower()
-        if "women" in t or "women's" in t or "womens" in t:
-            return 'Female'
-        if "men" in t or "men's" in t or "mens" in t:
-            return 'Male'
-        return 'Unknown'
-
-    def infer_sport(team: str) -> str:
-        if not isinstance(team, str):
-            return 'Unknown'
-        t = team.lower()
-        if 'basketball' in t:
-            return 'Basketball'
-        if 'football' in t:
-            return 'Football'
-        return 'Other'
-
     pm['gender'] = pm['team'].apply(infer_gender)
     pm['sport'] = pm['team'].apply(infer_sport)
 
@@ -420,35 +398,44 @@ def research_gender_sport_summary(df: pd.DataFrame, asym_threshold: float = 10.0
     return
 
 
-def main():
-    print('Connecting to DB and fetching requested metrics...')
-    df = fetch_metrics_table(DB_TABLE, METRICS)
-    print(f'Fetched {len(df)} rows; metrics present: {sorted(df.metric.unique())}')
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Run the research queries and the 5-question branching flow.')
+    parser.parse_args(argv)
 
-    # 1) Team means
-    pivot = research_team_means(df)
+    # Queries and intermediate tables are kept as a run manifest (see manifest.py)
+    rules = load_rules()
+    config = {'asym_threshold': 10.0, 'rules': {name: rules[name] for name in ('question_flow', 'q4_risk')}}
+    with Run('test', config=config) as run:
+        print('Connecting to DB and fetching requested metrics...')
+        df = fetch_metrics_table(table_name(), METRICS)
+        print(f'Fetched {len(df)} rows; metrics present: {sorted(df.metric.unique())}')
 
-    # 2) Per-player mean table
-    player_means = per_player_means(df)
+        # 1) Team means
+        pivot = run.record('team_means', research_team_means(df))
 
-    # 3) Correlations
-    research_correlations(player_means)
+        # 2) Per-player mean table (force-plate metrics from the session table, see sessions.py)
+        sessions = force_plate_sessions()
+        player_means = run.cached('player_means', per_player_means, df, sessions)
 
-    # 4) Left/right asymmetry
-    _ = research_left_right_asymmetry(player_means, threshold_pct=10.0)
+        # 3) Correlations
+        research_correlations(player_means)
 
-    # 5) Top loaders and high-distance players
-    _ = research_top_loaders(df, top_n=10)
+        # 4) Left/right asymmetry
+        run.record('asymmetry', research_left_right_asymmetry(player_means, threshold_pct=10.0))
 
-    # 6) Yearly trends
-    _ = yearly_trends(df)
+        # 5) Top loaders and high-distance players
+        top_loaders = research_top_loaders(df, top_n=10)
+        if top_loaders:
+            run.record('top_loaders', pd.concat(top_loaders, names=['metric']).rename('mean').reset_index())
 
-    # 7) Suggest research questions (planned list)
-    suggest_research_questions()
+        # 6) Yearly trends
+        run.record('yearly_trends', yearly_trends(df, cube=refresh_cube()))
 
-    # 8) Run the 5-question branching flow (answers guide next questions)
-    run_question_flow(df, asym_threshold=10.0)
+        # 7) Suggest research questions (planned list)
+        suggest_research_questions()
 
+        # 8) Run the 5-question branching flow (answers guide next questions)
+        run_question_flow(df, asym_threshold=10.0, sessions=sessions)
 
 if __name__ == '__main__':
     main()
@@ -1,30 +1,15 @@
-from sqlalchemy import create_engine
-import pandas as pd
-import os
-from dotenv import load_dotenv
-
-load_dotenv(".env")
+import argparse
 
-DB_HOST = os.getenv('DB_HOST')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_NAME = os.getenv('DB_NAME')
-DB_TABLE = os.getenv('DB_TABLE')
+import pandas as pd
 
-url_string = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:3306/{DB_NAME}"
-conn = create_engine(url_string)
-table = DB_TABLE
+from cohorts import BASKETBALL_TEAMS
+from db import get_engine, table_name
 
-print("="*80)
-print("CHECKING WHAT METRICS EACH TEAM HAS")
-print("="*80)
 
-for team_name in ['Mens Basketball', 'Womens Basketball', "Men's Basketball", "Women's Basketball"]:
-    print(f"\n{team_name}:")
-    print("-" * 60)
-    
+def team_metrics(conn, table, team_name):
+    team_name = team_name.replace("'", "''")
     query = f"""
-    SELECT 
+    SELECT
         metric,
         COUNT(DISTINCT playername) as num_athletes,
         COUNT(*) as num_measurements
@@ -34,18 +19,11 @@ for team_name in ['Mens Basketball', 'Womens Basketball', "Men's Basketball", "W
     GROUP BY metric
     ORDER BY num_athletes DESC
     """
-    
-    result = pd.read_sql(query, conn)
-    if len(result) > 0:
-        print(result.to_string(index=False))
-    else:
-        print("  No data found")
+    return pd.read_sql(query, conn)
 
-print("\n" + "="*80)
-print("ATHLETES IN EACH TEAM (ANY METRIC):")
-print("="*80)
 
-for team_name in ['Mens Basketball', 'Womens Basketball', "Men's Basketball", "Women's Basketball"]:
+def team_athletes(conn, table, team_name):
+    team_name = team_name.replace("'", "''")
     query = f"""
     SELECT COUNT(DISTINCT playername) as count
     FROM {table}
@@ -53,4 +31,38 @@ for team_name in ['Mens Basketball', 'Womens Basketball', "Men's Basketball", "W
       AND value IS NOT NULL
     """
     result = pd.read_sql(query, conn)
-    print(f"{team_name}: {result.iloc[0]['count']} athletes")
\ No newline at end of file
+    return int(result.iloc[0]['count'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check which metrics and athletes each basketball team has.")
+    parser.parse_args(argv)
+
+    conn = get_engine()
+    table = table_name()
+
+    print("="*80)
+    print("CHECKING WHAT METRICS EACH TEAM HAS")
+    print("="*80)
+
+    for team_name in BASKETBALL_TEAMS:
+        print(f"\n{team_name}:")
+        print("-" * 60)
+
+        result = team_metrics(conn, table, team_name)
+        if len(result) > 0:
+            print(result.to_string(index=False))
+        else:
+            print("  No data found")
+
+    print("\n" + "="*80)
+    print("ATHLETES IN EACH TEAM (ANY METRIC):")
+    print("="*80)
+
+    for team_name in BASKETBALL_TEAMS:
+        count = team_athletes(conn, table, team_name)
+        print(f"{team_name}: {count} athletes")
+
+
+if __name__ == '__main__':
+    main()
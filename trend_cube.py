@@ -0,0 +1,157 @@
+"""trend_cube.py
+
+Time-aggregation cube for trend and testing-frequency charts.
+
+The base cube holds count / sum / min / max of `value` per
+(day, team, metric, data_source). Coarser grains (week, month, season,
+year) are rolled up from it, since counts and sums add and min/max combine,
+so a trend or frequency chart never re-runs a groupby over the raw rows.
+Seasons start in August (SEASON_START_MONTH) and are labelled by their
+first year.
+
+The cube is stored in `.trend_cube/` with the table watermark. `refresh`
+aggregates only the rows newer than the stored max timestamp and merges them
+in; if the table changed in any other way it rebuilds.
+
+Usage:
+    from trend_cube import load_cube, slice_cube
+    monthly = slice_cube(load_cube(), 'month', by=['team'])            # tests per month per team
+    yearly = slice_cube(load_cube(), 'year', by=['metric'])['mean']
+
+    python trend_cube.py --grain month --by team --metric accel_load_accum
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from db import get_engine, metrics_where, refresh_plan, table_name
+from profiling import profiled
+
+
+CUBE_DIR = Path(os.getenv('TREND_CUBE_DIR', Path(__file__).resolve().parent / '.trend_cube'))
+DIMS = ['team', 'metric', 'data_source']
+GRAINS = ['day', 'week', 'month', 'season', 'year']
+SEASON_START_MONTH = 8
+
+
+def period_start(day: pd.Series, grain: str) -> pd.Series:
+    """Start date of the `grain` period containing each day."""
+    if grain == 'day':
+        return day
+    if grain == 'week':
+        return day - pd.to_timedelta(day.dt.weekday, unit='D')
+    if grain == 'month':
+        return day.dt.to_period('M').dt.start_time
+    if grain == 'year':
+        return day.dt.to_period('Y').dt.start_time
+    if grain == 'season':
+        year = day.dt.year - (day.dt.month < SEASON_START_MONTH)
+        return pd.to_datetime({'year': year, 'month': SEASON_START_MONTH, 'day': 1})
+    raise ValueError(f"Unknown grain {grain!r} (use one of {GRAINS})")
+
+
+def aggregate(df: pd.DataFrame) -> pd.DataFrame:
+    """Raw rows -> day-level cube."""
+    df = df.dropna(subset=['timestamp', 'value'])
+    day = pd.to_datetime(df['timestamp']).dt.normalize()
+    dims = [d for d in DIMS if d in df.columns]
+    cube = df.assign(day=day).groupby(['day'] + dims, sort=True, dropna=False)['value'].agg(['count', 'sum', 'min', 'max'])
+    return cube.reset_index()
+
+
+def combine(*cubes: pd.DataFrame, keys: list[str] | None = None) -> pd.DataFrame:
+    """Merge partial cubes (or roll a cube up to `keys`)."""
+    keys = keys or ['day'] + [d for d in DIMS if d in cubes[0].columns]
+    cube = pd.concat(cubes, ignore_index=True)
+    return cube.groupby(keys, sort=True, dropna=False).agg(count=('count', 'sum'), sum=('sum', 'sum'),
+                                              min=('min', 'min'), max=('max', 'max')).reset_index()
+
+
+def slice_cube(cube: pd.DataFrame, grain: str = 'month', by: list[str] | None = None,
+               teams: list[str] | None = None, metrics: list[str] | None = None,
+               sources: list[str] | None = None, start=None, end=None) -> pd.DataFrame:
+    """Roll the day cube up to `grain` x `by` (a subset of team/metric/data_source).
+
+    Returns one row per period and group with count, sum, mean, min and max.
+    """
+    mask = pd.Series(True, index=cube.index)
+    for col, allowed in (('team', teams), ('metric', metrics), ('data_source', sources)):
+        if allowed:
+            mask &= cube[col].isin(allowed)
+    if start is not None:
+        mask &= cube['day'] >= pd.Timestamp(start)
+    if end is not None:
+        mask &= cube['day'] <= pd.Timestamp(end)
+    part = cube[mask]
+    by = list(by or [])
+    part = part.assign(period=period_start(part['day'], grain))
+    out = combine(part, keys=['period'] + by)
+    out['mean'] = out['sum'] / out['count']
+    return out[['period'] + by + ['count', 'sum', 'mean', 'min', 'max']]
+
+
+# ============================================================================
+# Storage and incremental refresh
+# ============================================================================
+
+def _sql(table: str, where: str) -> str:
+    return f"SELECT team, metric, data_source, value, timestamp FROM {table} {where}"
+
+
+@profiled('trend_cube.refresh')
+def refresh(engine=None, table: str | None = None, cube_dir: Path = CUBE_DIR, rebuild: bool = False) -> pd.DataFrame:
+    """Bring the stored cube up to date with the table and return it."""
+    engine = engine or get_engine()
+    table = table or table_name()
+    path, meta_path = cube_dir / 'day.feather', cube_dir / 'meta.json'
+    stored = not rebuild and path.exists() and meta_path.exists()
+    meta = json.loads(meta_path.read_text()) if stored else None
+    mark, where, incremental = refresh_plan(engine, table, metrics_where(), meta, 'Trend cube')
+
+    if where is None:
+        return pd.read_feather(path)
+    rows = pd.read_sql(_sql(table, where), engine)
+    if incremental:
+        print(f"Trend cube: merging {len(rows)} new rows after {meta['max_ts']}")
+        cube = combine(pd.read_feather(path), aggregate(rows))
+    else:
+        cube = aggregate(rows)
+    _store(cube, mark, cube_dir)
+    return cube
+
+
+def _store(cube: pd.DataFrame, mark: dict, cube_dir: Path) -> None:
+    cube_dir.mkdir(parents=True, exist_ok=True)
+    cube.to_feather(cube_dir / 'day.feather')
+    (cube_dir / 'meta.json').write_text(json.dumps(mark))
+
+
+def load_cube(cube_dir: Path = CUBE_DIR) -> pd.DataFrame:
+    """The stored cube, refreshed against the database first."""
+    return refresh(cube_dir=cube_dir)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Build/refresh the trend cube and print a slice of it.')
+    parser.add_argument('--grain', choices=GRAINS, default='month')
+    parser.add_argument('--by', action='append', choices=DIMS, help='group by these dimensions')
+    parser.add_argument('--team', action='append', help='only these teams')
+    parser.add_argument('--metric', action='append', help='only these metrics')
+    parser.add_argument('--source', action='append', help='only these data sources')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild from the full table')
+    args = parser.parse_args(argv)
+
+    cube = refresh(rebuild=args.rebuild)
+    print(f"Cube: {len(cube)} day x team x metric x source cells covering {int(cube['count'].sum())} rows")
+    out = slice_cube(cube, args.grain, by=args.by, teams=args.team, metrics=args.metric, sources=args.source)
+    print(out.round({'sum': 3, 'mean': 3, 'min': 3, 'max': 3}).to_string(index=False))
+    return out
+
+
+if __name__ == '__main__':
+    main()